@@ -0,0 +1,125 @@
+"""
+Benchmark looking up and resolving commands with the command index, compared to walking all plugins' commands.
+
+Run from the repository's root directory:
+    python -m benchmarks.bench_command_index [--plugins 30] [--commands 10] [--repeat 5]
+"""
+
+import argparse
+import random
+import string
+from typing import Dict, List
+
+from benchmarks.bench_plugin_data import measure
+from core.command_index import CommandIndex, fuzz
+from core.plugin import PluginCommand
+
+
+def create_commands(plugins: int, commands: int) -> Dict[str, List[PluginCommand]]:
+    """
+    Create the same random commands on every run, every fourth plugin restricts its commands to a room
+    :param plugins: number of plugins
+    :param commands: number of commands per plugin
+    :return: Dict of plugin name and its commands
+    """
+
+    rand: random.Random = random.Random(0)
+    result: Dict[str, List[PluginCommand]] = {}
+    plugin: int
+    for plugin in range(plugins):
+        name: str = f"plugin{plugin}"
+        room_id: List[str] or None = ["!room:example.org"] if plugin % 4 == 0 else None
+        result[name] = [
+            PluginCommand("".join(rand.choices(string.ascii_lowercase, k=rand.randint(3, 12))), lambda: None, "help", 0, room_id, plugin_name=name)
+            for _ in range(commands)
+        ]
+    return result
+
+
+def create_typos(commands: List[str], count: int) -> List[str]:
+    """
+    :param commands: the command-strings to misspell
+    :param count: number of misspelled command-strings to create
+    :return: command-strings with two adjacent characters swapped
+    """
+
+    rand: random.Random = random.Random(1)
+    typos: List[str] = []
+    for _ in range(count):
+        command: str = rand.choice(commands)
+        position: int = rand.randrange(len(command) - 1)
+        typos.append(command[:position] + command[position + 1] + command[position] + command[position + 2 :])
+    return typos
+
+
+def walk_plugins(plugins: Dict[str, List[PluginCommand]], command: str, fuzzy_threshold: int) -> str or None:
+    """
+    Resolve a command-string the way it used to be done: comparing it with every command of every plugin
+    """
+
+    plugin_commands: List[PluginCommand]
+    plugin_command: PluginCommand
+    for plugin_commands in plugins.values():
+        for plugin_command in plugin_commands:
+            if plugin_command.command == command:
+                return command
+
+    best_match: str or None = None
+    best_ratio: int = fuzzy_threshold
+    for plugin_commands in plugins.values():
+        for plugin_command in plugin_commands:
+            ratio: int = fuzz.ratio(command, plugin_command.command)
+            if ratio > best_ratio:
+                best_match = plugin_command.command
+                best_ratio = ratio
+    return best_match
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--plugins", type=int, default=30, help="number of plugins")
+    parser.add_argument("--commands", type=int, default=10, help="number of commands per plugin")
+    parser.add_argument("--lookups", type=int, default=1000, help="number of commands looked up per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs of each measurement, the fastest one is reported")
+    args: argparse.Namespace = parser.parse_args()
+
+    plugins: Dict[str, List[PluginCommand]] = create_commands(args.plugins, args.commands)
+    index: CommandIndex = CommandIndex(cache_size=args.lookups)
+    plugin_commands: List[PluginCommand]
+    plugin_command: PluginCommand
+    for plugin_commands in plugins.values():
+        for plugin_command in plugin_commands:
+            index.add(plugin_command)
+    commands: List[str] = list(index.commands.keys())
+    known: List[str] = random.Random(2).choices(commands, k=args.lookups)
+    typos: List[str] = create_typos(commands, args.lookups)
+    print(f"{len(commands)} commands of {args.plugins} plugins, {args.lookups} lookups, fastest of {args.repeat} runs")
+
+    def resolve_all(names: List[str]) -> None:
+        for name in names:
+            index.resolve(name)
+
+    def clear_cache() -> None:
+        # adding and removing a command invalidates the cache, as loading or unloading a plugin does
+        extra: PluginCommand = PluginCommand("extra", lambda: None, "help", 0, None)
+        index.add(extra)
+        index.remove(extra)
+
+    results: Dict[str, float] = {
+        "exact, walking plugins": measure(lambda: [walk_plugins(plugins, name, index.fuzzy_threshold) for name in known], args.repeat),
+        "exact, index": measure(lambda: resolve_all(known), args.repeat),
+        "room check, index": measure(lambda: [index.is_valid_for_room(name, "!other:example.org") for name in known], args.repeat),
+        "fuzzy, walking plugins": measure(lambda: [walk_plugins(plugins, name, index.fuzzy_threshold) for name in typos], args.repeat),
+        "fuzzy, index uncached": measure(lambda: resolve_all(typos), args.repeat, clear_cache),
+    }
+    resolve_all(typos)
+    results["fuzzy, index cached"] = measure(lambda: resolve_all(typos), args.repeat)
+
+    name: str
+    value: float
+    for name, value in results.items():
+        print(f"{name:24} {value:9.2f} ms  {value * 1000 / args.lookups:9.2f} µs/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark loading and saving plugin data shaped like the quote plugin's, for each data backend and format.
+
+Run from the repository's root directory:
+    python -m benchmarks.bench_plugin_data [--quotes 50000] [--repeat 1]
+"""
+
+import argparse
+import copy
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from core.data_codec import DATA_FORMATS, DataCodec, msgpack
+from core.data_view import create_view, unwrap
+from core.plugin_data import DATA_BACKENDS, PluginDataBackend, create_data_backend
+
+
+class QuoteLine:
+    def __init__(self, message: str, nick: str or None = None, message_type: str = "message"):
+        self.nick: str = nick
+        self.message: str = message
+        self.message_type: str = message_type
+
+
+class Quote:
+    def __init__(self, quote_id: str, lines: List[QuoteLine], date: float, user: str):
+        self.id: str = quote_id
+        self.type: str = "text"
+        self.text: str = "\n".join(line.message for line in lines)
+        self.url: str = ""
+        self.date: float = date
+        self.chan: str = "#channel"
+        self.mxroom: str = "!room:example.org"
+        self.user: str = user
+        self.mxuser: str = f"@{user}:example.org"
+        self.version: int = 3
+        self.lines: List[QuoteLine] = lines
+        self.deleted: bool = False
+        self.rank: int = 0
+        self.reactions: Dict[str, int] = {}
+        self.members: List[str] = []
+
+
+def create_quotes(count: int) -> Dict[str, Quote]:
+    """
+    Create the same random quotes on every run
+    :param count: number of quotes to create
+    :return: Dict of id and quote
+    """
+
+    rand: random.Random = random.Random(0)
+    words: List[str] = [f"word{index}" for index in range(1000)]
+    nicks: List[str] = [f"nick{index}" for index in range(50)]
+    quotes: Dict[str, Quote] = {}
+    quote_id: int
+    for quote_id in range(1, count + 1):
+        lines: List[QuoteLine] = [QuoteLine(" ".join(rand.choices(words, k=rand.randint(3, 20))), rand.choice(nicks)) for _ in range(rand.randint(1, 4))]
+        quote: Quote = Quote(str(quote_id), lines, 1500000000 + quote_id * 60.0, rand.choice(nicks))
+        quote.reactions = {"👍": rand.randint(0, 5)} if rand.random() < 0.3 else {}
+        quotes[quote.id] = quote
+    return quotes
+
+
+def measure(function: Callable[[], Any], repeat: int, setup: Callable[[], Any] or None = None) -> float:
+    """
+    :param function: the function to measure
+    :param repeat: number of runs
+    :param setup: called before each run, not measured
+    :return: the fastest run in milliseconds
+    """
+
+    best: float = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def get_size(store: PluginDataBackend) -> int:
+    """
+    :return: the size of all files of a backend in bytes
+    """
+
+    directory: str = os.path.dirname(store.filename)
+    return sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory))
+
+
+def bench_backend(backend: str, data_format: str, quotes: Dict[str, Quote], repeat: int) -> Dict[str, float]:
+    """
+    Measure saving and loading quotes
+    :param backend: one of DATA_BACKENDS
+    :param data_format: one of DATA_FORMATS
+    :param quotes: the quotes to store
+    :param repeat: number of runs of each measurement
+    :return: Dict of measurement and its result
+    """
+
+    directory: str = tempfile.mkdtemp()
+    basepath: str = os.path.join(directory, "quote")
+
+    def create_codec() -> DataCodec:
+        codec: DataCodec = DataCodec(data_format)
+        codec.register_class(Quote)
+        codec.register_class(QuoteLine)
+        return codec
+
+    def reset() -> None:
+        shutil.rmtree(directory)
+        os.makedirs(directory)
+
+    try:
+        results: Dict[str, float] = {}
+        results["save all ms"] = measure(lambda: create_data_backend(backend, basepath, create_codec()).write({"quotes": quotes}), repeat, reset)
+
+        store: PluginDataBackend = create_data_backend(backend, basepath, create_codec())
+        store.load()
+        results["save unchanged ms"] = measure(lambda: store.write({"quotes": quotes}), repeat)
+
+        changed: Quote = quotes["1"]
+
+        def save_changed() -> None:
+            changed.rank += 1
+            store.store("quotes", quotes, {changed.id})
+
+        results["save one ms"] = measure(save_changed, repeat)
+        store.close()
+
+        results["load ms"] = measure(lambda: create_data_backend(backend, basepath, create_codec()).load(), repeat)
+        results["size KiB"] = get_size(store) / 1024
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_read(quotes: Dict[str, Quote], repeat: int) -> Dict[str, float]:
+    """
+    Measure reading quotes and modifying one of them as read_data() does, by copy-on-write view or deep copy
+    :param quotes: the stored quotes
+    :param repeat: number of runs of each measurement
+    :return: Dict of measurement and its result
+    """
+
+    def modify(data: Dict[str, Quote]) -> Dict[str, Quote]:
+        data["1"].rank += 1
+        data["1"].members.append("@user:example.org")
+        return data
+
+    return {
+        "view ms": measure(lambda: unwrap(modify(create_view(quotes))), repeat),
+        "deepcopy ms": measure(lambda: modify(copy.deepcopy(quotes)), repeat),
+    }
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quotes", type=int, default=50000, help="number of quotes to store")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs of each measurement, the fastest one is reported")
+    parser.add_argument("--backends", nargs="+", choices=DATA_BACKENDS.keys(), default=list(DATA_BACKENDS.keys()))
+    parser.add_argument(
+        "--formats", nargs="+", choices=DATA_FORMATS, default=[data_format for data_format in DATA_FORMATS if data_format != "msgpack" or msgpack]
+    )
+    args: argparse.Namespace = parser.parse_args()
+
+    quotes: Dict[str, Quote] = create_quotes(args.quotes)
+    print(f"{args.quotes} quotes, fastest of {args.repeat} runs")
+
+    backend: str
+    data_format: str
+    for backend in args.backends:
+        for data_format in args.formats:
+            results: Dict[str, float] = bench_backend(backend, data_format, quotes, args.repeat)
+            print(f"{backend:8} {data_format:10} " + "  ".join(f"{name} {value:9.1f}" for name, value in results.items()))
+
+    print("read_data " + "  ".join(f"{name} {value:9.1f}" for name, value in bench_read(quotes, args.repeat).items()))
+
+
+if __name__ == "__main__":
+    main()
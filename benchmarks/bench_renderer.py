@@ -0,0 +1,93 @@
+"""
+Benchmark rendering messages shaped like the plugins' from markdown to HTML, for each installed renderer, and converting them to plain text.
+
+Run from the repository's root directory:
+    python -m benchmarks.bench_renderer [--rows 300] [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+from typing import Dict, List
+
+from benchmarks.bench_plugin_data import measure
+from core.chat_functions import strip_tags
+from core.renderer import RENDERERS, MarkdownRenderer, cmarkgfm
+
+GOLDEN_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "golden", "renderer")
+
+
+def read_short_replies() -> List[str]:
+    """
+    :return: the short replies of the renderer's golden tests
+    """
+
+    replies: List[str] = []
+    name: str
+    for name in ("meter", "dates_birthday", "help_plugin", "quote_display", "cashup"):
+        with open(os.path.join(GOLDEN_DIR, f"{name}.md"), encoding="utf-8", newline="") as file:
+            replies.append(file.read())
+    return replies
+
+
+def create_table(rows: int) -> str:
+    """
+    Create the same HTML table of series on every run, as sonarr's print_series sends it
+    :param rows: number of series
+    :return: the message
+    """
+
+    rand: random.Random = random.Random(0)
+    message: str = "<table><tr>" + "".join(f"<td><b>{col}</b></td>" for col in ("Title", "Seasons", "Episodes on Disk", "Size", "Status", "Rating")) + "</tr>"
+    row: int
+    for row in range(rows):
+        cols: List[str] = [
+            f'<a href="https://www.imdb.com/title/tt{rand.randint(100000, 9999999)}">Series {row}</a>',
+            str(rand.randint(1, 30)),
+            str(rand.randint(0, 600)),
+            f"{rand.uniform(0, 1024):.1f} GiB",
+            rand.choice(("continuing", "ended")),
+            f"{rand.uniform(1, 10):.1f}",
+        ]
+        message += "<tr>" + "".join(f"<td>{col}</td>" for col in cols) + "</tr>"
+    return message + "</table>"
+
+
+def create_list(rows: int) -> str:
+    """
+    Create the same markdown list of quotes on every run, as quote's stats and search results send them
+    :param rows: number of lines
+    :return: the message
+    """
+
+    rand: random.Random = random.Random(1)
+    return "".join(f"**{rand.randint(1, 20000)}** (*nick{rand.randint(0, 50)}*): some quoted text, `{row}` times  \n" for row in range(rows))
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300, help="number of rows of long tables and lists")
+    parser.add_argument("--repeat", type=int, default=20, help="number of runs of each measurement, the fastest one is reported")
+    parser.add_argument("--renderers", nargs="+", choices=RENDERERS.keys(), default=[name for name in RENDERERS.keys() if name != "cmarkgfm" or cmarkgfm])
+    args: argparse.Namespace = parser.parse_args()
+
+    messages: Dict[str, List[str]] = {
+        "short replies": read_short_replies(),
+        f"{args.rows}-row table": [create_table(args.rows)],
+        f"{args.rows}-line list": [create_list(args.rows)],
+    }
+    print(f"fastest of {args.repeat} runs, ms per message")
+
+    name: str
+    results: Dict[str, float]
+    for name in args.renderers:
+        renderer: MarkdownRenderer = RENDERERS[name]()
+        results = {kind: measure(lambda: [renderer.render(message) for message in texts], args.repeat) / len(texts) for kind, texts in messages.items()}
+        print(f"{name:12} " + "  ".join(f"{kind} {value:8.3f}" for kind, value in results.items()))
+
+    results = {kind: measure(lambda: [strip_tags(message) for message in texts], args.repeat) / len(texts) for kind, texts in messages.items()}
+    print(f"{'strip_tags':12} " + "  ".join(f"{kind} {value:8.3f}" for kind, value in results.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Set
+
+from core.data_codec import DataCodec
+from core.persistence import write_file_atomic
+from core.plugin_data import join_entries
+
+logger = logging.getLogger(__name__)
+
+BACKUP_FILENAME = re.compile(r"^(?P<backup_id>\d{8}-\d{6}-\d{6})\.(?P<kind>full|delta-(?P<base_id>\d{8}-\d{6}-\d{6}))\.json\.gz$")
+BACKUP_ID_FORMAT = "%Y%m%d-%H%M%S-%f"
+
+
+class Backup:
+    def __init__(self, backup_id: str, base_id: str or None, filename: str, size: int):
+        """
+        A backup of a plugin's data
+        :param backup_id: id of the backup, the time it has been created at
+        :param base_id: id of the full backup an incremental backup is based on, None for full backups
+        :param filename: the file the backup is stored in
+        :param size: size of the file in bytes
+        """
+
+        self.backup_id: str = backup_id
+        self.base_id: str or None = base_id
+        self.filename: str = filename
+        self.size: int = size
+        self.timestamp: datetime.datetime = datetime.datetime.strptime(backup_id, BACKUP_ID_FORMAT)
+
+    def is_full(self) -> bool:
+        """
+        :return:    True, if this is a full backup
+                    False, if this is an incremental backup
+        """
+
+        return self.base_id is None
+
+
+class PluginBackups:
+    def __init__(self, directory: str, codec: DataCodec, keep_recent: int = 10, keep_hourly: int = 24, keep_daily: int = 7):
+        """
+        Compressed backups of a plugin's data.
+        Full backups contain all entries of the data, incremental backups only the entries that differ from the latest full backup. A new full
+        backup is created once the latest one is older than a day or an incremental backup would be larger than half of it.
+        After each backup, only the keep_recent latest backups and the latest backup of each of the last keep_hourly hours and keep_daily days
+        are kept (plus the full backups these are based on).
+        All methods are blocking and are meant to be run in a thread.
+        :param directory: the directory to store the backups in
+        :param codec: the codec to encode the data with
+        :param keep_recent: number of latest backups to keep
+        :param keep_hourly: number of hours to keep the latest backup of
+        :param keep_daily: number of days to keep the latest backup of
+        """
+
+        self.directory: str = directory
+        self.codec: DataCodec = codec
+        self.keep_recent: int = keep_recent
+        self.keep_hourly: int = keep_hourly
+        self.keep_daily: int = keep_daily
+        self.full_interval: datetime.timedelta = datetime.timedelta(days=1)
+
+    def configure(self, keep_recent: int, keep_hourly: int, keep_daily: int) -> None:
+        """
+        Apply the bot's configuration
+        :param keep_recent: number of latest backups to keep
+        :param keep_hourly: number of hours to keep the latest backup of
+        :param keep_daily: number of days to keep the latest backup of
+        :return:
+        """
+
+        self.keep_recent = keep_recent
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+
+    def list(self) -> List[Backup]:
+        """
+        :return: all existing backups, oldest first
+        """
+
+        if not os.path.isdir(self.directory):
+            return []
+
+        backups: List[Backup] = []
+        filename: str
+        for filename in os.listdir(self.directory):
+            match = BACKUP_FILENAME.match(filename)
+            if match:
+                path: str = os.path.join(self.directory, filename)
+                backups.append(Backup(match.group("backup_id"), match.group("base_id"), path, os.path.getsize(path)))
+
+        return sorted(backups, key=lambda backup: backup.backup_id)
+
+    def get(self, backup_id: str) -> Backup or None:
+        """
+        :param backup_id: id of the backup
+        :return: the backup, None if it does not exist
+        """
+
+        backup: Backup
+        for backup in self.list():
+            if backup.backup_id == backup_id:
+                return backup
+        return None
+
+    @staticmethod
+    def __read_file(filename: str) -> Dict[str, Any]:
+        with gzip.open(filename, "rt", encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def __diff(
+        base_kinds: Dict[str, str], base_entries: Dict[str, Dict[str, str]], kinds: Dict[str, str], entries: Dict[str, Dict[str, str]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Determine the changes between the entries of a full backup and the current entries
+        :return: Dict of name and its changes in the form of {"kind": str or None, "changed": {entry: encoded}, "removed": [entry]}
+        """
+
+        changes: Dict[str, Dict[str, Any]] = {}
+        name: str
+        for name in base_kinds.keys():
+            if name not in kinds:
+                changes[name] = {"kind": None, "changed": {}, "removed": []}
+
+        kind: str
+        for name, kind in kinds.items():
+            # entries of a different kind are all replaced
+            stored_entries: Dict[str, str] = base_entries.get(name, {}) if base_kinds.get(name) == kind else {}
+            changed: Dict[str, str] = {entry: encoded for entry, encoded in entries[name].items() if stored_entries.get(entry) != encoded}
+            removed: List[str] = [entry for entry in stored_entries.keys() if entry not in entries[name]]
+            if changed or removed or base_kinds.get(name) != kind:
+                changes[name] = {"kind": kind, "changed": changed, "removed": removed}
+
+        return changes
+
+    def create(self, kinds: Dict[str, str], entries: Dict[str, Dict[str, str]]) -> Backup:
+        """
+        Create a backup of the given entries and remove outdated backups
+        :param kinds: kind of each stored name, as returned by PluginDataBackend.snapshot()
+        :param entries: encoded entries of each stored name, as returned by PluginDataBackend.snapshot()
+        :return: the created backup
+        """
+
+        backup_id: str = datetime.datetime.now().strftime(BACKUP_ID_FORMAT)
+        content: Dict[str, Any] = {"kinds": kinds, "entries": entries}
+        kind: str = "full"
+
+        full_backups: List[Backup] = [backup for backup in self.list() if backup.is_full()]
+        if full_backups and datetime.datetime.now() - full_backups[-1].timestamp < self.full_interval:
+            base: Backup = full_backups[-1]
+            base_content: Dict[str, Any] = self.__read_file(base.filename)
+            changes: Dict[str, Dict[str, Any]] = self.__diff(base_content["kinds"], base_content["entries"], kinds, entries)
+            full_size: int = sum(len(encoded) for name_entries in entries.values() for encoded in name_entries.values())
+            changes_size: int = sum(len(encoded) for change in changes.values() for encoded in change["changed"].values())
+            if changes_size * 2 < full_size:
+                content = {"base": base.backup_id, "changes": changes}
+                kind = f"delta-{base.backup_id}"
+
+        os.makedirs(self.directory, exist_ok=True)
+        filename: str = os.path.join(self.directory, f"{backup_id}.{kind}.json.gz")
+        write_file_atomic(filename, gzip.compress(json.dumps(content).encode("utf-8")))
+        self.prune()
+
+        return Backup(backup_id, content.get("base"), filename, os.path.getsize(filename))
+
+    def read(self, backup_id: str) -> Dict[str, Any]:
+        """
+        Read the data stored in a backup
+        :param backup_id: id of the backup
+        :return: the data stored in the backup
+        :raises FileNotFoundError: if the backup (or the full backup it is based on) does not exist
+        """
+
+        backup: Backup or None = self.get(backup_id)
+        if backup is None:
+            raise FileNotFoundError(f"Backup {backup_id} does not exist")
+
+        content: Dict[str, Any]
+        if backup.is_full():
+            content = self.__read_file(backup.filename)
+        else:
+            base: Backup or None = self.get(backup.base_id)
+            if base is None:
+                raise FileNotFoundError(f"Backup {backup.base_id}, which backup {backup_id} is based on, does not exist")
+            content = self.__read_file(base.filename)
+
+            name: str
+            change: Dict[str, Any]
+            for name, change in self.__read_file(backup.filename)["changes"].items():
+                if change["kind"] is None:
+                    content["kinds"].pop(name, None)
+                    content["entries"].pop(name, None)
+                    continue
+                if change["kind"] != content["kinds"].get(name):
+                    content["entries"][name] = {}
+                content["kinds"][name] = change["kind"]
+                content["entries"][name].update(change["changed"])
+                entry: str
+                for entry in change["removed"]:
+                    content["entries"][name].pop(entry, None)
+
+        return {name: join_entries(self.codec, kind, content["entries"][name]) for name, kind in content["kinds"].items()}
+
+    def prune(self) -> List[Backup]:
+        """
+        Remove all backups that are not needed to keep the keep_recent latest backups and the latest backup of each of the last keep_hourly hours
+        and keep_daily days
+        :return: the removed backups
+        """
+
+        backups: List[Backup] = self.list()
+        if not backups:
+            return []
+
+        latest_hourly: Dict[str, Backup] = {}
+        latest_daily: Dict[str, Backup] = {}
+        backup: Backup
+        for backup in backups:
+            # backups are sorted, so the latest backup of each hour and day remains
+            latest_hourly[backup.timestamp.strftime("%Y%m%d%H")] = backup
+            latest_daily[backup.timestamp.strftime("%Y%m%d")] = backup
+
+        keep: Set[str] = {backup.backup_id for backup in backups[-max(self.keep_recent, 1) :]}
+        if self.keep_hourly > 0:
+            keep.update(backup.backup_id for backup in list(latest_hourly.values())[-self.keep_hourly :])
+        if self.keep_daily > 0:
+            keep.update(backup.backup_id for backup in list(latest_daily.values())[-self.keep_daily :])
+        keep.update([backup.base_id for backup in backups if backup.backup_id in keep and not backup.is_full()])
+
+        removed: List[Backup] = []
+        for backup in backups:
+            if backup.backup_id not in keep:
+                try:
+                    os.remove(backup.filename)
+                    removed.append(backup)
+                except OSError as err:
+                    logger.warning(f"Could not remove outdated backup {backup.filename}: {err}")
+
+        return removed
@@ -1,10 +1,12 @@
+from functools import partial
 from typing import List
 
 from core.bot_commands import Command
-from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMessageText
+from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMemberEvent, RoomMessageText
 
 import logging
 
+from core.member_directory import member_directory
 from core.pluginloader import PluginLoader
 
 logger = logging.getLogger(__name__)
@@ -63,10 +65,11 @@ class Callbacks(object):
                 line = line.lstrip()
                 if line != "":
                     command = Command(self.client, self.store, self.config, line, room, event, self.plugin_loader)
-                    await self.plugin_loader.run_command(command)
+                    # run commands outside of the sync callback, in order per room
+                    self.plugin_loader.dispatcher.submit(room.room_id, partial(self.plugin_loader.run_command, command))
 
         else:
-            # no commands found, pass the message to the hooks
+            # no commands found, pass the message to the hooks, which run in the background
             await self.plugin_loader.run_hooks(self.client, "m.room.message", room, event)
 
     async def event_unknown(self, room: MatrixRoom, event: UnknownEvent):
@@ -84,6 +87,20 @@ class Callbacks(object):
         if event.type == "m.reaction":
             await self.plugin_loader.run_hooks(self.client, event.type, room, event)
 
+    async def member(self, room: MatrixRoom, event: RoomMemberEvent):
+        """
+        Keeps the member directory up to date with membership changes
+        :param room: nio.rooms.MatrixRoom: the room the event came from
+        :param event: nio.events.room_events.RoomMemberEvent: the membership change
+        :return:
+        """
+
+        if event.state_key == self.client.user and event.membership != "join":
+            # the bot left the room, its members are not of interest anymore
+            member_directory.invalidate(room.room_id)
+        else:
+            member_directory.update(room.room_id, event)
+
     async def invite(self, room: MatrixRoom, event: InviteEvent):
         """Callback for when an invite is received. Join the room specified in the invite"""
         logger.info(f"Got invite to {room.room_id} from {event.sender}.")
@@ -1,49 +1,125 @@
+import asyncio
+import hashlib
+import io
 import logging
-import math
-import os
-from asyncio import sleep
-from io import StringIO
-from html.parser import HTMLParser
-from typing import Union, Optional
-
-import aiofiles.os
+import re
+from functools import lru_cache
+from html import unescape
+from typing import Any, Dict, List, Optional, Tuple, Union
+
 from PIL import Image
-import uuid
 import blurhash
 
 from nio import SendRetryError, RoomSendResponse, Event, RoomGetEventResponse, RoomGetEventError, UploadResponse, AsyncClient, RoomSendError
-import commonmark
+from core.media_cache import CachedMedia, media_cache
+from core.outbound import outbound_queue
+from core.renderer import MarkdownRenderer, create_renderer
+from core.sent_events import SentEvent, sent_event_cache
 
 logger = logging.getLogger(__name__)
 
 
-class MLStripper(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.reset()
-        self.strict = False
-        self.convert_charrefs = True
-        self.text = StringIO()
+IMAGE_MIME_TYPES: Dict[str, str] = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+"""formats of images that are uploaded as they are, and their mime types"""
+
+BLURHASH_THUMBNAIL_SIZE: Tuple[int, int] = (64, 64)
+"""maximum size of the thumbnail blurhashes are calculated from"""
+
+HTML_MARKUP = re.compile(r"""<!--.*?(?:-->|\Z)|<[!?][^<>]*>|</?[a-zA-Z][^\s/<>]*(?:[\s/](?:[^<>"']|"[^"]*"|'[^']*')*)?>""", re.DOTALL)
+"""
+comments (an unclosed one removes the rest of the text), declarations and start- and end-tags (including attributes, which may contain > when
+quoted). Unquoted parts of a tag must not contain <, so matching an unclosed tag stops at the next one, instead of rescanning the rest of
+the text from every unclosed tag (quadratic on e.g. long runs of "<a").
+"""
+
+
+def strip_tags(html: str) -> str:
+    """
+    Convert HTML to plain text by removing all markup and unescaping character references
+    :param html: (str) the HTML (or markdown, which may contain HTML)
+    :return: (str) the plain text
+    """
+
+    # most messages are plain markdown without any markup
+    if "<" not in html and "&" not in html:
+        return html
+    return unescape(HTML_MARKUP.sub("", html))
+
+
+markdown_renderer: MarkdownRenderer = create_renderer("commonmark")
+"""the renderer used to convert messages from markdown to HTML"""
+
+
+def set_markdown_renderer(name: str) -> None:
+    """
+    Set the renderer used to convert messages from markdown to HTML
+    :param name: (str) name of the renderer, one of core.renderer.RENDERERS
+    :return:
+    """
+
+    global markdown_renderer
+    markdown_renderer = create_renderer(name)
+    render_markdown.cache_clear()
+    render_message.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def render_markdown(message: str) -> str:
+    """
+    Render markdown to HTML. Results are cached, as the same texts (e.g. help texts or table headers) are often sent repeatedly.
+    :param message: (str) the markdown to render
+    :return: (str) the rendered HTML
+    """
 
-    def handle_data(self, d):
-        self.text.write(d)
+    return markdown_renderer.render(message)
 
-    def get_data(self):
-        return self.text.getvalue()
 
+@lru_cache(maxsize=1024)
+def render_message(message: str, markdown_convert: bool = True) -> Tuple[str, str]:
+    """
+    Render a message once into its plain text and HTML forms. Results are cached.
+    :param message: (str) the message
+    :param markdown_convert: (bool) Whether to convert the message from markdown to HTML, otherwise it is expected to be HTML already
+    :return: (str, str) the message as plain text and as HTML
+    """
+
+    return strip_tags(message), render_markdown(message) if markdown_convert else message
+
+
+def build_message_content(message: str, msgtype: str = "m.text", markdown_convert: bool = True) -> Dict[str, Any]:
+    """
+    Build the content of a message event, containing the rendered message in all fields expected by clients
+    :param message: (str) the message
+    :param msgtype: (str) the msgtype of the message, e.g. "m.text" or "m.notice"
+    :param markdown_convert: (bool) Whether to convert the message from markdown to HTML, otherwise it is expected to be HTML already
+    :return: (dict) the content
+    """
 
-def strip_tags(html):
-    s = MLStripper()
-    s.feed(html)
-    return s.get_data()
+    body, formatted_body = render_message(message, markdown_convert)
+    return {
+        "msgtype": msgtype,
+        # legacy format
+        "body": body,
+        "format": "org.matrix.custom.html",
+        "formatted_body": formatted_body,
+        # MSC1767
+        "m.message": [{"mimetype": "text/plain", "body": body}, {"mimetype": "text/html", "body": formatted_body}],
+    }
 
 
 async def room_send(
-    client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: Optional[str] = None, ignore_unverified_devices: bool = False
-) -> RoomSendResponse:
+    client: AsyncClient,
+    room_id: str,
+    message_type: str,
+    content: dict,
+    tx_id: Optional[str] = None,
+    ignore_unverified_devices: bool = False,
+    priority: Optional[int] = None,
+) -> RoomSendResponse or RoomSendError:
     """
-    Small wrapper function for client.room_send that implements a simple rate-limit. If more than 8 events are being sent in less than two seconds,
-    all future events are being queued up and sent every two seconds until the queue has cooled down again (e.g. no events sent for more than two seconds)
+    Small wrapper function for client.room_send that sends events through the rate-limited outbound queue. Events are limited per room and in
+    total (by default to 8 events per 2 seconds per room), events of higher priority are sent first. Rate limits reported by the homeserver are
+    retried with the same transaction id in the background, the caller only waits for the result.
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) The room id of the room where the message should be sent to.
     :param message_type: (str) A string identifying the type of the message.
@@ -51,34 +127,18 @@ async def room_send(
     :param tx_id: (str) The transaction ID of this event used to uniquely identify this message.
     :param ignore_unverified_devices: (bool) If the room is encrypted and contains unverified devices, the devices can be marked as ignored here. Ignored
     devices will still receive encryption keys for messages but they won't be marked as verified.
-    :return: RoomSendResponse
-    """
-
-    send_retries: int = 0
-    max_retries: int = 3
-    send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
-    while isinstance(send_response, RoomSendError) and send_retries <= max_retries:
-        if send_response.status_code == "M_LIMIT_EXCEEDED":
-            # we're being rate-limited, try again after the given time
-            send_retries += 1
-            logger.warning(
-                f"Ratelimit hit with {message_type} to {room_id}! Server is asking us to wait {send_response.retry_after_ms}ms. "
-                f"Sending again in {math.ceil(send_response.retry_after_ms/1000)}s (Retry: {send_retries}/{max_retries})."
-            )
-            await sleep(math.ceil(send_response.retry_after_ms / 1000))
-            send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
-
-        else:
-            # unknown error, just try again after three seconds
-            send_retries += 1
-            logger.warning(f"Unknown error sending {message_type} to {room_id}. Retrying in 3 sec ({send_retries}/{max_retries}).")
-            await sleep(3)
-            send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
+    :param priority: (int) PRIORITY_REPLY, PRIORITY_BROADCAST or PRIORITY_REACTION (see core.outbound), defaults to the priority of the current
+    context, e.g. PRIORITY_BROADCAST for timers
+    :return: RoomSendResponse, RoomSendError if the message could not be sent
+    """
 
-    if send_retries > max_retries:
-        # log message if it could not be sent
-        logger.warning(f"Could not send {message_type} to {room_id} after {send_retries} retries. Giving up. Message {content.get('body')} is lost!")
-    return send_response
+    response: RoomSendResponse or RoomSendError = await outbound_queue.send(
+        client, room_id, message_type, content, tx_id, ignore_unverified_devices, priority=priority
+    )
+    # remember what the bot sent, so edits can be compared against it without fetching the event again
+    if message_type == "m.room.message" and isinstance(response, RoomSendResponse):
+        sent_event_cache.put_content(response.event_id, content)
+    return response
 
 
 async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=True, markdown_convert=True) -> RoomSendResponse or None:
@@ -95,21 +155,7 @@ async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=T
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
 
-    if markdown_convert:
-        formatted_message: str = commonmark.commonmark(message)
-    else:
-        formatted_message: str = message
-
-    content = {
-        "msgtype": msgtype,
-        # legacy format
-        "body": strip_tags(message),
-        "format": "org.matrix.custom.html",
-        "formatted_body": formatted_message,
-        # MSC1767
-        "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)},
-                      {"mimetype": "text/html", "body": formatted_message}],
-    }
+    content = build_message_content(message, msgtype, markdown_convert)
 
     response: RoomSendResponse
 
@@ -121,14 +167,14 @@ async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=T
         return None
 
 
-async def send_reaction(client, room_id, event_id: str, reaction: str):
+async def send_reaction(client, room_id, event_id: str, reaction: str) -> RoomSendResponse or RoomSendError:
     """
     Send a reaction to a specific event
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) room_id to send the reaction to (is this actually being used?)
     :param event_id: (str) event_id to react to
     :param reaction: (str) the reaction to send
-    :return:
+    :return: RoomSendResponse, RoomSendError if the reaction could not be sent
     """
 
     content = {
@@ -139,111 +185,205 @@ async def send_reaction(client, room_id, event_id: str, reaction: str):
         }
     }
 
-    await room_send(client, room_id, "m.reaction", content, ignore_unverified_devices=True)
+    return await room_send(client, room_id, "m.reaction", content, ignore_unverified_devices=True)
+
+
+async def send_reactions(client, room_id: str, event_id: str, reactions: List[str]) -> Dict[str, RoomSendResponse or RoomSendError or None]:
+    """
+    Send several reactions to a specific event at once. The reactions are queued together and sent concurrently, so sending them does not take
+    one round trip per reaction.
+    :param client: (nio.AsyncClient) The client to communicate to matrix with
+    :param room_id: (str) room_id to send the reactions to
+    :param event_id: (str) event_id to react to
+    :param reactions: (list) the reactions to send, duplicates are only sent once
+    :return: (dict) the result of sending each reaction by reaction, None if sending it raised an exception
+    """
+
+    reactions = list(dict.fromkeys(reactions))
+    results: List[RoomSendResponse or RoomSendError or BaseException] = await asyncio.gather(
+        *[send_reaction(client, room_id, event_id, reaction) for reaction in reactions], return_exceptions=True
+    )
+
+    responses: Dict[str, RoomSendResponse or RoomSendError or None] = {}
+    response: RoomSendResponse or RoomSendError or BaseException
+    for reaction, response in zip(reactions, results):
+        if isinstance(response, BaseException):
+            logger.warning(f"Failed to send reaction {reaction} to {event_id} in {room_id}: {response}")
+            response = None
+        responses[reaction] = response
+    return responses
 
 
-async def send_replace(client, room_id: str, event_id: str, message: str, message_type: str = "m.text") -> str or None:
+async def fetch_latest_content(client: AsyncClient, room_id: str, event: Event) -> Tuple[Dict[str, Any] or None, bool]:
+    """
+    Determine the current content of a message fetched from the server, i.e. the content of its latest edit. The server reports the latest
+    edit along with the original event, either completely or (on older servers) by its event_id only, which is fetched then.
+    :param client: (nio.AsyncClient) The client to communicate to matrix with
+    :param room_id: (str) the room the message has been sent to
+    :param event: (nio.Event) the original message
+    :return: (dict, bool)   the content of the latest edit and True, if the message has been edited,
+                            the original content and False, if no edit has been reported (the server might just not report edits),
+                            None and False, if the latest edit could not be fetched
+    """
+
+    edit: Dict[str, Any] or None = ((event.source.get("unsigned") or {}).get("m.relations") or {}).get("m.replace")
+    if not edit:
+        return event.source["content"], False
+
+    edit_content: Dict[str, Any] or None = edit.get("content")
+    if edit_content is None:
+        try:
+            edit_response: Union[RoomGetEventResponse, RoomGetEventError] = await client.room_get_event(room_id, edit["event_id"])
+            edit_content = edit_response.event.source["content"]
+        except Exception:
+            return None, False
+
+    new_content: Dict[str, Any] or None = edit_content.get("m.new_content") if isinstance(edit_content, dict) else None
+    if not isinstance(new_content, dict) or not isinstance(new_content.get("body"), str):
+        return None, False
+    return new_content, True
+
+
+async def send_replace(
+    client, room_id: str, event_id: str, message: str, message_type: str = "m.text", markdown_convert: bool = True
+) -> str or None:
     """
     Send a replacement message (edit a previous message).
-    Gets the event from the server first and compares old content against new content. Only if the content differs, will the m.replace event be sent
+    Compares the current content of the event against the new content. Only if the content differs, will the m.replace event be sent.
+    The current content of events sent by the bot is looked up locally, other events are fetched from the server along with their latest edit.
+    If the latest edit cannot be determined, the m.replace event is sent regardless.
     :param message_type:
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) room_id to send the edit to
     :param event_id: (str) event_id to react to
     :param message: (str) the new message body
+    :param markdown_convert: (bool) Whether to convert the message content to markdown.
     :return:    (str) the event-id of the new room-event, if the original event has been replaced or
                 None, if the event has not been edited
     """
 
-    try:
-        original_response: Union[RoomGetEventResponse, RoomGetEventError] = await client.room_get_event(room_id, event_id)
-        original_event: Event = original_response.event
-        original_content = original_event.source["content"]
-    except Exception:
-        return None
-
-    if isinstance(original_response, RoomGetEventResponse) and original_content != {}:
-
-        new_content = {
-            "m.new_content": {
-                "msgtype": message_type,
-                "format": "org.matrix.custom.html",
-                "body": strip_tags(message),
-                "formatted_body": commonmark.commonmark(message),
-                "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)},
-                              {"mimetype": "text/html", "body": commonmark.commonmark(message)}],
-            },
-            "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
-            "msgtype": "m.text",
-            "format": "org.matrix.custom.html",
-            "body": strip_tags(message),
-            "formatted_body": commonmark.commonmark(message),
-            "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)},
-                          {"mimetype": "text/html", "body": commonmark.commonmark(message)}],
-        }
+    original: SentEvent or None = sent_event_cache.get(event_id)
+    if original is None:
+        try:
+            original_response: Union[RoomGetEventResponse, RoomGetEventError] = await client.room_get_event(room_id, event_id)
+            original_event: Event = original_response.event
+            original_content = original_event.source["content"]
+        except Exception:
+            return None
 
-        # check if there are any differences in body or formatted_body before actually sending the m.replace-event
-        if new_content["body"] != original_content["body"] or new_content["formatted_body"] != original_content["formatted_body"]:
-            return await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
-        else:
+        if not isinstance(original_response, RoomGetEventResponse) or original_content == {}:
             return None
+
+        current_content, is_latest = await fetch_latest_content(client, room_id, original_event)
+        if current_content is not None:
+            original = SentEvent(current_content.get("body"), current_content.get("formatted_body"))
+        if is_latest:
+            # remember the content of the latest edit, so editing the message again does not fetch it again
+            sent_event_cache.put_content(event_id, current_content)
+
+    new_content = build_message_content(message, "m.text", markdown_convert)
+    new_content["m.new_content"] = build_message_content(message, message_type, markdown_convert)
+    new_content["m.relates_to"] = {"rel_type": "m.replace", "event_id": event_id}
+
+    # check if there are any differences in body or formatted_body before actually sending the m.replace-event
+    if original is None or new_content["body"] != original.body or new_content["formatted_body"] != original.formatted_body:
+        return await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
     else:
         return None
 
 
-async def send_image(client: AsyncClient, room_id: str, image: Image.Image) -> str or None:
+def encode_image(image: Image.Image or bytes) -> Tuple[bytes, str, str]:
     """
-    Uploads the given Image-Object to the matrix-server and sends a new message including the image.
-    :param client:
-    :param room_id:
-    :param image:
-    :return:     (str) the event-id of the new room-event
-                None if sending image or message failed
+    Encode an image for uploading. Encoded images of a format supported by clients are passed through unchanged, everything else is encoded
+    as PNG in memory.
+    Blocking, meant to be run in a thread.
+    :param image: a PIL image or an encoded image
+    :return: the encoded image, its mime type and the hash of its content
     """
 
-    # temporarily save the image to a file
-    temp_filename: str = f"{uuid.uuid4().hex}.png"
-    try:
-        image.save(temp_filename, "PNG")
-    except OSError:
-        return None
+    data: bytes or None = None
+    mime_type: str or None = None
+    if isinstance(image, bytes):
+        # only reads the header
+        mime_type = IMAGE_MIME_TYPES.get(Image.open(io.BytesIO(image)).format)
+        if mime_type is not None:
+            data = image
+        else:
+            image = Image.open(io.BytesIO(image))
+
+    if data is None:
+        buffer: io.BytesIO = io.BytesIO()
+        image.save(buffer, "PNG")
+        data = buffer.getvalue()
+        mime_type = "image/png"
+
+    return data, mime_type, hashlib.sha256(data).hexdigest()
 
+
+def describe_image(data: bytes) -> Tuple[int, int, str]:
+    """
+    Determine the dimensions and blurhash of an encoded image. The blurhash is calculated from a thumbnail of the image.
+    Blocking, meant to be run in a thread.
+    :param data: the encoded image
+    :return: width, height and blurhash of the image
+    """
+
+    image: Image.Image = Image.open(io.BytesIO(data))
     (width, height) = image.size  # image.size returns (width,height) tuple
-    mime_type: str = "image/png"
+    image.thumbnail(BLURHASH_THUMBNAIL_SIZE)
+    return width, height, blurhash.encode(image, x_components=4, y_components=3)
+
 
-    # first do an upload of image, then send URI of upload to room
-    file_stat = await aiofiles.os.stat(temp_filename)
-    image_hash = blurhash.encode(temp_filename, x_components=4, y_components=3)
+async def send_image(client: AsyncClient, room_id: str, image: Image.Image or bytes) -> RoomSendResponse or RoomSendError or None:
+    """
+    Uploads the given image to the matrix-server and sends a new message including the image.
+    The image is uploaded from memory, encoded images (e.g. fetched from a url) are uploaded as they are. Images uploaded before are not
+    uploaded again, but looked up in the media cache by the hash of their content.
+    :param client:
+    :param room_id:
+    :param image: a PIL image or an encoded image (PNG, JPEG, GIF or WEBP)
+    :return:     the response of sending the message
+                None if preparing or uploading the image failed
+    """
 
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
     try:
-        async with aiofiles.open(temp_filename, "r+b") as f:
-            resp, maybe_keys = await client.upload(
-                f,
-                content_type=mime_type,
-                filename=os.path.basename(temp_filename),
-                filesize=file_stat.st_size,
-            )
-        os.remove(temp_filename)
-    except OSError:
-        logger.warning(f"Failed to remove temporary image file {temp_filename}")
-
-    if isinstance(resp, UploadResponse):
-        content = {
-            "body": os.path.basename(temp_filename),  # descriptive title
-            "info": {
-                "size": file_stat.st_size,
-                "mimetype": mime_type,
-                "w": width,  # width in pixel
-                "h": height,  # height in pixel
-                "xyz.amorgan.blurhash": image_hash,
-            },
-            "msgtype": "m.image",
-            "url": resp.content_uri,
-        }
+        data, mime_type, content_hash = await loop.run_in_executor(None, encode_image, image)
+    except (OSError, ValueError) as err:
+        logger.warning(f"Failed to prepare image for upload: {err}")
+        return None
 
+    filename: str = f"{content_hash[:32]}.{mime_type.split('/')[1]}"
+    media: CachedMedia or None = media_cache.get(content_hash)
+    if media is None:
         try:
-            return await room_send(client, room_id, message_type="m.room.message", content=content)
-        except Exception:
+            width, height, image_hash = await loop.run_in_executor(None, describe_image, data)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Failed to prepare image for upload: {err}")
             return None
-    else:
+
+        resp, maybe_keys = await client.upload(io.BytesIO(data), content_type=mime_type, filename=filename, filesize=len(data))
+        if not isinstance(resp, UploadResponse):
+            logger.warning(f"Failed to upload image: {resp}")
+            return None
+
+        media = CachedMedia(resp.content_uri, mime_type, len(data), width, height, image_hash)
+        media_cache.put(content_hash, media)
+
+    content = {
+        "body": filename,  # descriptive title
+        "info": {
+            "size": media.size,
+            "mimetype": media.mime_type,
+            "w": media.width,  # width in pixel
+            "h": media.height,  # height in pixel
+            "xyz.amorgan.blurhash": media.blurhash,
+        },
+        "msgtype": "m.image",
+        "url": media.content_uri,
+    }
+
+    try:
+        return await room_send(client, room_id, message_type="m.room.message", content=content)
+    except Exception:
         return None
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from typing import Dict, List, Set, Tuple
+
+from nio import AsyncClient, RoomSendError, RoomSendResponse
+
+from core.chat_functions import render_markdown, send_text_to_room
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescedBatch:
+    def __init__(self, client: AsyncClient, room_id: str, notice: bool):
+        """
+        Messages to a single room collected during the coalescing window, to be sent as one event
+        """
+
+        self.client: AsyncClient = client
+        self.room_id: str = room_id
+        self.notice: bool = notice
+        self.messages: List[Tuple[str, bool]] = []
+        """messages along with whether they need to be converted from markdown"""
+        self.full: asyncio.Event = asyncio.Event()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class MessageCoalescer:
+    def __init__(self, window: float = 2.0, max_messages: int = 20):
+        """
+        Merges messages sent to the same room within a short window into a single event, e.g. when a timer reports many changes at once.
+        Only messages flagged as mergeable are coalesced, messages and notices are coalesced separately. The first message of a batch is
+        displayed, all others are collapsed below it. A batch is sent once the window has passed or it contains max_messages messages.
+        :param window: seconds to wait for further messages after the first message of a batch, 0 to disable coalescing
+        :param max_messages: maximum number of messages merged into a single event
+        """
+
+        self.window: float = window
+        self.max_messages: int = max_messages
+        self.batches: Dict[Tuple[str, bool], CoalescedBatch] = {}
+        """batches being collected, by room_id and whether they are notices"""
+        self.tasks: Set[asyncio.Task] = set()
+
+        # statistics
+        self.submitted: int = 0
+        self.sent: int = 0
+
+    def configure(self, window: float, max_messages: int) -> None:
+        """
+        Apply the bot's configuration
+        :param window: seconds to wait for further messages after the first message of a batch, 0 to disable coalescing
+        :param max_messages: maximum number of messages merged into a single event
+        :return:
+        """
+
+        self.window = window
+        self.max_messages = max_messages
+
+    async def send(
+        self, client: AsyncClient, room_id: str, message: str, notice: bool = True, markdown_convert: bool = True
+    ) -> RoomSendResponse or RoomSendError or None:
+        """
+        Send a message as part of the room's current batch. Returns once the batch has been sent, so callers sending several messages should
+        send them concurrently (e.g. using asyncio.gather) for them to be merged.
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) the room to send the message to
+        :param message: (str) the message
+        :param notice: (bool) whether to send the message as notice
+        :param markdown_convert: (bool) whether to convert the message from markdown to HTML
+        :return: the response of sending the event containing the message, None if sending it failed
+        """
+
+        self.submitted += 1
+        if self.window <= 0:
+            self.sent += 1
+            return await send_text_to_room(client, room_id, message, notice=notice, markdown_convert=markdown_convert)
+
+        key: Tuple[str, bool] = (room_id, notice)
+        batch: CoalescedBatch or None = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = CoalescedBatch(client, room_id, notice)
+            task: asyncio.Task = asyncio.get_running_loop().create_task(self.__flush_later(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        batch.messages.append((message, markdown_convert))
+        if len(batch.messages) >= self.max_messages:
+            # later messages start a new batch
+            del self.batches[key]
+            batch.full.set()
+
+        # shielded, so a caller giving up does not cancel sending the batch for all others
+        return await asyncio.shield(batch.future)
+
+    async def __flush_later(self, key: Tuple[str, bool], batch: CoalescedBatch) -> None:
+        """
+        Send a batch once the window has passed or it is full
+        :param key: the batch's key
+        :param batch: the batch
+        :return:
+        """
+
+        try:
+            await asyncio.wait_for(batch.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        await self.__flush(key, batch)
+
+    async def __flush(self, key: Tuple[str, bool], batch: CoalescedBatch) -> None:
+        """
+        Send all messages of a batch as a single event
+        :param key: the batch's key
+        :param batch: the batch
+        :return:
+        """
+
+        if self.batches.get(key) is batch:
+            del self.batches[key]
+
+        response: RoomSendResponse or RoomSendError or None
+        try:
+            if len(batch.messages) == 1:
+                message, markdown_convert = batch.messages[0]
+                response = await send_text_to_room(batch.client, batch.room_id, message, notice=batch.notice, markdown_convert=markdown_convert)
+            else:
+                merged: str = self.__merge(batch.messages)
+                response = await send_text_to_room(batch.client, batch.room_id, merged, notice=batch.notice, markdown_convert=False)
+            self.sent += 1
+        except Exception as err:
+            logger.warning(f"Failed to send {len(batch.messages)} coalesced messages to {batch.room_id}: {err}")
+            response = None
+
+        if not batch.future.done():
+            batch.future.set_result(response)
+
+    @staticmethod
+    def __merge(messages: List[Tuple[str, bool]]) -> str:
+        """
+        Merge several messages into one, displaying the first one and collapsing all others below it
+        :param messages: messages along with whether they need to be converted from markdown
+        :return: the merged message as HTML
+        """
+
+        rendered: List[str] = [render_markdown(message) if markdown_convert else message for message, markdown_convert in messages]
+        return f"{rendered[0]}<details><summary>{len(rendered) - 1} more</summary><br>{'<br>'.join(rendered[1:])}</details>"
+
+    async def close(self) -> None:
+        """
+        Send all batches being collected right away, e.g. on shutdown
+        :return:
+        """
+
+        batch: CoalescedBatch
+        for batch in list(self.batches.values()):
+            batch.full.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: statistics about the coalescer
+        """
+
+        return {
+            "collecting": sum(len(batch.messages) for batch in self.batches.values()),
+            "messages": self.submitted,
+            "events": self.sent,
+        }
+
+
+message_coalescer: MessageCoalescer = MessageCoalescer()
+"""merges mergeable messages sent by plugins"""
@@ -0,0 +1,180 @@
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Tuple
+
+if TYPE_CHECKING:
+    from core.plugin import PluginCommand
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    from fuzzywuzzy import fuzz
+
+    process = None
+
+logger = logging.getLogger(__name__)
+
+
+class CommandIndex:
+    def __init__(self, fuzzy_threshold: int = 60, cache_size: int = 1024):
+        """
+        Index of the commands of all plugins, kept up to date by the plugins whenever a command is added or removed, so looking up a command and
+        checking if it may be used in a room do not need to walk all plugins.
+        Unknown commands are resolved to the most similar command (using rapidfuzz, if installed, fuzzywuzzy otherwise). Results are cached
+        until commands are added or removed.
+        :param fuzzy_threshold: minimum similarity (0-100) a command needs to exceed to be resolved as a fuzzy match
+        :param cache_size: number of resolved (or unresolvable) command-strings to cache
+        """
+
+        self.commands: Dict[str, "PluginCommand"] = {}
+        """the active command for each command-string"""
+
+        self.room_ids: Dict[str, FrozenSet[str]] = {}
+        """rooms each command is restricted to, commands valid in all rooms are not contained"""
+
+        self.__registered: Dict[str, List["PluginCommand"]] = {}
+        """all commands registered for a command-string by different plugins, the last one registered is active"""
+
+        self.version: int = 0
+        """incremented whenever commands are added or removed, allows for caching results derived from the index"""
+
+        self.fuzzy_threshold: int = fuzzy_threshold
+        self.cache_size: int = cache_size
+        self.__choices: List[Tuple[str, int]] or None = None
+        """command-strings and their lengths to resolve fuzzy matches from, built on first use"""
+        self.__resolved: Dict[str, str or None] = OrderedDict()
+        """LRU-cache of resolved command-strings, None for command-strings without any match"""
+
+        # statistics
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+
+    def add(self, plugin_command: "PluginCommand") -> None:
+        """
+        Add a command to the index, replacing a command of the same name registered by another plugin
+        :param plugin_command: the command to add
+        :return:
+        """
+
+        registered: List["PluginCommand"] = self.__registered.setdefault(plugin_command.command, [])
+        if registered:
+            logger.warning(f"Command {plugin_command.command} is registered by multiple plugins, the last one registered is used")
+        registered.append(plugin_command)
+        self.__activate(plugin_command.command)
+
+    def remove(self, plugin_command: "PluginCommand") -> None:
+        """
+        Remove a command from the index, reactivating a command of the same name registered by another plugin
+        :param plugin_command: the command to remove
+        :return:
+        """
+
+        registered: List["PluginCommand"] = self.__registered.get(plugin_command.command, [])
+        if plugin_command in registered:
+            registered.remove(plugin_command)
+            self.__activate(plugin_command.command)
+
+    def __activate(self, command: str) -> None:
+        """
+        Make the last command registered for a command-string the active one
+        :param command: the command-string
+        :return:
+        """
+
+        registered: List["PluginCommand"] = self.__registered.get(command, [])
+        self.room_ids.pop(command, None)
+        if registered:
+            self.commands[command] = registered[-1]
+            if registered[-1].room_id:
+                self.room_ids[command] = frozenset(registered[-1].room_id)
+        else:
+            self.commands.pop(command, None)
+            self.__registered.pop(command, None)
+        self.version += 1
+        self.__choices = None
+        self.__resolved.clear()
+
+    def get(self, command: str) -> "PluginCommand" or None:
+        """
+        :param command: the command-string
+        :return: the active command, None if no command is registered for the command-string
+        """
+
+        return self.commands.get(command)
+
+    def resolve(self, command: str) -> str or None:
+        """
+        Resolve a command-string to a registered command, either an exact or the most similar match
+        :param command: the command-string
+        :return: the command-string of the matching command, None if there is no command similar enough
+        """
+
+        if command in self.commands:
+            return command
+
+        if command in self.__resolved:
+            self.cache_hits += 1
+            self.__resolved.move_to_end(command)
+            return self.__resolved[command]
+
+        self.cache_misses += 1
+        resolved: str or None = self.__find_similar(command)
+        self.__resolved[command] = resolved
+        if len(self.__resolved) > self.cache_size:
+            self.__resolved.popitem(last=False)
+        return resolved
+
+    def __find_similar(self, command: str) -> str or None:
+        """
+        Find the command most similar to the given command-string
+        :param command: the command-string
+        :return: the command-string of the most similar command, None if no command exceeds the fuzzy_threshold
+        """
+
+        if self.__choices is None:
+            self.__choices = [(choice, len(choice)) for choice in self.commands.keys()]
+
+        if process is not None:
+            match: Tuple[str, float, int] or None = process.extractOne(
+                command, [choice for choice, length in self.__choices], scorer=fuzz.ratio, score_cutoff=self.fuzzy_threshold + 0.5
+            )
+            return match[0] if match is not None else None
+
+        best_match: str or None = None
+        best_ratio: int = self.fuzzy_threshold
+        command_length: int = len(command)
+        choice: str
+        length: int
+        for choice, length in self.__choices:
+            # skip commands whose difference in length alone rules out a better match
+            if 200 * min(length, command_length) / (length + command_length) <= best_ratio:
+                continue
+            ratio: int = fuzz.ratio(command, choice)
+            if ratio > best_ratio:
+                best_match = choice
+                best_ratio = ratio
+
+        return best_match
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: statistics about the index
+        """
+
+        return {
+            "commands": len(self.commands),
+            "fuzzy cache hits": self.cache_hits,
+            "fuzzy cache misses": self.cache_misses,
+        }
+
+    def is_valid_for_room(self, command: str, room_id: str) -> bool:
+        """
+        Check whether a command may be used in a room
+        :param command: the command-string
+        :param room_id: the room to check for
+        :return:    True, if the command is not restricted to specific rooms or allowed in the given room
+                    False, otherwise
+        """
+
+        room_ids: FrozenSet[str] or None = self.room_ids.get(command)
+        return room_ids is None or room_id in room_ids
@@ -45,6 +45,26 @@ class Config(object):
         self.database_filepath = self._get_cfg(["storage", "database_filepath"], required=True)
         self.store_filepath = self._get_cfg(["storage", "store_filepath"], required=True)
 
+        # Time to wait for further changes before writing plugin data to disk
+        self.plugin_data_flush_delay: float = self._get_cfg(["storage", "plugin_data_flush_delay"], default=1.0, required=False)
+
+        # Load plugin data on first access ("lazy") or all plugins' data concurrently at startup ("preload")
+        self.plugin_data_loading: str = self._get_cfg(["storage", "plugin_data_loading"], default="lazy", required=False)
+        if self.plugin_data_loading not in ("lazy", "preload"):
+            raise ConfigError(f"storage.plugin_data_loading '{self.plugin_data_loading}' must be either 'lazy' or 'preload'")
+
+        # Number of latest backups of plugin data to keep, and number of hours and days to keep the latest backup of
+        self.plugin_data_backup_keep_recent: int = self._get_cfg(["storage", "plugin_data_backup_keep_recent"], default=10, required=False)
+        self.plugin_data_backup_keep_hourly: int = self._get_cfg(["storage", "plugin_data_backup_keep_hourly"], default=24, required=False)
+        self.plugin_data_backup_keep_daily: int = self._get_cfg(["storage", "plugin_data_backup_keep_daily"], default=7, required=False)
+
+        # Backend used to store plugin data, either "sqlite" or "journal"
+        self.plugin_data_backend: str = self._get_cfg(["storage", "plugin_data_backend"], default="sqlite", required=False)
+        if self.plugin_data_backend not in ("sqlite", "journal"):
+            raise ConfigError(f"storage.plugin_data_backend '{self.plugin_data_backend}' must be either 'sqlite' or 'journal'")
+        # Size of the journal in bytes after which it is compacted into a snapshot
+        self.plugin_data_journal_compaction_size: int = self._get_cfg(["storage", "plugin_data_journal_compaction_size"], default=1048576, required=False)
+
         # Create the store folder if it doesn't exist
         if not os.path.isdir(self.store_filepath):
             if not os.path.exists(self.store_filepath):
@@ -66,7 +86,69 @@ class Config(object):
 
         self.command_prefix = self._get_cfg(["command_prefix"], default="!c ")
 
+        # Handling of unknown commands: "run" the most similar command, "suggest" it or turn fuzzy matching "off"
+        self.command_fuzzy_matching: str = self._get_cfg(["commands", "fuzzy_matching"], default="run", required=False)
+        if self.command_fuzzy_matching not in ("run", "suggest", "off"):
+            raise ConfigError(f"commands.fuzzy_matching '{self.command_fuzzy_matching}' must be one of 'run', 'suggest' or 'off'")
+        # Minimum similarity (0-100) a command needs to exceed to be matched
+        self.command_fuzzy_threshold: int = self._get_cfg(["commands", "fuzzy_threshold"], default=60, required=False)
+        # Number of commands run concurrently (commands of a single room are always run one after another)
+        self.command_workers: int = self._get_cfg(["commands", "workers"], default=8, required=False)
+        # Maximum number of commands running at the same time, further commands wait until others are finished
+        self.command_max_in_flight: int = self._get_cfg(["commands", "max_in_flight"], default=100, required=False)
+        # Maximum number of commands of a single room waiting to be run, further commands of the room are dropped
+        self.command_max_queued_per_room: int = self._get_cfg(["commands", "max_queued_per_room"], default=100, required=False)
+        if self.command_workers < 1 or self.command_max_in_flight < 1 or self.command_max_queued_per_room < 1:
+            raise ConfigError("commands.workers, commands.max_in_flight and commands.max_queued_per_room must be at least 1")
+
+        # Seconds a hook may run before being cancelled, 0 to let hooks run indefinitely
+        self.hook_timeout: float = self._get_cfg(["hooks", "timeout"], default=60, required=False)
+        # Maximum number of hooks of a single plugin running at the same time
+        self.hook_max_concurrent_per_plugin: int = self._get_cfg(["hooks", "max_concurrent_per_plugin"], default=4, required=False)
+        # Maximum number of hooks of a single plugin waiting to be run, further hooks are dropped
+        self.hook_max_queued_per_plugin: int = self._get_cfg(["hooks", "max_queued_per_plugin"], default=100, required=False)
+        if self.hook_max_concurrent_per_plugin < 1 or self.hook_max_queued_per_plugin < 0:
+            raise ConfigError("hooks.max_concurrent_per_plugin must be at least 1, hooks.max_queued_per_plugin must not be negative")
+
         # plugins
+        # Renderer used to convert messages from markdown to HTML
+        self.markdown_renderer: str = self._get_cfg(["markdown", "renderer"], default="commonmark", required=False)
+        if self.markdown_renderer not in ("commonmark", "cmarkgfm"):
+            raise ConfigError(f"markdown.renderer '{self.markdown_renderer}' must be either 'commonmark' or 'cmarkgfm'")
+
+        # Rate limits of events sent by the bot, per room and across all rooms
+        self.outbound_room_rate: float = self._get_cfg(["outbound", "room_rate"], default=4.0, required=False)
+        self.outbound_room_burst: int = self._get_cfg(["outbound", "room_burst"], default=8, required=False)
+        self.outbound_global_rate: float = self._get_cfg(["outbound", "global_rate"], default=10.0, required=False)
+        self.outbound_global_burst: int = self._get_cfg(["outbound", "global_burst"], default=20, required=False)
+        if min(self.outbound_room_rate, self.outbound_room_burst, self.outbound_global_rate, self.outbound_global_burst) <= 0:
+            raise ConfigError("outbound rates and bursts must be greater than 0")
+        # Seconds to collect mergeable messages to a room for, and the maximum number of messages merged into one event
+        self.outbound_coalesce_window: float = self._get_cfg(["outbound", "coalesce_window"], default=2.0, required=False)
+        self.outbound_coalesce_max_messages: int = self._get_cfg(["outbound", "coalesce_max_messages"], default=20, required=False)
+        if self.outbound_coalesce_window < 0:
+            raise ConfigError("outbound.coalesce_window must not be negative")
+        if self.outbound_coalesce_max_messages < 1:
+            raise ConfigError("outbound.coalesce_max_messages must be at least 1")
+
+        # Uploaded media, by the hash of their content, so they are not uploaded again
+        self.media_cache_max_entries: int = self._get_cfg(["media_cache", "max_entries"], default=1000, required=False)
+        self.media_cache_max_size: int or None = self._get_cfg(["media_cache", "max_size"], default=None, required=False)
+        if self.media_cache_max_entries < 0:
+            raise ConfigError("media_cache.max_entries must not be negative")
+        if self.media_cache_max_size is not None and self.media_cache_max_size <= 0:
+            raise ConfigError("media_cache.max_size must be greater than 0")
+
+        # Content of messages sent by the bot, so edits do not need to fetch the original message from the server
+        self.sent_events_max_entries: int = self._get_cfg(["sent_events", "max_entries"], default=1000, required=False)
+        if self.sent_events_max_entries < 0:
+            raise ConfigError("sent_events.max_entries must not be negative")
+
+        # Seconds after which the members of a room are fetched from the server again, 0 to only rely on membership changes seen by sync
+        self.members_ttl: float = self._get_cfg(["members", "ttl"], default=3600, required=False)
+        if self.members_ttl < 0:
+            raise ConfigError("members.ttl must not be negative")
+
         self.plugins_allowlist = self._get_cfg(["plugins", "allowlist"], required=False, default=[])
         self.plugins_denylist = self._get_cfg(["plugins", "denylist"], required=False, default=[])
 
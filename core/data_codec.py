@@ -0,0 +1,236 @@
+import base64
+import datetime
+import json
+import logging
+import math
+import zlib
+from typing import Any, Callable, Dict
+
+import jsonpickle
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DATA_FORMATS = ("jsonpickle", "json", "msgpack")
+"""formats values can be encoded in"""
+
+TYPE_KEYS = ("__object__", "__tuple__", "__set__", "__datetime__", "__date__", "__timedelta__")
+"""keys marking values of types not natively supported by json and msgpack in their encoded form"""
+
+
+class DataCodec:
+    def __init__(self, data_format: str = "jsonpickle", compression_threshold: int or None = 65536):
+        """
+        Encodes the values stored by a plugin.
+        Besides jsonpickle, which is able to encode almost anything but is slow and verbose, values can be encoded in compact json (using orjson, if
+        available) or msgpack. These formats only support the basic python types, datetimes and instances of classes registered by the plugin,
+        values containing anything else are encoded using jsonpickle instead.
+        Encoded values are tagged with their format, so values encoded in any format can always be decoded. Values stored before tagging was
+        introduced are jsonpickle-encoded and not tagged.
+        :param data_format: the format to encode values in, one of DATA_FORMATS
+        :param compression_threshold: encoded values larger than this number of bytes are compressed (using zstd, if available, zlib otherwise),
+                                      None to disable compression
+        """
+
+        self.data_format: str = "jsonpickle"
+        self.compression_threshold: int or None = compression_threshold
+        self.classes: Dict[str, type] = {}
+        """classes registered for compact encoding, by name"""
+        self.class_names: Dict[type, str] = {}
+
+        self.set_format(data_format)
+
+    def set_format(self, data_format: str) -> None:
+        """
+        Set the format to encode values in
+        :param data_format: one of DATA_FORMATS
+        :return:
+        """
+
+        if data_format not in DATA_FORMATS:
+            raise ValueError(f"Unknown data format {data_format}, must be one of {', '.join(DATA_FORMATS)}")
+        if data_format == "msgpack" and msgpack is None:
+            logger.warning("msgpack is not installed, encoding data as json instead")
+            data_format = "json"
+        self.data_format = data_format
+
+    def register_class(self, cls: type, name: str or None = None) -> None:
+        """
+        Register a class for compact encoding. Its instances are encoded as the name of the class and their instance-attributes, they are restored
+        without calling __init__.
+        :param cls: the class to register
+        :param name: the name to store the class by, defaults to the name of the class. Needs to be kept when renaming or moving the class.
+        :return:
+        """
+
+        name = name or cls.__name__
+        self.classes[name] = cls
+        self.class_names[cls] = name
+
+    def __pack(self, value: Any) -> Any:
+        """
+        Convert a value into the basic types supported by json and msgpack
+        :param value: the value to convert
+        :return: the converted value
+        :raises TypeError: if the value contains types that can not be converted
+        """
+
+        value_type: type = type(value)
+        if value_type in (str, int, bool) or value is None:
+            return value
+        elif value_type is float:
+            if not math.isfinite(value):
+                raise TypeError("nan and infinity are not supported")
+            return value
+        elif value_type is list:
+            return [self.__pack(item) for item in value]
+        elif value_type is dict:
+            if not all(type(key) is str for key in value.keys()) or any(key in value for key in TYPE_KEYS):
+                raise TypeError("dict keys are not supported")
+            return {key: self.__pack(item) for key, item in value.items()}
+        elif value_type is tuple:
+            return {"__tuple__": [self.__pack(item) for item in value]}
+        elif value_type is set:
+            return {"__set__": [self.__pack(item) for item in value]}
+        elif value_type is datetime.datetime:
+            if value.tzinfo is not None and value.tzinfo is not datetime.timezone.utc:
+                raise TypeError("timezones are not supported")
+            return {"__datetime__": value.isoformat()}
+        elif value_type is datetime.date:
+            return {"__date__": value.isoformat()}
+        elif value_type is datetime.timedelta:
+            return {"__timedelta__": [value.days, value.seconds, value.microseconds]}
+        elif value_type in self.class_names:
+            return {"__object__": self.class_names[value_type], "state": self.__pack(vars(value))}
+        else:
+            raise TypeError(f"{value_type.__name__} is not supported")
+
+    def __unpack(self, value: Any) -> Any:
+        """
+        Restore a value converted by __pack()
+        :param value: the converted value
+        :return: the original value
+        """
+
+        value_type: type = type(value)
+        if value_type is list:
+            return [self.__unpack(item) for item in value]
+        elif value_type is not dict:
+            return value
+        elif "__object__" in value:
+            obj: Any = object.__new__(self.classes[value["__object__"]])
+            obj.__dict__.update(self.__unpack(value["state"]))
+            return obj
+        elif "__tuple__" in value:
+            return tuple(self.__unpack(item) for item in value["__tuple__"])
+        elif "__set__" in value:
+            return set(self.__unpack(item) for item in value["__set__"])
+        elif "__datetime__" in value:
+            return datetime.datetime.fromisoformat(value["__datetime__"])
+        elif "__date__" in value:
+            return datetime.date.fromisoformat(value["__date__"])
+        elif "__timedelta__" in value:
+            return datetime.timedelta(*value["__timedelta__"])
+        else:
+            return {key: self.__unpack(item) for key, item in value.items()}
+
+    def encode(self, value: Any) -> str:
+        """
+        Encode a value in the codec's format
+        :param value: the value to encode
+        :return: the encoded value, tagged with its format
+        """
+
+        data_format: str = self.data_format
+        payload: bytes or None = None
+        if data_format != "jsonpickle":
+            try:
+                packed: Any = self.__pack(value)
+                if data_format == "msgpack":
+                    payload = msgpack.packb(packed)
+                elif orjson is not None:
+                    payload = orjson.dumps(packed)
+                else:
+                    payload = json.dumps(packed, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+            except (TypeError, ValueError, OverflowError):
+                # values containing unsupported types are still stored, just not as compact
+                data_format = "jsonpickle"
+        if payload is None:
+            payload = jsonpickle.encode(value).encode("utf-8")
+
+        if self.compression_threshold is not None and len(payload) > self.compression_threshold:
+            if zstandard is not None:
+                return f"~{data_format}+zstd:{base64.b64encode(zstandard.ZstdCompressor().compress(payload)).decode('ascii')}"
+            else:
+                return f"~{data_format}+zlib:{base64.b64encode(zlib.compress(payload)).decode('ascii')}"
+        elif data_format == "msgpack":
+            return f"~msgpack:{base64.b64encode(payload).decode('ascii')}"
+        elif data_format == "jsonpickle" and self.data_format == "jsonpickle":
+            # keep data readable by earlier versions, as long as it is not being compressed
+            return payload.decode("utf-8")
+        else:
+            return f"~{data_format}:{payload.decode('utf-8')}"
+
+    def decode(self, encoded: str) -> Any:
+        """
+        Decode a value encoded in any format
+        :param encoded: the encoded value
+        :return: the decoded value
+        """
+
+        if not encoded.startswith("~"):
+            # untagged values are always jsonpickle, json itself never starts with ~
+            return jsonpickle.decode(encoded)
+
+        tag, payload = encoded[1:].split(":", 1)
+        data_format, _, compression = tag.partition("+")
+        if compression or data_format == "msgpack":
+            payload_bytes: bytes = base64.b64decode(payload)
+            if compression == "zstd":
+                if zstandard is None:
+                    raise ValueError("zstandard is required to decode zstd-compressed data")
+                payload_bytes = zstandard.ZstdDecompressor().decompress(payload_bytes)
+            elif compression == "zlib":
+                payload_bytes = zlib.decompress(payload_bytes)
+        else:
+            payload_bytes = payload.encode("utf-8")
+
+        loads: Callable[[bytes], Any]
+        if data_format == "jsonpickle":
+            return jsonpickle.decode(payload_bytes.decode("utf-8"))
+        elif data_format == "msgpack":
+            if msgpack is None:
+                raise ValueError("msgpack is required to decode msgpack-encoded data")
+            loads = msgpack.unpackb
+        elif orjson is not None:
+            loads = orjson.loads
+        else:
+            loads = json.loads
+        return self.__unpack(loads(payload_bytes))
+
+    def is_current(self, encoded: str) -> bool:
+        """
+        Check if a value has been encoded in the codec's current format, e.g. to migrate data encoded in another format
+        :param encoded: the encoded value
+        :return:    True, if the value has been encoded in the current format, or in jsonpickle as it contains types not supported by it
+                    False, if the value should be encoded again
+        """
+
+        if not encoded.startswith("~"):
+            return self.data_format == "jsonpickle"
+        data_format: str = encoded[1:].split(":", 1)[0].partition("+")[0]
+        return data_format in (self.data_format, "jsonpickle")
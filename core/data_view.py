@@ -0,0 +1,977 @@
+"""
+Copy-on-write views on plugin data as handed out by Plugin.read_data().
+
+Reading through a view is passed through to the stored data without copying anything but references. When the data is modified through a view,
+only the object being modified and the containers on its path from the top of the data are copied (shallowly), everything else stays shared with
+the stored data. Views of the same read_data()-call are redirected to these copies. The stored data itself is never modified through a view,
+changes are only persisted when the view (or any data containing it) is passed to Plugin.store_data().
+As every modification goes through a view, views also keep track of whether they have been modified, so storing an unmodified view is a no-op.
+
+Views of dicts, lists and sets are actual dicts, lists and sets mirroring the references to the items of the object they represent, so isinstance()
+checks and code reading them directly (like json or str.join()) work as they would for the data. Views of other objects are instances of a subclass
+of the object's class. Tuples and frozensets are returned as tuples and frozensets (of views, if they contain mutable objects).
+"""
+
+import copy
+import datetime
+import decimal
+import enum
+from types import FunctionType, MethodType
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
+
+IMMUTABLE_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    bool,
+    type(None),
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+    datetime.tzinfo,
+    decimal.Decimal,
+    enum.Enum,
+    range,
+    type,
+    FunctionType,
+    MethodType,
+)
+"""Types that can not be modified and are therefore returned without wrapping them into a view"""
+
+_UNADOPTABLE_TYPES = IMMUTABLE_TYPES + (tuple, frozenset)
+
+
+class ViewRoot:
+    __slots__ = ("original", "memo", "owned", "views", "aliases", "locations", "modified", "base", "dirty_keys")
+
+    def __init__(self, original: Any):
+        """
+        Shared state of all views created by a single read_data()-call
+        :param original: the stored data the views are created for
+        """
+
+        self.original: Any = original
+
+        self.memo: Dict[int, Any] = {}
+        """copies of objects of the original data that have been modified (or contain modified objects), by id of the original object.
+        Objects inserted through a view are their own copy."""
+
+        self.owned: Set[int] = set()
+        """ids of the original objects whose copies have not been stored yet and may therefore be modified in place"""
+
+        self.views: Dict[int, Tuple[Any, DataView or None]] = {}
+        """views already created along with the object they have been created for (keeping its id valid), by id of the object, so accessing
+        the same object twice returns the same view. Copies are registered for the view of their original object. Tuples and frozensets without
+        any mutable objects are registered without a view."""
+
+        self.aliases: Dict[int, List[Tuple[DataView, Any]]] = {}
+        """further containers (and the key) objects have been read from besides the parent of their view, by id of the original object"""
+
+        self.locations: Dict[int, Tuple[Dict[int, Any], Dict[int, List[Any]]]] = {}
+        """key of the items of copied dicts and lists by id of the item (and all keys of items held more than once), by id of the copy, to find
+        all occurrences of an object being replaced"""
+
+        self.modified: bool = False
+        """True, if the data has been modified since it has been read or last stored"""
+
+        self.base: Any = original
+        """the data as read or last stored, the data dirty_keys are relative to"""
+
+        self.dirty_keys: Set[Any] = set()
+        """keys of the data (if it is a dict) whose items have been set, modified or removed since it has been read or last stored"""
+
+    def resolve(self, obj: Any) -> Any:
+        """
+        Get the object currently representing obj, e.g. its copy if it has been modified
+        :param obj: an object of the original data
+        :return: the object to read from
+        """
+
+        return self.memo.get(id(obj), obj)
+
+    def writable(self, obj_view: "DataView") -> Any:
+        """
+        Get the object represented by a view for modifying it, copying it (and the containers on its path) unless it has been copied since the
+        data has been read or last stored
+        :param obj_view: the view of the object to modify
+        :return: the object to write to
+        """
+
+        obj_id: int = id(obj_view._view_obj)
+        if obj_id in self.owned:
+            return self.memo[obj_id]
+
+        current: Any = self.resolve(obj_view._view_obj)
+        copied: Any = copy.copy(current)
+        self.__replace(obj_view, current, copied)
+        self.__redirect(obj_view, copied)
+        self.owned.add(obj_id)
+        self.modified = True
+        return copied
+
+    def adopt(self, obj: Any) -> None:
+        """
+        Take over a mutable object inserted into the data through a view, so it is modified in place (like the data would be without a view) instead
+        of being copied, keeping the references of whoever inserted it valid
+        :param obj: the object inserted
+        :return:
+        """
+
+        obj_id: int = id(obj)
+        if obj_id not in self.memo:
+            self.memo[obj_id] = obj
+            self.owned.add(obj_id)
+
+    def __replace(self, obj_view: "DataView", current: Any, replacement: Any) -> None:
+        """
+        Replace an object by its copy within all containers it has been read from, copying the containers first
+        :param obj_view: the view of the object
+        :param current: the object currently representing the view
+        :param replacement: the object to replace it by
+        :return:
+        """
+
+        if obj_view._view_parent is not None:
+            self.__replace_in(obj_view._view_parent, current, replacement)
+        parent: DataView
+        for parent, _ in self.aliases.get(id(obj_view._view_obj), ()):
+            self.__replace_in(parent, current, replacement)
+
+    def __replace_in(self, parent: "DataView", current: Any, replacement: Any) -> None:
+        """
+        Replace all occurrences of an object within a container, copying the container first
+        :param parent: the view of the container
+        :param current: the object to replace
+        :param replacement: the object to replace it by
+        :return:
+        """
+
+        parent_current: Any = self.resolve(parent._view_obj)
+        if isinstance(parent_current, (tuple, frozenset)):
+            if any(item is current for item in parent_current):
+                # immutable containers are rebuilt containing the replacement, which is then replaced within their own container in turn
+                rebuilt: Any = _rebuild(parent_current, [replacement if item is current else item for item in parent_current])
+                self.__replace(parent, parent_current, rebuilt)
+                self.__redirect(parent, rebuilt)
+            return
+
+        container: Any = self.writable(parent)
+        if isinstance(container, (dict, list)):
+            keys: List[Any] = self.__locate(container, current)
+            key: Any
+            for key in keys:
+                container[key] = replacement
+                parent._view_mirror(key, replacement)
+            if parent._view_parent is None and isinstance(container, dict):
+                self.dirty_keys.update(keys)
+        elif isinstance(container, set):
+            if current in container:
+                container.discard(current)
+                container.add(replacement)
+                parent._view_mirror(current, replacement)
+        else:
+            attributes: Dict[str, Any] = _get_attributes(container)
+            for key in [name for name, item in attributes.items() if item is current]:
+                object.__setattr__(container, key, replacement)
+
+    def __locate(self, container: dict or list, item: Any) -> List[Any]:
+        """
+        Find all keys or indices of an object within a copied dict or list, indexing the copy on first use
+        :param container: the copy
+        :param item: the object to find
+        :return: the keys or indices holding item
+        """
+
+        index: Tuple[Dict[int, Any], Dict[int, List[Any]]] or None = self.locations.get(id(container))
+        if index is not None:
+            keys: List[Any] = index[1].get(id(item)) or ([index[0][id(item)]] if id(item) in index[0] else [])
+            if keys and all(_holds(container, key, item) for key in keys):
+                return keys
+
+        # not indexed yet, or the container has been changed since (e.g. items of a list have been moved)
+        items: List[Tuple[Any, Any]] = list(container.items() if isinstance(container, dict) else enumerate(container))
+        single: Dict[int, Any] = {id(value): key for key, value in items}
+        multiple: Dict[int, List[Any]] = {}
+        if len(single) < len(items):
+            # objects held more than once
+            key: Any
+            value: Any
+            for key, value in items:
+                if single[id(value)] != key:
+                    multiple.setdefault(id(value), [single[id(value)]]).append(key)
+        self.locations[id(container)] = (single, multiple)
+        return multiple.get(id(item)) or ([single[id(item)]] if id(item) in single else [])
+
+    def __redirect(self, obj_view: "DataView", obj: Any) -> None:
+        """
+        Redirect a view to a copy of its object
+        :param obj_view: the view
+        :param obj: the copy
+        :return:
+        """
+
+        obj_id: int = id(obj_view._view_obj)
+        previous: Any or None = self.memo.get(obj_id)
+        if previous is not None and self.views.get(id(previous), (None, None))[1] is obj_view:
+            del self.views[id(previous)]
+        self.memo[obj_id] = obj
+        self.views[id(obj)] = (obj, obj_view)
+
+    def release(self) -> None:
+        """
+        Stop modifying copies in place, e.g. as they have become part of other data. Objects modified next have to be copied again.
+        :return:
+        """
+
+        self.owned.clear()
+        self.locations.clear()
+
+    def commit(self) -> None:
+        """
+        Mark the data as stored, objects modified next have to be copied again
+        :return:
+        """
+
+        self.release()
+        self.modified = False
+        self.base = self.target()
+        self.dirty_keys = set()
+
+    def is_modified(self) -> bool:
+        """
+        :return:    True, if the data has been modified since it has been read or last stored
+                    False, otherwise
+        """
+
+        return self.modified
+
+    def target(self) -> Any:
+        """
+        :return: the data the root currently represents, either the original data or its copy
+        """
+
+        return self.resolve(self.original)
+
+    def view(self, obj: Any, parent: "DataView" or None = None, key: Any = None) -> Any:
+        """
+        Wrap obj into a view, unless it is immutable anyway
+        :param obj: the object to wrap
+        :param parent: the view of the container obj has been read from, None for the data itself
+        :param key: the key, index or attribute name obj has been read by, if known
+        :return: a view of obj, a tuple or frozenset of views of its items or obj itself
+        """
+
+        if isinstance(obj, IMMUTABLE_TYPES):
+            return obj
+
+        obj_view: DataView or None
+        entry: Tuple[Any, DataView or None] or None = self.views.get(id(obj))
+        if entry is not None:
+            obj_view = entry[1]
+            if obj_view is None:
+                return obj
+            if parent is not None and parent is not obj_view._view_parent:
+                self.__alias(obj_view, parent, key)
+        else:
+            if isinstance(obj, dict):
+                obj_view = DictView(self, obj, parent, key)
+            elif isinstance(obj, list):
+                obj_view = ListView(self, obj, parent, key)
+            elif isinstance(obj, set):
+                obj_view = SetView(self, obj, parent, key)
+            elif isinstance(obj, (tuple, frozenset)):
+                obj_view = FrozenView(self, obj, parent, key) if not _is_frozen(obj) else None
+            else:
+                # bypassing the __new__ and __init__ of the object's class
+                obj_view = object.__new__(_object_view_class(type(obj)))
+                DataView.__init__(obj_view, self, obj, parent, key)
+            self.views[id(obj)] = (obj, obj_view)
+            if obj_view is None:
+                return obj
+
+        if isinstance(obj_view, FrozenView):
+            return obj_view._view_frozen()
+        return obj_view
+
+    def __alias(self, obj_view: "DataView", parent: "DataView", key: Any) -> None:
+        """
+        Remember another container an object has been read from, so it is replaced there as well once it is copied
+        :param obj_view: the view of the object
+        :param parent: the view of the container
+        :param key: the key, index or attribute name the object has been read by
+        :return:
+        """
+
+        aliases: List[Tuple[DataView, Any]] = self.aliases.setdefault(id(obj_view._view_obj), [])
+        if not any(alias_parent is parent for alias_parent, _ in aliases):
+            aliases.append((parent, key))
+
+
+def _get_attributes(obj: Any) -> Dict[str, Any]:
+    """
+    Get the attributes of a plain object, stored in its __dict__ or __slots__
+    :param obj: the object
+    :return: Dict of name and value of all attributes that are set
+    """
+
+    attributes: Dict[str, Any] = dict(getattr(obj, "__dict__", {}))
+    klass: type
+    for klass in type(obj).__mro__:
+        slots: str or Tuple[str, ...] = klass.__dict__.get("__slots__", ())
+        name: str
+        for name in (slots,) if isinstance(slots, str) else slots:
+            if name not in ("__dict__", "__weakref__"):
+                try:
+                    attributes[name] = object.__getattribute__(obj, name)
+                except AttributeError:
+                    pass
+    return attributes
+
+
+def _holds(container: dict or list, key: Any, item: Any) -> bool:
+    """
+    :return: True, if container holds item at key, False otherwise
+    """
+
+    try:
+        return container[key] is item
+    except (KeyError, IndexError):
+        return False
+
+
+def _is_frozen(obj: tuple or frozenset) -> bool:
+    """
+    :return: True, if a tuple or frozenset only contains immutable objects, False otherwise
+    """
+
+    return all(isinstance(item, IMMUTABLE_TYPES) or (isinstance(item, (tuple, frozenset)) and _is_frozen(item)) for item in obj)
+
+
+def _rebuild(obj: tuple or frozenset or list or set, items: List[Any]) -> Any:
+    """
+    Create a container of the same type (including namedtuples) as obj with other items
+    :param obj: the container
+    :param items: the items of the new container
+    :return: the new container
+    """
+
+    return type(obj)(*items) if hasattr(obj, "_fields") else type(obj)(items)
+
+
+def create_view(data: Any) -> Any:
+    """
+    Create a copy-on-write view of stored data
+    :param data: the stored data
+    :return: a view of the data, or the data itself if it is immutable
+    """
+
+    return ViewRoot(data).view(data)
+
+
+def is_unmodified_view(value: Any, stored: Any) -> bool:
+    """
+    Check if a value is a view of stored data which has not been modified, e.g. to skip storing it again
+    :param value: the value to check
+    :param stored: the data currently stored
+    :return:    True, if value is an unmodified view of stored
+                False, otherwise
+    """
+
+    if not isinstance(value, DataView):
+        return False
+
+    root: ViewRoot = value._view_root
+    return value._view_obj is root.original and not root.is_modified() and root.target() is stored
+
+
+def get_dirty_keys(value: Any, stored: Any) -> Set[Any] or None:
+    """
+    Get the keys of a dict that have been changed through a view since it has been read or last stored, e.g. to only write those
+    :param value: the value to be stored
+    :param stored: the data currently stored
+    :return: the keys whose items have been set, modified or removed, None if value is not a view of stored
+    """
+
+    if not isinstance(value, DataView) or value._view_parent is not None:
+        return None
+
+    root: ViewRoot = value._view_root
+    if root.base is not stored:
+        return None
+    return set(root.dirty_keys)
+
+
+def unwrap(value: Any, commit: bool = False, own: ViewRoot or None = None) -> Any:
+    """
+    Replace views by the objects they currently represent, including views contained in dicts, lists, tuples, sets and the attributes of plain
+    objects (which are copied if they contain views)
+    :param value: a value that may be or contain views
+    :param commit: the value is being stored. If it is a view, mark its data as stored, so it is copied again before being modified. Views of
+                   other data contained in the value are not marked as stored, but stop modifying their copies in place, as these are now shared.
+    :param own: the root of the data the value is inserted into. Objects of the same data are copied first (unless they have been already), so
+                the data refers to the same copy in both places instead of one of them still referring to the stored object. Other mutable
+                objects are adopted by the data, so modifying them through a view modifies them in place.
+    :return: the value without any views, the value itself if it did not contain any views
+    """
+
+    if commit and isinstance(value, DataView) and value._view_root is not own:
+        target: Any = value._view_target()
+        value._view_root.commit()
+        return target
+
+    return _unwrap(value, commit or own is not None, own, {})
+
+
+def _unwrap(value: Any, release: bool, own: ViewRoot or None, memo: Dict[int, Any]) -> Any:
+    """
+    :param value: a value that may be or contain views
+    :param release: release the copies of the views' data, see ViewRoot.release()
+    :param own: the root of the data the value is inserted into, see unwrap()
+    :param memo: plain objects already unwrapped, by id, so objects referring to each other are unwrapped once
+    :return: the value without any views
+    """
+
+    if isinstance(value, DataView):
+        root: ViewRoot = value._view_root
+        if root is own:
+            return value._view_writable()
+        if release:
+            root.release()
+        return value._view_target()
+
+    value_type: type = type(value)
+    if value_type is dict:
+        unwrapped_items = [(key, _unwrap(item, release, own, memo)) for key, item in value.items()]
+        if any(item is not value[key] for key, item in unwrapped_items):
+            value = dict(unwrapped_items)
+    elif value_type in (list, set, frozenset) or isinstance(value, tuple):
+        unwrapped_items = [_unwrap(item, release, own, memo) for item in value]
+        if any(unwrapped is not item for unwrapped, item in zip(unwrapped_items, value)):
+            value = _rebuild(value, unwrapped_items)
+    elif value_type.__module__ != "builtins" and not isinstance(value, IMMUTABLE_TYPES):
+        if id(value) in memo:
+            return memo[id(value)]
+        # objects referring back to this one keep referring to it
+        memo[id(value)] = value
+
+        attributes: Dict[str, Any] = _get_attributes(value)
+        unwrapped_attributes: Dict[str, Any] = {name: _unwrap(item, release, own, memo) for name, item in attributes.items()}
+        if any(unwrapped is not attributes[name] for name, unwrapped in unwrapped_attributes.items()):
+            unwrapped_value: Any = copy.copy(value)
+            name: str
+            for name, unwrapped in unwrapped_attributes.items():
+                object.__setattr__(unwrapped_value, name, unwrapped)
+            memo[id(value)] = unwrapped_value
+            value = unwrapped_value
+
+    if own is not None and not isinstance(value, _UNADOPTABLE_TYPES):
+        own.adopt(value)
+    return value
+
+
+_VIEW_SLOTS: Tuple[str, ...] = ("_view_root", "_view_obj", "_view_parent", "_view_key")
+
+
+class DataView:
+    __slots__ = ()
+
+    def __init__(self, root: ViewRoot, obj: Any, parent: "DataView" or None = None, key: Any = None):
+        """
+        Base class of all views, passing reading access through to the object it represents
+        :param root: the root shared by all views of the same read_data()-call
+        :param obj: the object of the original data this view represents
+        :param parent: the view of the container obj has been read from, copied along with obj when obj is modified
+        :param key: the key, index or attribute name obj has been read by, if known
+        """
+
+        object.__setattr__(self, "_view_root", root)
+        object.__setattr__(self, "_view_obj", obj)
+        object.__setattr__(self, "_view_parent", parent)
+        object.__setattr__(self, "_view_key", key)
+        self._view_sync()
+
+    def _view_target(self) -> Any:
+        """
+        :return: the object to read from, either the original object or its copy
+        """
+
+        return self._view_root.resolve(self._view_obj)
+
+    def _view_writable(self) -> Any:
+        """
+        Copy the object (and the containers on its path) on first modification
+        :return: the object to write to
+        """
+
+        return self._view_root.writable(self)
+
+    def _view(self, obj: Any, key: Any = None) -> Any:
+        return self._view_root.view(obj, self, key)
+
+    def _view_sync(self) -> None:
+        """
+        Mirror all references to the items of the object, for views that are containers themselves
+        :return:
+        """
+
+    def _view_mirror(self, key: Any, value: Any) -> None:
+        """
+        Mirror the replacement of a single item of the object, for views that are containers themselves
+        :param key: the key or index of the item, the item itself for sets
+        :param value: the new item
+        :return:
+        """
+
+    def _view_changed(self, *keys: Any) -> None:
+        """
+        Record the keys of the data changed through this view, if it is the view of the data itself
+        :param keys: the keys whose items have been set or removed
+        :return:
+        """
+
+        if self._view_parent is None:
+            self._view_root.dirty_keys.update(keys)
+
+    def _view_insertable(self, value: Any) -> Any:
+        """
+        :param value: a value to insert into the data
+        :return: the value without any views
+        """
+
+        return unwrap(value, own=self._view_root)
+
+    def __eq__(self, other):
+        return self._view_target() == unwrap(other)
+
+    def __ne__(self, other):
+        return self._view_target() != unwrap(other)
+
+    def __lt__(self, other):
+        return self._view_target() < unwrap(other)
+
+    def __le__(self, other):
+        return self._view_target() <= unwrap(other)
+
+    def __gt__(self, other):
+        return self._view_target() > unwrap(other)
+
+    def __ge__(self, other):
+        return self._view_target() >= unwrap(other)
+
+    def __bool__(self):
+        return bool(self._view_target())
+
+    def __repr__(self):
+        return repr(self._view_target())
+
+    def __str__(self):
+        return str(self._view_target())
+
+    def __format__(self, format_spec):
+        return format(self._view_target(), format_spec)
+
+    def __copy__(self):
+        # shallow copies would share their content with the stored data, always hand out an independent copy
+        return copy.deepcopy(self._view_target())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._view_target(), memo)
+
+    def __reduce_ex__(self, protocol):
+        return self._view_target().__reduce_ex__(protocol)
+
+
+class DictView(DataView, dict):
+    __slots__ = _VIEW_SLOTS
+
+    __hash__ = None
+
+    def _view_sync(self) -> None:
+        dict.clear(self)
+        dict.update(self, self._view_target())
+
+    def _view_mirror(self, key: Any, value: Any) -> None:
+        dict.__setitem__(self, key, value)
+
+    def __getitem__(self, key):
+        return self._view(self._view_target()[key], key)
+
+    def get(self, key, default=None):
+        target: dict = self._view_target()
+        if key in target:
+            return self._view(target[key], key)
+        else:
+            return default
+
+    def __contains__(self, key):
+        return key in self._view_target()
+
+    def __len__(self):
+        return len(self._view_target())
+
+    def __iter__(self):
+        return iter(self._view_target())
+
+    def __reversed__(self):
+        return reversed(self._view_target())
+
+    def keys(self):
+        return self._view_target().keys()
+
+    def values(self):
+        return [self._view(value, key) for key, value in self._view_target().items()]
+
+    def items(self):
+        return [(key, self._view(value, key)) for key, value in self._view_target().items()]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __or__(self, other):
+        return {**self.copy(), **other}
+
+    def __setitem__(self, key, value):
+        value = self._view_insertable(value)
+        self._view_writable()[key] = value
+        dict.__setitem__(self, key, value)
+        self._view_changed(key)
+
+    def __delitem__(self, key):
+        del self._view_writable()[key]
+        dict.__delitem__(self, key)
+        self._view_changed(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, key, *default):
+        if key not in self._view_target():
+            return self._view_target().pop(key, *default)
+        self._view_changed(key)
+        dict.pop(self, key)
+        return self._view_root.view(self._view_writable().pop(key))
+
+    def popitem(self):
+        item: tuple = self._view_writable().popitem()
+        dict.pop(self, item[0])
+        self._view_changed(item[0])
+        return item[0], self._view_root.view(item[1])
+
+    def setdefault(self, key, default=None):
+        if key not in self._view_target():
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        items: dict = {key: self._view_insertable(value) for key, value in dict(*args, **kwargs).items()}
+        self._view_writable().update(items)
+        dict.update(self, items)
+        self._view_changed(*items.keys())
+
+    def clear(self):
+        self._view_changed(*self._view_target().keys())
+        self._view_writable().clear()
+        dict.clear(self)
+
+
+class ListView(DataView, list):
+    __slots__ = _VIEW_SLOTS
+
+    __hash__ = None
+
+    def _view_sync(self) -> None:
+        list.__setitem__(self, slice(None), self._view_target())
+
+    def _view_mirror(self, key: Any, value: Any) -> None:
+        list.__setitem__(self, key, value)
+
+    def __getitem__(self, index):
+        target: list = self._view_target()
+        if isinstance(index, slice):
+            return [self._view(target[item_index], item_index) for item_index in range(len(target))[index]]
+        else:
+            item: Any = target[index]
+            return self._view(item, index if index >= 0 else index + len(target))
+
+    def __contains__(self, item):
+        return unwrap(item) in self._view_target()
+
+    def __len__(self):
+        return len(self._view_target())
+
+    def __iter__(self):
+        return (self._view(item, index) for index, item in enumerate(self._view_target()))
+
+    def __reversed__(self):
+        target: list = self._view_target()
+        return (self._view(target[index], index) for index in reversed(range(len(target))))
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __mul__(self, other):
+        return list(self) * other
+
+    __rmul__ = __mul__
+
+    def index(self, item, *args):
+        return self._view_target().index(unwrap(item), *args)
+
+    def count(self, item):
+        return self._view_target().count(unwrap(item))
+
+    def copy(self):
+        return list(self)
+
+    def __setitem__(self, index, value):
+        value = [self._view_insertable(item) for item in value] if isinstance(index, slice) else self._view_insertable(value)
+        self._view_writable()[index] = value
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        del self._view_writable()[index]
+        list.__delitem__(self, index)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, other):
+        self._view_writable().__imul__(other)
+        self._view_sync()
+        return self
+
+    def append(self, item):
+        item = self._view_insertable(item)
+        self._view_writable().append(item)
+        list.append(self, item)
+
+    def extend(self, items):
+        items = [self._view_insertable(item) for item in items]
+        self._view_writable().extend(items)
+        list.extend(self, items)
+
+    def insert(self, index, item):
+        item = self._view_insertable(item)
+        self._view_writable().insert(index, item)
+        list.insert(self, index, item)
+
+    def pop(self, *index):
+        item: Any = self._view_writable().pop(*index)
+        list.pop(self, *index)
+        return self._view_root.view(item)
+
+    def remove(self, item):
+        self._view_writable().remove(unwrap(item))
+        self._view_sync()
+
+    def clear(self):
+        self._view_writable().clear()
+        list.clear(self)
+
+    def sort(self, *args, **kwargs):
+        self._view_writable().sort(*args, **kwargs)
+        self._view_sync()
+
+    def reverse(self):
+        self._view_writable().reverse()
+        list.reverse(self)
+
+
+class SetView(DataView, set):
+    __slots__ = _VIEW_SLOTS
+
+    __hash__ = None
+
+    def _view_sync(self) -> None:
+        set.clear(self)
+        set.update(self, self._view_target())
+
+    def _view_mirror(self, key: Any, value: Any) -> None:
+        set.discard(self, key)
+        set.add(self, value)
+
+    def _view_items(self, items: set or frozenset) -> set:
+        """
+        :param items: items of the set, e.g. the result of a set operation
+        :return: a set of views of the items
+        """
+
+        return {self._view_root.view(item) for item in items}
+
+    def __contains__(self, item):
+        return unwrap(item) in self._view_target()
+
+    def __len__(self):
+        return len(self._view_target())
+
+    def __iter__(self):
+        return (self._view_root.view(item) for item in self._view_target())
+
+    def __or__(self, other):
+        return self._view_items(self._view_target() | unwrap(other))
+
+    def __and__(self, other):
+        return self._view_items(self._view_target() & unwrap(other))
+
+    def __sub__(self, other):
+        return self._view_items(self._view_target() - unwrap(other))
+
+    def __xor__(self, other):
+        return self._view_items(self._view_target() ^ unwrap(other))
+
+    def union(self, *others):
+        return self._view_items(self._view_target().union(*map(unwrap, others)))
+
+    def intersection(self, *others):
+        return self._view_items(self._view_target().intersection(*map(unwrap, others)))
+
+    def difference(self, *others):
+        return self._view_items(self._view_target().difference(*map(unwrap, others)))
+
+    def symmetric_difference(self, other):
+        return self._view_items(self._view_target().symmetric_difference(unwrap(other)))
+
+    def issubset(self, other):
+        return self._view_target().issubset(unwrap(other))
+
+    def issuperset(self, other):
+        return self._view_target().issuperset(unwrap(other))
+
+    def isdisjoint(self, other):
+        return self._view_target().isdisjoint(unwrap(other))
+
+    def copy(self):
+        return self._view_items(self._view_target())
+
+    def add(self, item):
+        item = self._view_insertable(item)
+        self._view_writable().add(item)
+        set.add(self, item)
+
+    def discard(self, item):
+        item = unwrap(item)
+        self._view_writable().discard(item)
+        set.discard(self, item)
+
+    def remove(self, item):
+        item = unwrap(item)
+        self._view_writable().remove(item)
+        set.discard(self, item)
+
+    def pop(self):
+        item: Any = self._view_writable().pop()
+        set.discard(self, item)
+        return self._view_root.view(item)
+
+    def clear(self):
+        self._view_writable().clear()
+        set.clear(self)
+
+    def update(self, *others):
+        self._view_writable().update(*[[self._view_insertable(item) for item in other] for other in others])
+        self._view_sync()
+
+    def difference_update(self, *others):
+        self._view_writable().difference_update(*map(unwrap, others))
+        self._view_sync()
+
+    def intersection_update(self, *others):
+        self._view_writable().intersection_update(*map(unwrap, others))
+        self._view_sync()
+
+    def symmetric_difference_update(self, other):
+        self._view_writable().symmetric_difference_update(unwrap(other))
+        self._view_sync()
+
+
+class FrozenView(DataView):
+    __slots__ = _VIEW_SLOTS
+
+    def _view_frozen(self) -> tuple or frozenset:
+        """
+        Tuples and frozensets are not handed out as views, but rebuilt containing views of their items, so they are still hashable and operations
+        on them return tuples and frozensets. Their view is the container of the views of their items, copied along with them.
+        :return: a tuple or frozenset of the same type as the object, containing views of its items
+        """
+
+        target: tuple or frozenset = self._view_target()
+        return _rebuild(target, [self._view(item, index) for index, item in enumerate(target)])
+
+
+class ObjectView(DataView):
+    __slots__ = _VIEW_SLOTS
+
+    def __getattribute__(self, name: str):
+        if name in _VIEW_ATTRIBUTES:
+            return object.__getattribute__(self, name)
+
+        target: Any = self._view_target()
+
+        try:
+            return self._view(vars(target)[name], name)
+        except (TypeError, KeyError):
+            pass
+
+        # methods and properties are bound to the view, so modifications made by the object's own methods are copied on write as well
+        klass: type
+        for klass in type(target).__mro__:
+            if name in klass.__dict__:
+                attribute: Any = klass.__dict__[name]
+                if isinstance(attribute, FunctionType):
+                    return MethodType(attribute, self)
+                elif isinstance(attribute, property) and attribute.fget is not None:
+                    return attribute.fget(self)
+                break
+
+        return self._view(getattr(target, name), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._view_writable(), name, self._view_insertable(value))
+
+    def __delattr__(self, name: str):
+        delattr(self._view_writable(), name)
+
+    def __hash__(self):
+        return hash(self._view_target())
+
+    def __len__(self):
+        return len(self._view_target())
+
+    def __iter__(self):
+        return (self._view(item) for item in self._view_target())
+
+    def __contains__(self, item):
+        return unwrap(item) in self._view_target()
+
+
+_VIEW_ATTRIBUTES: FrozenSet[str] = frozenset(
+    {name for klass in (DataView, ObjectView) for name in vars(klass)} - {"__module__", "__qualname__", "__doc__"} | {"__class__"}
+)
+"""attributes of object views that belong to the view itself rather than to the object it represents"""
+
+_object_view_classes: Dict[type, type] = {}
+"""view classes of the classes of objects wrapped so far"""
+
+
+def _object_view_class(cls: type) -> type:
+    """
+    Get the class of views of objects of a class, a subclass of both ObjectView and the class, so views pass isinstance() checks
+    :param cls: the class of the object
+    :return: the view class, ObjectView itself if it can not be combined with cls (e.g. as cls uses __slots__ itself)
+    """
+
+    view_class: type or None = _object_view_classes.get(cls)
+    if view_class is None:
+        try:
+            view_class = type(cls.__name__, (ObjectView, cls), {"__slots__": (), "__module__": cls.__module__, "__qualname__": cls.__qualname__})
+        except TypeError:
+            view_class = ObjectView
+        _object_view_classes[cls] = view_class
+    return view_class
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RoomQueue:
+    def __init__(self):
+        """
+        Jobs waiting to be run for a single room, along with statistics about them
+        """
+
+        self.jobs: Deque[Tuple[float, Callable[[], Awaitable]]] = deque()
+        """pending jobs along with the time they have been submitted at"""
+        self.scheduled: bool = False
+        """whether the room is waiting for or being served by a worker"""
+
+        # statistics
+        self.processed: int = 0
+        self.dropped: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+
+
+class Dispatcher:
+    def __init__(self, max_workers: int = 8, max_in_flight: int = 100, max_queued_per_room: int = 100):
+        """
+        Runs jobs (e.g. commands) outside of the sync callbacks.
+        Jobs are queued per room and run by a bounded pool of workers. Each room is served by at most one worker at a time, so jobs of a room are
+        run strictly in the order they have been submitted in, while different rooms progress in parallel.
+        Submitting a job never waits, so the sync loop is not held up by busy rooms. Once max_queued_per_room jobs of a room are waiting, further
+        jobs of the room are dropped.
+        :param max_workers: number of rooms served concurrently
+        :param max_in_flight: maximum number of jobs running at the same time, workers wait for one of them to finish before starting another one
+        :param max_queued_per_room: maximum number of jobs of a single room waiting to be run
+        """
+
+        self.max_workers: int = max_workers
+        self.max_in_flight: int = max_in_flight
+        self.max_queued_per_room: int = max_queued_per_room
+        self.rooms: Dict[str, RoomQueue] = {}
+        self.workers: List[asyncio.Task] = []
+        self.ready: asyncio.Queue or None = None
+        """rooms with pending jobs not being served by a worker"""
+        self.in_flight: asyncio.Semaphore or None = None
+
+        # statistics
+        self.running: int = 0
+        self.processed: int = 0
+        self.failed: int = 0
+        self.dropped: int = 0
+        self.max_depth: int = 0
+
+    def __start(self) -> None:
+        """
+        Start the workers, needs to be called from within the running event loop
+        :return:
+        """
+
+        self.ready = asyncio.Queue()
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.workers = [asyncio.get_running_loop().create_task(self.__work()) for _ in range(self.max_workers)]
+
+    def submit(self, room_id: str, job: Callable[[], Awaitable]) -> bool:
+        """
+        Queue a job to be run after all jobs previously submitted for the room, needs to be called from within the running event loop
+        :param room_id: the room the job belongs to
+        :param job: callable returning the awaitable to run
+        :return:    True, if the job has been queued
+                    False, if it has been dropped as too many jobs of the room are waiting
+        """
+
+        if self.ready is None:
+            self.__start()
+
+        room: RoomQueue = self.rooms.setdefault(room_id, RoomQueue())
+        if len(room.jobs) >= self.max_queued_per_room:
+            room.dropped += 1
+            self.dropped += 1
+            logger.warning(f"Dropped job in room {room_id}, {len(room.jobs)} jobs are already waiting")
+            return False
+
+        room.jobs.append((time.monotonic(), job))
+        self.max_depth = max(self.max_depth, len(room.jobs))
+        if not room.scheduled:
+            room.scheduled = True
+            self.ready.put_nowait(room_id)
+        return True
+
+    async def __work(self) -> None:
+        """
+        Serve rooms with pending jobs, one job at a time
+        :return:
+        """
+
+        while True:
+            room_id: str = await self.ready.get()
+            room: RoomQueue = self.rooms[room_id]
+            # the job is only taken from the room's queue once it may be run, so it counts towards the room's limit until then
+            await self.in_flight.acquire()
+            submitted, job = room.jobs.popleft()
+
+            wait: float = time.monotonic() - submitted
+            room.total_wait += wait
+            room.max_wait = max(room.max_wait, wait)
+            self.running += 1
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.critical(f"Job failed to catch exception in room {room_id}:")
+                traceback.print_exc()
+            finally:
+                self.running -= 1
+                room.processed += 1
+                self.processed += 1
+                self.in_flight.release()
+
+                # requeue the room behind all other rooms with pending jobs, so busy rooms do not starve others
+                if room.jobs:
+                    self.ready.put_nowait(room_id)
+                else:
+                    room.scheduled = False
+
+    def queued(self) -> int:
+        """
+        :return: number of jobs waiting to be run
+        """
+
+        return sum(len(room.jobs) for room in self.rooms.values())
+
+    async def close(self) -> None:
+        """
+        Stop all workers, dropping jobs still waiting to be run, e.g. on shutdown
+        :return:
+        """
+
+        if self.queued():
+            logger.warning(f"Dropping {self.queued()} queued jobs")
+
+        worker: asyncio.Task
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        :return: statistics about the dispatcher
+        """
+
+        return {
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "max queue depth": self.max_depth,
+        }
+
+    def get_room_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: statistics about the queue of each room, by room_id
+        """
+
+        return {
+            room_id: {
+                "queued": len(room.jobs),
+                "processed": room.processed,
+                "dropped": room.dropped,
+                "avg wait (ms)": round(room.total_wait / room.processed * 1000, 1) if room.processed else 0.0,
+                "max wait (ms)": round(room.max_wait * 1000, 1),
+            }
+            for room_id, room in self.rooms.items()
+        }
@@ -0,0 +1,212 @@
+import logging
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Tuple
+
+if TYPE_CHECKING:
+    from core.plugin import Plugin, PluginHook
+
+logger = logging.getLogger(__name__)
+
+Position = Tuple[int, int]
+"""position of a hook in the order of all hooks: the position of its plugin and the number of hooks indexed before it"""
+
+
+class EventTypeHooks:
+    def __init__(self):
+        """
+        All hooks registered for a single event_type, grouped by what they are restricted to.
+        Hooks are stored along with their position in the order of all hooks, given by the order of their plugins and the order they have been
+        registered in, so hooks of different groups can be run in that order, and the plugin they belong to.
+        """
+
+        self.global_hooks: List[Tuple[Position, "Plugin", "PluginHook"]] = []
+        """hooks valid in all rooms and for all events"""
+
+        self.room_hooks: Dict[str, List[Tuple[Position, "Plugin", "PluginHook"]]] = {}
+        """hooks restricted to specific rooms, by room_id"""
+
+        self.event_hooks: Dict[str, List[Tuple[Position, "Plugin", "PluginHook", FrozenSet[str] or None]]] = {}
+        """hooks restricted to events relating to specific events, by the related event_id, along with the rooms they are restricted to"""
+
+
+class HookIndex:
+    def __init__(self, plugins: Dict[str, "Plugin"]):
+        """
+        Index of the hooks of all plugins, by event_type, room_id and related event_id, so finding the hooks to run for an event only takes a few
+        lookups. Plugins update the index whenever they add, modify or remove a hook, which only touches the lists the hook is contained in.
+        When invalidated, e.g. after a plugin's hooks have been restored from its state, the index is rebuilt on next use.
+        :param plugins: all loaded plugins, by name
+        """
+
+        self.plugins: Dict[str, "Plugin"] = plugins
+        self.index: Dict[str, EventTypeHooks] or None = None
+        self.indexed: Dict[int, Tuple["PluginHook", str, Position, FrozenSet[str], FrozenSet[str]]] = {}
+        """each indexed hook along with its event_type, position and the event_ids and room_ids it has been indexed by, by id of the hook"""
+        self.plugin_positions: Dict[int, int] = {}
+        """position of each plugin in the order of all plugins, by id of the plugin"""
+        self.next_position: int = 0
+        self.rebuilds: int = 0
+        self.updates: int = 0
+
+    def invalidate(self) -> None:
+        """
+        Mark the index as outdated after hooks have been changed in ways not reported by update(), it is rebuilt on next use
+        :return:
+        """
+
+        self.index = None
+
+    def update(self, plugin: "Plugin", hook: "PluginHook") -> None:
+        """
+        Update the index after a single hook has been added, modified (e.g. rooms added or removed) or removed. A modified hook keeps its
+        position in the order of all hooks, an added one is run after the hooks its plugin added before, as if the index had been rebuilt.
+        :param plugin: the plugin the hook belongs to
+        :param hook: the hook
+        :return:
+        """
+
+        if self.index is None:
+            return
+
+        if id(plugin) not in self.plugin_positions:
+            # the plugin has been loaded after the index has been built
+            self.invalidate()
+            return
+
+        position: Position or None = self.__remove(self.index, hook)
+        if any(registered is hook for registered in plugin._get_hooks().get(hook.event_type, [])):
+            if position is None:
+                position = (self.plugin_positions[id(plugin)], self.next_position)
+                self.next_position += 1
+            self.__insert(self.index, hook.event_type, position, plugin, hook)
+        self.updates += 1
+
+    def __insert(self, index: Dict[str, EventTypeHooks], event_type: str, position: Position, plugin: "Plugin", hook: "PluginHook") -> None:
+        """
+        Add a hook to the lists of all events and rooms it is restricted to, keeping the lists ordered by position
+        :param index: the index to add the hook to
+        :param event_type: the event_type the hook is registered for
+        :param position: the hook's position in the order of all hooks
+        :param plugin: the plugin the hook belongs to
+        :param hook: the hook
+        :return:
+        """
+
+        event_type_hooks: EventTypeHooks = index.setdefault(event_type, EventTypeHooks())
+        event_ids: FrozenSet[str] = frozenset(hook.event_ids or ())
+        room_ids: FrozenSet[str] = frozenset(hook.room_id_list or ())
+
+        if event_ids:
+            event_id: str
+            for event_id in event_ids:
+                self.__insort(event_type_hooks.event_hooks.setdefault(event_id, []), (position, plugin, hook, room_ids or None))
+        elif room_ids:
+            room_id: str
+            for room_id in room_ids:
+                self.__insort(event_type_hooks.room_hooks.setdefault(room_id, []), (position, plugin, hook))
+        else:
+            self.__insort(event_type_hooks.global_hooks, (position, plugin, hook))
+        self.indexed[id(hook)] = (hook, event_type, position, event_ids, room_ids)
+
+    @staticmethod
+    def __insort(hooks: List[tuple], entry: tuple) -> None:
+        """
+        Insert an entry into a list of hooks ordered by position, usually at its end
+        :param hooks: the list
+        :param entry: the entry, starting with the hook's position
+        :return:
+        """
+
+        index: int = len(hooks)
+        while index > 0 and hooks[index - 1][0] > entry[0]:
+            index -= 1
+        hooks.insert(index, entry)
+
+    def __remove(self, index: Dict[str, EventTypeHooks], hook: "PluginHook") -> Position or None:
+        """
+        Remove a hook from all lists it has been added to
+        :param index: the index to remove the hook from
+        :param hook: the hook
+        :return: the hook's position, None if it has not been indexed
+        """
+
+        indexed: Tuple["PluginHook", str, Position, FrozenSet[str], FrozenSet[str]] or None = self.indexed.pop(id(hook), None)
+        if indexed is None:
+            return None
+        _, event_type, position, event_ids, room_ids = indexed
+
+        event_type_hooks: EventTypeHooks = index[event_type]
+        buckets: Dict[str, List[tuple]]
+        keys: FrozenSet[str]
+        if event_ids:
+            buckets, keys = event_type_hooks.event_hooks, event_ids
+        elif room_ids:
+            buckets, keys = event_type_hooks.room_hooks, room_ids
+        else:
+            event_type_hooks.global_hooks = [entry for entry in event_type_hooks.global_hooks if entry[2] is not hook]
+            buckets, keys = {}, frozenset()
+
+        key: str
+        for key in keys:
+            remaining: List[tuple] = [entry for entry in buckets[key] if entry[2] is not hook]
+            if remaining:
+                buckets[key] = remaining
+            else:
+                del buckets[key]
+
+        if not event_type_hooks.global_hooks and not event_type_hooks.room_hooks and not event_type_hooks.event_hooks:
+            del index[event_type]
+        return position
+
+    def __build(self) -> Dict[str, EventTypeHooks]:
+        """
+        Build the index from all plugins' hooks
+        :return: the index
+        """
+
+        index: Dict[str, EventTypeHooks] = {}
+        self.indexed = {}
+        self.plugin_positions = {}
+        self.next_position = 0
+
+        plugin: "Plugin"
+        for plugin in self.plugins.values():
+            self.plugin_positions[id(plugin)] = len(self.plugin_positions)
+            event_type: str
+            hooks: List["PluginHook"]
+            for event_type, hooks in plugin._get_hooks().items():
+                hook: "PluginHook"
+                for hook in hooks:
+                    self.__insert(index, event_type, (self.plugin_positions[id(plugin)], self.next_position), plugin, hook)
+                    self.next_position += 1
+
+        self.rebuilds += 1
+        logger.debug(f"Rebuilt hook index with {self.next_position} hooks")
+        return index
+
+    def get_hooks(self, event_type: str, room_id: str, relates_to: str or None = None) -> List[Tuple["Plugin", "PluginHook"]]:
+        """
+        Get all hooks to run for an event
+        :param event_type: the type of the event
+        :param room_id: the room the event has been sent to
+        :param relates_to: the event_id of the event the event relates to, if any
+        :return: all applicable hooks along with the plugin they belong to, in the order they have been registered in
+        """
+
+        if self.index is None:
+            self.index = self.__build()
+
+        event_type_hooks: EventTypeHooks or None = self.index.get(event_type)
+        if event_type_hooks is None:
+            return []
+
+        hooks: List[Tuple[Position, "Plugin", "PluginHook"]] = event_type_hooks.global_hooks + event_type_hooks.room_hooks.get(room_id, [])
+        if relates_to is not None and relates_to in event_type_hooks.event_hooks:
+            hooks += [
+                (position, plugin, hook)
+                for position, plugin, hook, room_ids in event_type_hooks.event_hooks[relates_to]
+                if room_ids is None or room_id in room_ids
+            ]
+
+        if len(hooks) > 1 and (event_type_hooks.room_hooks or event_type_hooks.event_hooks):
+            hooks.sort(key=lambda item: item[0])
+        return [(plugin, hook) for position, plugin, hook in hooks]
@@ -0,0 +1,107 @@
+from typing import Dict
+
+from core.sqlite_cache import SQLiteCache
+
+
+class CachedMedia:
+    def __init__(self, content_uri: str, mime_type: str, size: int, width: int, height: int, blurhash: str):
+        """
+        Media uploaded to the media repository before, along with the information needed to post it again
+        :param content_uri: the mxc-uri of the upload
+        :param mime_type: mime type of the media
+        :param size: size of the media in bytes
+        :param width: width of the image in pixels
+        :param height: height of the image in pixels
+        :param blurhash: blurhash of the image
+        """
+
+        self.content_uri: str = content_uri
+        self.mime_type: str = mime_type
+        self.size: int = size
+        self.width: int = width
+        self.height: int = height
+        self.blurhash: str = blurhash
+
+
+class MediaCache(SQLiteCache):
+    name = "media cache"
+    table = "media"
+    key_column = "hash"
+    columns = {
+        "content_uri": "TEXT NOT NULL",
+        "mime_type": "TEXT NOT NULL",
+        "size": "INTEGER NOT NULL",
+        "width": "INTEGER NOT NULL",
+        "height": "INTEGER NOT NULL",
+        "blurhash": "TEXT NOT NULL",
+    }
+    entry_type = CachedMedia
+
+    def __init__(self, filename: str or None = None, max_entries: int = 1000, max_size: int or None = None):
+        """
+        Cache of uploaded media by the hash of their content, so posting the same media again does not upload it again.
+        The least recently used entries are evicted once there are more than max_entries entries or the media referenced exceeds max_size bytes.
+        :param filename: the database to persist the cache in, None to keep it in memory only
+        :param max_entries: maximum number of entries
+        :param max_size: maximum total size of the media referenced by all entries in bytes, None for no limit
+        """
+
+        self.max_size: int or None = max_size
+        self.size: int = 0
+        super().__init__(filename, max_entries)
+
+    def configure(self, filename: str or None, max_entries: int, max_size: int or None = None) -> None:
+        """
+        Apply the bot's configuration
+        :param filename: the database to persist the cache in, None to keep it in memory only
+        :param max_entries: maximum number of entries
+        :param max_size: maximum total size of the media referenced by all entries in bytes, None for no limit
+        :return:
+        """
+
+        self.max_size = max_size
+        super().configure(filename, max_entries)
+
+    def get(self, content_hash: str) -> CachedMedia or None:
+        """
+        Look up media by the hash of its content
+        :param content_hash: the hash
+        :return: the cached media, None if it has not been cached
+        """
+
+        return super().get(content_hash)
+
+    def put(self, content_hash: str, media: CachedMedia) -> None:
+        """
+        Add uploaded media to the cache
+        :param content_hash: hash of the media's content
+        :param media: the uploaded media
+        :return:
+        """
+
+        super().put(content_hash, media)
+
+    def _added(self, media: CachedMedia) -> None:
+        self.size += media.size
+
+    def _removed(self, media: CachedMedia) -> None:
+        self.size -= media.size
+
+    def _cleared(self) -> None:
+        self.size = 0
+
+    def _exceeds_limits(self) -> bool:
+        return self.max_size is not None and self.size > self.max_size
+
+    def get_stats(self) -> Dict[str, int or float]:
+        """
+        :return: statistics about the cache
+        """
+
+        stats: Dict[str, int or float] = super().get_stats()
+        stats["size (bytes)"] = self.size
+        return stats
+
+
+media_cache: MediaCache = MediaCache()
+"""cache of all media uploaded by the bot"""
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from nio import AsyncClient, JoinedMembersResponse, RoomMember, RoomMemberEvent
+
+logger = logging.getLogger(__name__)
+
+
+class RoomMembers:
+    def __init__(self, members: List[RoomMember]):
+        """
+        The joined members of a single room
+        :param members: the members as returned by the server
+        """
+
+        self.members: Dict[str, RoomMember] = {member.user_id: member for member in members}
+        """members by user_id"""
+        self.loaded: float = time.monotonic()
+        self.__all: Tuple[RoomMember, ...] or None = None
+        """all members, built on first use after a change"""
+
+    def get_all(self) -> Tuple[RoomMember, ...]:
+        """
+        :return: all members of the room, not copied again until they change
+        """
+
+        if self.__all is None:
+            self.__all = tuple(self.members.values())
+        return self.__all
+
+    def put(self, member: RoomMember) -> None:
+        """
+        Add a member or replace it by its new version, e.g. after a change of displayname
+        :param member: the member
+        :return:
+        """
+
+        self.members[member.user_id] = member
+        self.__all = None
+
+    def remove(self, user_id: str) -> None:
+        """
+        Remove a member, if it is a member of the room
+        :param user_id: the user_id of the member
+        :return:
+        """
+
+        if self.members.pop(user_id, None) is not None:
+            self.__all = None
+
+
+class MemberDirectory:
+    def __init__(self, ttl: float = 3600):
+        """
+        Joined members of all rooms, so looking up users does not need to ask the server every time.
+        A room's members are fetched once when they are first needed and then kept up to date from the m.room.member events received by sync.
+        As a safety net against missed events, they are fetched again once they are older than ttl seconds.
+        :param ttl: seconds after which a room's members are fetched again, 0 to keep them until the room is invalidated
+        """
+
+        self.ttl: float = ttl
+        self.rooms: Dict[str, RoomMembers] = {}
+        """members by room_id"""
+        self.loading: Dict[str, asyncio.Future] = {}
+        """rooms whose members are being fetched, so concurrent lookups share a single request"""
+        self.pending: Dict[str, List[RoomMemberEvent]] = {}
+        """membership changes received while a room's members are being fetched (initially or again), applied to the fetched members"""
+
+        # statistics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.updates: int = 0
+
+    def configure(self, ttl: float) -> None:
+        """
+        Apply the bot's configuration
+        :param ttl: seconds after which a room's members are fetched again, 0 to keep them until the room is invalidated
+        :return:
+        """
+
+        self.ttl = ttl
+
+    async def get_members(self, client: AsyncClient, room_id: str) -> Tuple[RoomMember, ...]:
+        """
+        Get the joined members of a room, fetching them from the server if they are not known or outdated
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) the room
+        :return: the members of the room, empty if they could not be fetched
+        """
+
+        room: RoomMembers or None = await self.__get_room(client, room_id)
+        return room.get_all() if room is not None else ()
+
+    async def get_member(self, client: AsyncClient, room_id: str, user_id: str) -> RoomMember or None:
+        """
+        Get a joined member of a room by their user_id
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) the room
+        :param user_id: (str) the user
+        :return: the member, None if the user is not a member of the room
+        """
+
+        room: RoomMembers or None = await self.__get_room(client, room_id)
+        return room.members.get(user_id) if room is not None else None
+
+    async def __get_room(self, client: AsyncClient, room_id: str) -> RoomMembers or None:
+        """
+        Get the joined members of a room, fetching them from the server if they are not known or outdated
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) the room
+        :return: the members of the room, None if they could not be fetched
+        """
+
+        room: RoomMembers or None = self.rooms.get(room_id)
+        if room is not None and (self.ttl <= 0 or time.monotonic() - room.loaded < self.ttl):
+            self.hits += 1
+            return room
+
+        self.misses += 1
+        if room_id not in self.loading:
+            self.loading[room_id] = asyncio.get_running_loop().create_task(self.__load(client, room_id))
+        # shielded, so a caller giving up does not cancel loading the members for all others
+        return await asyncio.shield(self.loading[room_id])
+
+    async def __load(self, client: AsyncClient, room_id: str) -> RoomMembers or None:
+        """
+        Fetch the joined members of a room from the server
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) the room
+        :return: the members of the room, None if they could not be fetched
+        """
+
+        # membership changes are buffered from now on, no matter whether the room's members are known already (and outdated) or not
+        self.pending[room_id] = []
+        try:
+            response: JoinedMembersResponse = await client.joined_members(room_id)
+            if not isinstance(response, JoinedMembersResponse):
+                logger.warning(f"Could not fetch members of {room_id}: {response}")
+                return None
+
+            room: RoomMembers = RoomMembers(response.members)
+            events: List[RoomMemberEvent] or None = self.pending.get(room_id)
+            if events is None:
+                # the room has been invalidated meanwhile, answer the waiting lookups but do not keep the members
+                return room
+            # sync might have delivered membership changes the response does not include yet
+            event: RoomMemberEvent
+            for event in events:
+                self.__apply(room, event)
+            self.rooms[room_id] = room
+            return room
+        finally:
+            del self.loading[room_id]
+            self.pending.pop(room_id, None)
+
+    def update(self, room_id: str, event: RoomMemberEvent) -> None:
+        """
+        Apply a membership change to the members of a room, if they are known or being fetched
+        :param room_id: (str) the room the event has been sent to
+        :param event: (nio.RoomMemberEvent) the membership change
+        :return:
+        """
+
+        if room_id in self.pending:
+            # the members being fetched replace the known ones, the change is applied to them once they arrive
+            self.pending[room_id].append(event)
+        room: RoomMembers or None = self.rooms.get(room_id)
+        if room is not None:
+            self.__apply(room, event)
+        if room is not None or room_id in self.pending:
+            self.updates += 1
+
+    def __apply(self, room: RoomMembers, event: RoomMemberEvent) -> None:
+        """
+        Apply a membership change to the members of a room
+        :param room: the members of the room
+        :param event: (nio.RoomMemberEvent) the membership change
+        :return:
+        """
+
+        if event.membership == "join":
+            # also covers changes of displayname and avatar
+            room.put(RoomMember(event.state_key, event.content.get("displayname"), event.content.get("avatar_url")))
+        else:
+            room.remove(event.state_key)
+
+    def invalidate(self, room_id: str) -> None:
+        """
+        Forget the members of a room, so they are fetched again when needed next
+        :param room_id: (str) the room
+        :return:
+        """
+
+        self.rooms.pop(room_id, None)
+        # members being fetched right now are not kept either
+        self.pending.pop(room_id, None)
+
+    def get_stats(self) -> Dict[str, int or float]:
+        """
+        :return: statistics about the directory
+        """
+
+        return {
+            "rooms": len(self.rooms),
+            "members": sum(len(room.members) for room in self.rooms.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit rate (%)": round(self.hits / (self.hits + self.misses) * 100, 1) if self.hits + self.misses else 0.0,
+            "updates": self.updates,
+        }
+
+
+member_directory: MemberDirectory = MemberDirectory()
+"""joined members of all rooms the bot is in"""
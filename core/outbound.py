@@ -0,0 +1,376 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Set, Tuple, Type
+
+from aiohttp import ClientError
+from nio import AsyncClient, RoomSendError, RoomSendResponse
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0
+"""messages sent in response to users, e.g. by commands and hooks"""
+PRIORITY_BROADCAST = 1
+"""messages sent on the bot's own initiative, e.g. by timers"""
+PRIORITY_REACTION = 2
+"""reactions"""
+
+RETRY_DELAY: float = 3.0
+"""time in seconds to wait before retrying an event after an error, doubled with every further retry"""
+
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (asyncio.TimeoutError, ClientError, OSError)
+"""exceptions raised while sending an event (timeouts, connection errors) after which the event is retried"""
+
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_REPLY)
+"""priority of messages sent from the current context, set by whatever runs plugin code (e.g. the timer scheduler)"""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        Rate limit allowing bursts of up to `burst` events, refilled by `rate` events per second
+        :param rate: events per second
+        :param burst: maximum number of events at once
+        """
+
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+
+    def __refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available_at(self, now: float) -> float:
+        """
+        :param now: the current (monotonic) time
+        :return: the (monotonic) time a token is available at, now if there is one available already
+        """
+
+        self.__refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """
+        Consume a token, make sure one is available using available_at() first
+        :param now: the current (monotonic) time
+        :return:
+        """
+
+        self.__refill(now)
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    def __init__(
+        self, client: AsyncClient, room_id: str, message_type: str, content: Dict[str, Any], tx_id: str, ignore_unverified_devices: bool, priority: int
+    ):
+        """
+        An event waiting to be sent. Its transaction id is kept for all retries, so the homeserver does not accept it more than once.
+        """
+
+        self.client: AsyncClient = client
+        self.room_id: str = room_id
+        self.message_type: str = message_type
+        self.content: Dict[str, Any] = content
+        self.tx_id: str = tx_id
+        self.ignore_unverified_devices: bool = ignore_unverified_devices
+        self.priority: int = priority
+        self.ordered: bool = message_type != "m.reaction"
+        """whether the event needs to be sent in order with other events of the room, reactions do not"""
+        self.submitted: float = time.monotonic()
+        self.not_before: float = 0.0
+        """(monotonic) time to wait for before retrying"""
+        self.retries: int = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class RoomOutbox:
+    def __init__(self, rate: float, burst: int):
+        """
+        Events waiting to be sent to a single room, ordered by priority and the order they have been submitted in
+        """
+
+        self.pending: List[Tuple[int, int, OutboundMessage]] = []
+        self.bucket: TokenBucket = TokenBucket(rate, burst)
+        self.sending: int = 0
+        """number of events being sent to the room"""
+        self.sending_ordered: bool = False
+        """whether one of them is an ordered event"""
+
+    def can_send(self, message: OutboundMessage) -> bool:
+        """
+        Ordered events of a room are sent one after another, reactions may be sent concurrently with each other (but not with ordered events)
+        :param message: the next event to send to the room
+        :return: whether the event can be sent now
+        """
+
+        if message.ordered:
+            return self.sending == 0
+        return not self.sending_ordered
+
+
+class OutboundQueue:
+    def __init__(self, room_rate: float = 4.0, room_burst: int = 8, global_rate: float = 10.0, global_burst: int = 20, max_retries: int = 3):
+        """
+        Sends all events of the bot.
+        Events are queued per room and sent by a background task, limited by a token bucket per room and a global one. When the global limit is
+        reached, events of higher priority (replies before broadcasts before reactions) are sent first. Rate limits reported by the homeserver
+        and other errors (including timeouts and connection errors) are handled by retrying the event with the same transaction id, callers only
+        wait for the result and never sleep themselves.
+        :param room_rate: events per second per room
+        :param room_burst: maximum number of events sent to a room at once
+        :param global_rate: events per second across all rooms
+        :param global_burst: maximum number of events sent at once across all rooms
+        :param max_retries: number of times to retry sending an event
+        """
+
+        self.room_rate: float = room_rate
+        self.room_burst: int = room_burst
+        self.global_bucket: TokenBucket = TokenBucket(global_rate, global_burst)
+        self.max_retries: int = max_retries
+        self.rooms: Dict[str, RoomOutbox] = {}
+        self.sequence = itertools.count()
+        self.wakeup: asyncio.Event or None = None
+        self.task: asyncio.Task or None = None
+        self.sending_tasks: Set[asyncio.Task] = set()
+
+        # statistics
+        self.sent: int = 0
+        self.retried: int = 0
+        self.rate_limited: int = 0
+        self.failed: int = 0
+        self.max_wait: float = 0.0
+
+    def configure(self, room_rate: float, room_burst: int, global_rate: float, global_burst: int) -> None:
+        """
+        Apply the bot's configuration
+        :param room_rate: events per second per room
+        :param room_burst: maximum number of events sent to a room at once
+        :param global_rate: events per second across all rooms
+        :param global_burst: maximum number of events sent at once across all rooms
+        :return:
+        """
+
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.rooms = {room_id: room for room_id, room in self.rooms.items() if room.pending or room.sending}
+
+    async def send(
+        self,
+        client: AsyncClient,
+        room_id: str,
+        message_type: str,
+        content: Dict[str, Any],
+        tx_id: str or None = None,
+        ignore_unverified_devices: bool = False,
+        priority: int or None = None,
+    ) -> RoomSendResponse or RoomSendError:
+        """
+        Queue an event and wait for it to be sent
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) The room id of the room where the event should be sent to.
+        :param message_type: (str) A string identifying the type of the event.
+        :param content: (dict) A dictionary containing the content of the event.
+        :param tx_id: (str) The transaction ID of the event, generated if not given
+        :param ignore_unverified_devices: (bool) Whether to ignore unverified devices in encrypted rooms
+        :param priority: one of PRIORITY_REPLY, PRIORITY_BROADCAST, PRIORITY_REACTION, defaults to the priority of the current context
+                         (reactions always default to PRIORITY_REACTION)
+        :return: the response of the homeserver, a RoomSendError if the event could not be sent after all retries
+        """
+
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.__run())
+
+        if priority is None:
+            priority = PRIORITY_REACTION if message_type == "m.reaction" else send_priority.get()
+        message: OutboundMessage = OutboundMessage(client, room_id, message_type, content, tx_id or uuid.uuid4().hex, ignore_unverified_devices, priority)
+
+        room: RoomOutbox = self.rooms.setdefault(room_id, RoomOutbox(self.room_rate, self.room_burst))
+        heapq.heappush(room.pending, (priority, next(self.sequence), message))
+        self.wakeup.set()
+
+        return await message.future
+
+    async def __run(self) -> None:
+        """
+        Send the next event as soon as the rate limits allow to
+        :return:
+        """
+
+        while True:
+            now: float = time.monotonic()
+            next_room: RoomOutbox or None = None
+            wake_at: float or None = None
+
+            # pick the event of highest priority among all rooms ready to send
+            room: RoomOutbox
+            for room in self.rooms.values():
+                # drop events the caller is no longer waiting for
+                while room.pending and room.pending[0][2].future.cancelled():
+                    heapq.heappop(room.pending)
+                if not room.pending or not room.can_send(room.pending[0][2]):
+                    continue
+                message: OutboundMessage = room.pending[0][2]
+                ready_at: float = max(message.not_before, room.bucket.available_at(now))
+                if ready_at > now:
+                    wake_at = ready_at if wake_at is None else min(wake_at, ready_at)
+                elif next_room is None or room.pending[0][:2] < next_room.pending[0][:2]:
+                    next_room = room
+
+            if next_room is not None:
+                global_ready_at: float = self.global_bucket.available_at(now)
+                if global_ready_at > now:
+                    wake_at = global_ready_at if wake_at is None else min(wake_at, global_ready_at)
+                else:
+                    self.global_bucket.take(now)
+                    next_room.bucket.take(now)
+                    entry: Tuple[int, int, OutboundMessage] = heapq.heappop(next_room.pending)
+                    next_room.sending += 1
+                    next_room.sending_ordered = next_room.sending_ordered or entry[2].ordered
+                    task: asyncio.Task = asyncio.get_running_loop().create_task(self.__send(next_room, entry))
+                    self.sending_tasks.add(task)
+                    task.add_done_callback(self.sending_tasks.discard)
+                    continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=None if wake_at is None else max(wake_at - now, 0.001))
+            except asyncio.TimeoutError:
+                pass
+
+    async def __send(self, room: RoomOutbox, entry: Tuple[int, int, OutboundMessage]) -> None:
+        """
+        Send a single event, requeue it if it needs to be retried
+        :param room: the room's outbox
+        :param entry: the event's entry in the outbox
+        :return:
+        """
+
+        message: OutboundMessage = entry[2]
+        if message.retries == 0:
+            self.max_wait = max(self.max_wait, time.monotonic() - message.submitted)
+
+        error: BaseException or None = None
+        try:
+            response: RoomSendResponse or RoomSendError or None = await message.client.room_send(
+                message.room_id, message.message_type, message.content, message.tx_id, message.ignore_unverified_devices
+            )
+        except asyncio.CancelledError:
+            message.future.cancel()
+            raise
+        except TRANSIENT_ERRORS as err:
+            error = err
+            response = None
+        except Exception as err:
+            self.failed += 1
+            if not message.future.done():
+                message.future.set_exception(err)
+            response = None
+
+        if (isinstance(response, RoomSendError) or error is not None) and message.retries < self.max_retries:
+            message.retries += 1
+            self.retried += 1
+            if isinstance(response, RoomSendError) and response.status_code == "M_LIMIT_EXCEEDED":
+                # we're being rate-limited, try again after the given time
+                self.rate_limited += 1
+                retry_after: float = math.ceil((response.retry_after_ms or 1000) / 1000)
+                logger.warning(
+                    f"Ratelimit hit with {message.message_type} to {message.room_id}! Server is asking us to wait {response.retry_after_ms}ms. "
+                    f"Sending again in {retry_after}s (Retry: {message.retries}/{self.max_retries})."
+                )
+            else:
+                # timeouts, connection errors or unknown errors, back off further with every retry. The transaction id stays the same, so the
+                # event is not sent twice if it has reached the homeserver before.
+                retry_after: float = RETRY_DELAY * 2 ** (message.retries - 1)
+                reason: str = "Unknown error" if error is None else f"{type(error).__name__} ({error})"
+                logger.warning(
+                    f"{reason} sending {message.message_type} to {message.room_id}. Retrying in {retry_after} sec ({message.retries}/{self.max_retries})."
+                )
+            message.not_before = time.monotonic() + retry_after
+            heapq.heappush(room.pending, entry)
+
+        elif error is not None:
+            self.failed += 1
+            logger.warning(
+                f"Could not send {message.message_type} to {message.room_id} after {message.retries} retries: {type(error).__name__} ({error}). "
+                f"Giving up. Message {message.content.get('body')} is lost!"
+            )
+            if not message.future.done():
+                message.future.set_exception(error)
+
+        elif response is not None:
+            if isinstance(response, RoomSendError):
+                self.failed += 1
+                logger.warning(
+                    f"Could not send {message.message_type} to {message.room_id} after {message.retries} retries. Giving up. "
+                    f"Message {message.content.get('body')} is lost!"
+                )
+            else:
+                self.sent += 1
+            if not message.future.done():
+                message.future.set_result(response)
+
+        room.sending -= 1
+        if message.ordered:
+            room.sending_ordered = False
+        self.wakeup.set()
+
+    def queued(self) -> int:
+        """
+        :return: number of events waiting to be sent
+        """
+
+        return sum(len(room.pending) for room in self.rooms.values())
+
+    async def close(self) -> None:
+        """
+        Stop sending, events still waiting to be sent are dropped, e.g. on shutdown
+        :return:
+        """
+
+        if self.queued():
+            logger.warning(f"Dropping {self.queued()} unsent events")
+
+        tasks: List[asyncio.Task] = list(self.sending_tasks)
+        if self.task is not None:
+            tasks.append(self.task)
+            self.task = None
+        task: asyncio.Task
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        room: RoomOutbox
+        for room in self.rooms.values():
+            for _, _, message in room.pending:
+                message.future.cancel()
+            room.pending = []
+
+    def get_stats(self) -> Dict[str, int or float]:
+        """
+        :return: statistics about the queue
+        """
+
+        return {
+            "queued": self.queued(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "rate limited": self.rate_limited,
+            "failed": self.failed,
+            "max wait (ms)": round(self.max_wait * 1000, 1),
+        }
+
+
+outbound_queue: OutboundQueue = OutboundQueue()
+"""the queue all events are sent through"""
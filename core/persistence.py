@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY: float = 60.0
+"""maximum time in seconds to wait before retrying failed writes"""
+
+
+def write_file_atomic(filename: str, content: str or bytes) -> None:
+    """
+    Write content to a file without ever leaving a partially written file behind: write a temporary file next to it, fsync it and rename it
+    to the actual filename
+    :param filename: the file to write
+    :param content: the content to write
+    :return:
+    """
+
+    directory: str = os.path.dirname(filename) or "."
+    fd, temp_filename = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content.encode("utf-8") if isinstance(content, str) else content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+    # make sure the rename itself is persisted
+    try:
+        dir_fd: int = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        # not supported on all platforms (e.g. windows)
+        pass
+
+
+class PersistenceWorker:
+    def __init__(self, delay: float = 1.0, max_workers: int = 4):
+        """
+        Background worker persisting plugin data and plugin states.
+        Plugins mark data as dirty, the worker waits for `delay` seconds to collect further changes and then writes the latest version of all
+        dirty data in a thread pool, so a burst of changes results in a single write that does not block the event loop.
+        Data and states that could not be written are marked as dirty again and retried, waiting twice as long after every failed flush.
+        :param delay: time in seconds to wait for further changes before writing
+        :param max_workers: maximum number of threads used for writing
+        """
+
+        self.delay: float = delay
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="persistence")
+
+        self.dirty_data: Dict[str, Dict[str, Set[str] or None]] = {}
+        """names of dirty data along with the keys changed since they have last been written (None if anything might have changed), by plugin name"""
+        self.dirty_states: Set[str] = set()
+        """names of plugins with dirty state"""
+        self.plugins: Dict[str, Any] = {}
+
+        self.flush_task: asyncio.Task or None = None
+        self.flushing: bool = False
+        self.flush_lock: asyncio.Lock or None = None
+        """makes sure flushes do not overlap, so data is written in the order it has been stored in. Created on first use, within the running loop"""
+        self.closed: bool = False
+        """set on shutdown, afterwards plugins write their data themselves"""
+        self.failures: int = 0
+        """number of consecutive flushes that failed to write anything, determines the time to wait before retrying"""
+
+        # statistics
+        self.requested_writes: int = 0
+        self.disk_writes: int = 0
+        self.flushes: int = 0
+        self.failed_writes: int = 0
+        self.last_flush_latency: float = 0.0
+        self.max_flush_latency: float = 0.0
+
+    def configure(self, delay: float) -> None:
+        """
+        Apply the bot's configuration
+        :param delay: time in seconds to wait for further changes before writing
+        :return:
+        """
+
+        self.delay = delay
+
+    def schedule_data(self, plugin, name: str, dirty_keys: Set[str] or None = None) -> bool:
+        """
+        Mark a plugin's data as dirty, it will be written by the next flush
+        :param plugin: the Plugin the data belongs to
+        :param name: name of the data
+        :param dirty_keys: keys of a dict changed since it has last been stored, None if anything might have changed
+        :return:    True, if writing has been scheduled
+                    False, if there is no running event loop or the worker has been closed, the caller needs to write itself
+        """
+
+        if not self.__schedule():
+            return False
+
+        self.plugins[plugin.name] = plugin
+        dirty: Dict[str, Set[str] or None] = self.dirty_data.setdefault(plugin.name, {})
+        if dirty_keys is None or (name in dirty and dirty[name] is None):
+            dirty[name] = None
+        else:
+            dirty.setdefault(name, set()).update(dirty_keys)
+        self.requested_writes += 1
+        return True
+
+    def schedule_state(self, plugin) -> bool:
+        """
+        Mark a plugin's state as dirty, it will be written by the next flush
+        :param plugin: the Plugin the state belongs to
+        :return:    True, if writing has been scheduled
+                    False, if there is no running event loop or the worker has been closed, the caller needs to write itself
+        """
+
+        if not self.__schedule():
+            return False
+
+        self.plugins[plugin.name] = plugin
+        self.dirty_states.add(plugin.name)
+        self.requested_writes += 1
+        return True
+
+    def __schedule(self) -> bool:
+        """
+        Make sure a flush has been scheduled
+        :return:    True, if a flush is pending
+                    False, if there is no running event loop to schedule a flush on or the worker has been closed
+        """
+
+        try:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        if self.closed:
+            return False
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = loop.create_task(self.__delayed_flush())
+        return True
+
+    async def __delayed_flush(self) -> None:
+        """
+        Wait for further changes, then flush. Repeat if changes have been made while flushing.
+        :return:
+        """
+
+        while (self.dirty_data or self.dirty_states) and not self.closed:
+            await asyncio.sleep(self.__get_delay())
+            self.flushing = True
+            try:
+                await self.flush()
+            finally:
+                self.flushing = False
+
+    def __get_delay(self) -> float:
+        """
+        :return: time in seconds to wait before the next flush, backing off exponentially while writes keep failing
+        """
+
+        if not self.failures:
+            return self.delay
+        return min(max(self.delay, 1.0) * 2 ** (self.failures - 1), MAX_RETRY_DELAY)
+
+    def pending_writes(self) -> int:
+        """
+        :return: number of data items and states waiting to be written
+        """
+
+        return sum(len(names) for names in self.dirty_data.values()) + len(self.dirty_states)
+
+    async def flush(self) -> bool:
+        """
+        Immediately write all dirty data and states. Anything that could not be written is marked as dirty again and retried later.
+        :return:    True, if everything has been written successfully
+                    False, otherwise
+        """
+
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            return await self.__flush()
+
+    async def __flush(self) -> bool:
+        """
+        Write all dirty data and states, the flush lock needs to be held
+        :return:    True, if everything has been written successfully
+                    False, otherwise
+        """
+
+        if not self.dirty_data and not self.dirty_states:
+            return True
+
+        dirty_data: Dict[str, Dict[str, Set[str] or None]] = self.dirty_data
+        dirty_states: Set[str] = self.dirty_states
+        self.dirty_data = {}
+        self.dirty_states = set()
+
+        start: float = time.monotonic()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        jobs: List[asyncio.Future] = []
+        # plugin name and dirty data of each job, None for states
+        written: List[Tuple[str, Dict[str, Set[str] or None] or None]] = []
+
+        plugin_name: str
+        for plugin_name, dirty in dirty_data.items():
+            # only collect the current values on the loop, encoding and writing happens in the thread
+            jobs.append(loop.run_in_executor(self.executor, self.plugins[plugin_name]._get_data_writer(dirty)))
+            written.append((plugin_name, dirty))
+        for plugin_name in dirty_states:
+            jobs.append(loop.run_in_executor(self.executor, self.plugins[plugin_name]._get_state_writer()))
+            written.append((plugin_name, None))
+
+        failed: List[str] = []
+        result: bool or BaseException
+        for (plugin_name, dirty), result in zip(written, await asyncio.gather(*jobs, return_exceptions=True)):
+            self.disk_writes += 1
+            if result is True:
+                continue
+
+            self.failed_writes += 1
+            if isinstance(result, BaseException):
+                logger.critical(f"Could not persist {'data' if dirty is not None else 'state'} of {plugin_name}: {result}")
+            if dirty is not None:
+                # it is not known which entries made it to disk, write the failed data completely
+                name: str
+                for name in dirty.keys():
+                    self.dirty_data.setdefault(plugin_name, {})[name] = None
+                failed.extend(f"{plugin_name}/{name}" for name in dirty.keys())
+            else:
+                self.dirty_states.add(plugin_name)
+                failed.append(f"{plugin_name} (state)")
+
+        self.flushes += 1
+        self.last_flush_latency = time.monotonic() - start
+        self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+
+        if not failed:
+            self.failures = 0
+            return True
+
+        self.failures += 1
+        logger.error(f"Could not write {', '.join(failed)}, retrying in {self.__get_delay()} seconds")
+        self.__schedule()
+        return False
+
+    async def close(self, retries: int = 3) -> bool:
+        """
+        Flush all pending writes, e.g. on shutdown. Failed writes are retried with the usual backoff.
+        :param retries: number of times to retry writes that failed
+        :return:    True, if everything has been written successfully
+                    False, if data or states could not be written and are lost
+        """
+
+        self.closed = True
+        if self.flush_task is not None and not self.flush_task.done() and not self.flushing:
+            # a running flush is not cancelled, its writes are already in progress and flush() waits for it
+            self.flush_task.cancel()
+
+        attempt: int
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(self.__get_delay())
+            if await self.flush():
+                return True
+
+        lost: List[str] = [f"{plugin_name}/{name}" for plugin_name, dirty in self.dirty_data.items() for name in dirty.keys()]
+        lost.extend(f"{plugin_name} (state)" for plugin_name in self.dirty_states)
+        logger.critical(f"Could not write {', '.join(lost)} before shutting down, these changes are lost")
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        :return: statistics about the worker
+        """
+
+        return {
+            "pending writes": self.pending_writes(),
+            "requested writes": self.requested_writes,
+            "disk writes": self.disk_writes,
+            "failed writes": self.failed_writes,
+            "consecutive failed flushes": self.failures,
+            "flushes": self.flushes,
+            "last flush latency (ms)": round(self.last_flush_latency * 1000, 1),
+            "max flush latency (ms)": round(self.max_flush_latency * 1000, 1),
+        }
+
+
+persistence_worker: PersistenceWorker = PersistenceWorker()
@@ -2,7 +2,7 @@ import io
 import os.path
 from os import remove, path
 import pickle
-from typing import List, Any, Dict, Callable, Union, Hashable, Tuple
+from typing import List, Any, Dict, Callable, Union, Hashable, Tuple, Set
 import datetime
 
 import requests
@@ -10,33 +10,47 @@ import yaml
 from core.chat_functions import (
     send_text_to_room,
     send_reaction,
+    send_reactions,
     send_replace,
     send_image,
+    render_markdown,
 )
+import asyncio
 from asyncio import sleep
 import logging
+import time
 from nio import (
     AsyncClient,
-    JoinedMembersResponse,
     RoomMember,
     RoomSendResponse,
     RoomSendError,
     MatrixRoom,
 )
-from core.timer import Timer
+from core.timer import Timer, TimerScheduler
+from core.coalescer import message_coalescer
+from core.member_directory import member_directory
+from core.backup import Backup, PluginBackups
+from core.command_index import CommandIndex
+from core.hook_index import HookIndex
+from core.data_codec import DataCodec
+from core.plugin_data import DATA_BACKENDS, PluginDataBackend, REMOVED, create_data_backend
+from core.persistence import persistence_worker, write_file_atomic
+from core.data_view import IMMUTABLE_TYPES, create_view, get_dirty_keys, is_unmodified_view, unwrap
 from fuzzywuzzy import fuzz
 import copy
 import jsonpickle
-import commonmark
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
 
 class Plugin:
-    def __init__(self, name: str, category: str, description: str):
+    def __init__(self, name: str, category: str, description: str, deepcopy_data: bool = False, serialized: bool = False):
         """
         commands (list[tuple]): list of commands in the form of (trigger: str, method: str, helptext: str)
+        deepcopy_data (bool): make read_data() return deep copies instead of copy-on-write views by default (for legacy plugins)
+        serialized (bool): run the plugin's commands, hooks and timers one at a time, for plugins sharing mutable state between them (e.g. reading
+                           data, awaiting something and storing the modified data)
 
         """
         self.category: str = category
@@ -48,6 +62,9 @@ class Plugin:
         self.timers: List[Timer] = []
         self.rooms: List[str] = []
         self.client: AsyncClient or None = None
+        self.command_index: CommandIndex or None = None
+        self.hook_index: HookIndex or None = None
+        self.timer_scheduler: TimerScheduler or None = None
         if path.isdir(f"plugins/{self.name}"):
             self.is_directory_based: bool = True
             self.basepath: str = f"plugins/{self.name}/{self.name}"
@@ -61,6 +78,15 @@ class Plugin:
         self.config_items_filename: str = f"{self.basepath}.yaml"
 
         self.plugin_data: Dict[str, Any] = {}
+        self.data_loaded: bool = False
+        self.data_loading: asyncio.Future or None = None
+        self.data_load_time: float or None = None
+        """time in seconds it took to load the plugin's data"""
+        self.deepcopy_data: bool = deepcopy_data
+        self.serialized: bool = serialized
+        self.data_codec: DataCodec = DataCodec()
+        self.data_store: PluginDataBackend = create_data_backend("sqlite", self.basepath, codec=self.data_codec)
+        self.backups: PluginBackups = PluginBackups(f"{self.basepath}_backups", self.data_codec)
         self.config_items: Dict[str, Any] = {}
         self.configuration: Union[Dict[Hashable, Any], list, None] = self.__load_config()
         logger.debug(f"{self.name}: Configuration loaded from file: {self.configuration}")
@@ -111,10 +137,12 @@ class Plugin:
         :return:
         """
 
-        plugin_command = PluginCommand(command, method, help_text, power_level=power_level, room_id=room_id, command_type=command_type)
+        plugin_command = PluginCommand(command, method, help_text, power_level=power_level, room_id=room_id, command_type=command_type, plugin_name=self.name)
         if command not in self.commands.keys():
             self.commands[command] = plugin_command
             self.help_texts[command] = help_text
+            if self.command_index is not None:
+                self.command_index.add(plugin_command)
             # Add rooms from command to the rooms the plugin is valid for
             if room_id:
                 for room in room_id:
@@ -138,6 +166,8 @@ class Plugin:
         command: str
         if command in self.commands.keys():
             if self.commands.get(command).command_type == "dynamic":
+                if self.command_index is not None:
+                    self.command_index.remove(self.commands[command])
                 del self.commands[command]
                 self._save_state()
                 return True
@@ -164,29 +194,38 @@ class Plugin:
         room_id_list: List[str] or None = None,
         event_ids: List[str] or None = None,
         hook_type: str = "static",
+        ordered: bool = False,
     ):
         """
         Hook into events defined by event_type with `method`.
         Will overwrite existing hooks with the same event_type and method.
+        Hooks applicable to an event are run concurrently, unless they are ordered.
         :param event_type: event-type to hook into, currently "m.reaction" and "m.room.message"
         :param method: method to be called when an event is received
         :param room_id_list: optional list of room_ids the hook is active on
         :param event_ids: optional list of event-ids, the hook is applicable for, currently only useful for "m.reaction"-hooks
         :param hook_type: the optional type of the hook, currently "static" (default) or "dynamic"
+        :param ordered: run the hook one after another with all other ordered hooks for an event, in the order they have been registered in
         :return:
         """
 
         if not self.has_hook(event_type, method, room_id_list=room_id_list):
             # a hook doesn't already exist for the same event_type, method and room_id_list
 
+            hook: PluginHook
             if event_type not in self.hooks.keys():
                 # no hooks for event_type, add an event_type and hook
-                self.hooks[event_type] = [
-                    PluginHook(event_type, method, room_id_list=copy.deepcopy(room_id_list), event_ids=copy.deepcopy(event_ids), hook_type=hook_type)
-                ]
+                hook = PluginHook(
+                    event_type,
+                    method,
+                    room_id_list=copy.deepcopy(room_id_list),
+                    event_ids=copy.deepcopy(event_ids),
+                    hook_type=hook_type,
+                    ordered=ordered,
+                )
+                self.hooks[event_type] = [hook]
 
             else:
-                hook: PluginHook
                 for hook in self.hooks[event_type]:
                     if hook.method == method:
                         # hook exists for same event_type and method, adjust rooms if required
@@ -195,16 +234,18 @@ class Plugin:
                         break
                 else:
                     # no hook for the given method, append a new hook
-                    self.hooks[event_type].append(
-                        PluginHook(
-                            event_type,
-                            method,
-                            room_id_list=room_id_list,
-                            event_ids=event_ids,
-                            hook_type=hook_type,
-                        )
+                    hook = PluginHook(
+                        event_type,
+                        method,
+                        room_id_list=room_id_list,
+                        event_ids=event_ids,
+                        hook_type=hook_type,
+                        ordered=ordered,
                     )
+                    self.hooks[event_type].append(hook)
 
+            if self.hook_index is not None:
+                self.hook_index.update(self, hook)
             if hook_type == "dynamic":
                 self._save_state()
             logger.debug(f"Added hook for event {event_type}, method {method} to rooms {room_id_list}")
@@ -227,15 +268,17 @@ class Plugin:
             # there actually is a matching hook
 
             hook_removed: bool = False
+            changed_hooks: List[PluginHook] = []
             hooks = self.hooks
             hook: PluginHook
-            for hook in hooks.get(event_type):
+            for hook in list(hooks.get(event_type)):
                 if hook.method == method:
                     # hook exists for same event_type and method, adjust rooms if required
                     if hook.hook_type == "dynamic":
                         if not room_id_list or all(elem in room_id_list for elem in hook.room_id_list):
                             # completely remove the hook as no rooms have been supplied or all room_ids of the hook are to be removed
                             self.hooks[event_type].remove(hook)
+                            changed_hooks.append(hook)
                             hook_removed = True
                         else:
                             if not hook.room_id_list:
@@ -247,12 +290,16 @@ class Plugin:
                                     if room_id in hook.room_id_list:
                                         hook.room_id_list.remove(room_id)
 
+                                changed_hooks.append(hook)
                                 hook_removed = True
 
                     else:
                         logger.warning(f"Plugin {self.name} tried to remove static hook for {event_type}.")
 
             if hook_removed:
+                if self.hook_index is not None:
+                    for hook in changed_hooks:
+                        self.hook_index.update(self, hook)
                 self._save_state()
                 logger.debug(f"Removed hook for event {event_type}, method {method}")
                 return True
@@ -295,6 +342,8 @@ class Plugin:
         method: Callable,
         frequency: str or datetime.timedelta or None = None,
         timer_type: str = "static",
+        timezone: str or None = None,
+        misfire: str = "run_once",
     ):
         """
 
@@ -303,22 +352,32 @@ class Plugin:
                 can be:
                 - datetime.timedelta: to specify timeperiods between triggers or
                 - str:
-                    - "weekly": run once a week roughly at Monday, 00:00
-                    - "daily": run once a day roughly at midnight
-                    - "hourly": run once an hour roughly at :00
-                - None: triggers about every thirty seconds
+                    - "weekly": run once a week at Monday, 00:00
+                    - "daily": run once a day at midnight
+                    - "hourly": run once an hour at :00
+                    - "at HH:MM": run once a day at the given time
+                    - a cron expression, e.g. "30 8 * * 1-5" to run at 08:30 on weekdays
+                - None: triggers every thirty seconds
         :param timer_type:
+        :param timezone: name of the timezone the frequency is evaluated in, e.g. "Europe/Berlin", defaults to the system's timezone
+        :param misfire: how to handle runs missed while the bot was not running:
+                - "run_once": run once as soon as possible (default)
+                - "skip": skip the missed runs and wait for the next regular run
+                - "catch_up": run once for each missed run
         :return:
         """
 
-        self.timers.append(
-            Timer(
-                f"{self.name}.{method.__name__}",
-                method,
-                frequency=frequency,
-                timer_type=timer_type,
-            )
+        timer: Timer = Timer(
+            f"{self.name}.{method.__name__}",
+            method,
+            frequency=frequency,
+            timer_type=timer_type,
+            timezone=timezone,
+            misfire=misfire,
         )
+        self.timers.append(timer)
+        if self.timer_scheduler is not None:
+            self.timer_scheduler.add(timer)
         if timer_type == "dynamic":
             self._save_state()
 
@@ -354,6 +413,8 @@ class Plugin:
             if timer.method == method:
                 if timer.timer_type == "dynamic":
                     self._get_timers().remove(timer)
+                    if self.timer_scheduler is not None:
+                        self.timer_scheduler.remove(timer)
                     self._save_state()
                     return True
                 else:
@@ -361,30 +422,73 @@ class Plugin:
 
         return False
 
+    def set_data_codec(self, data_format: str, compression_threshold: int or None = 65536) -> None:
+        """
+        Set the format the plugin's data is stored in. Data already stored in another format is still read and converted on the next start.
+        :param data_format: "jsonpickle" (default, supports almost anything, but slow and verbose), "json" (compact, using orjson if installed) or
+                            "msgpack" (compact binary, requires msgpack). json and msgpack support basic types, datetimes and classes registered
+                            by register_data_class(), values containing anything else are still stored using jsonpickle
+        :param compression_threshold: compress stored values larger than this number of bytes (using zstd if installed, zlib otherwise),
+                                      None to disable compression
+        :return:
+        """
+
+        self.data_codec.set_format(data_format)
+        self.data_codec.compression_threshold = compression_threshold
+
+    def register_data_class(self, cls: type, name: str or None = None) -> None:
+        """
+        Register a class to be stored in compact form by the json and msgpack formats. Instances are stored as their instance-attributes and
+        restored without calling __init__.
+        :param cls: the class to register
+        :param name: name to store the class by, defaults to the class' name. Keep it when renaming the class to be able to read stored data.
+        :return:
+        """
+
+        self.data_codec.register_class(cls, name)
+
     async def store_data(self, name: str, data: Any) -> bool:
         """
-        Store data in plugins/<pluginname>.dill
+        Store data in plugins/<pluginname>/<pluginname>.db (or .journal, depending on the configured backend)
+        Writing happens in the background, shortly after the data has been stored. Changes stored in quick succession are written at once and only
+        the parts of the data that have actually changed are written to disk.
+        Storing a view returned by read_data() that has not been modified does nothing. Other data is compared to the stored data in its encoded
+        form while writing, so unchanged data does not cause any disk writes.
         :param name: Name of the data to store, used as a reference to retrieve it later
         :param data: data to be stored
         :return:    True, if data was successfully stored
                     False, if data could not be stored
         """
 
-        if data != self.plugin_data.get(name):
-            self.plugin_data[name] = data
-            return await self.__save_data_to_file()
-        else:
+        await self._ensure_data_loaded()
+        stored: Any = self.plugin_data.get(name)
+        if name in self.plugin_data and (
+            is_unmodified_view(data, stored) or (isinstance(data, IMMUTABLE_TYPES) and type(data) is type(stored) and data == stored)
+        ):
             return True
 
-    async def read_data(self, name: str) -> Any:
+        # only the items of a dict changed through its view need to be encoded and compared when writing
+        dirty_keys: Set[str] or None = get_dirty_keys(data, stored) if name in self.plugin_data else None
+        data = unwrap(data, commit=True)
+        self.plugin_data[name] = data
+        return persistence_worker.schedule_data(self, name, dirty_keys) or self.data_store.store(name, data, dirty_keys)
+
+    async def read_data(self, name: str, deepcopy: bool or None = None) -> Any:
         """
         Read data from self.plugin_data
+        The data is returned as a copy-on-write view: reading it does not copy anything, the data is only copied once it is being modified.
+        Modifications are not persisted until the data is passed to store_data().
         :param name: Name of the data to be retrieved
+        :param deepcopy: optionally return a deep copy of the data instead of a view, defaults to the plugin's deepcopy_data
         :return: the previously stored data
         """
 
+        await self._ensure_data_loaded()
         if name in self.plugin_data:
-            return copy.deepcopy(self.plugin_data[name])
+            if deepcopy or (deepcopy is None and self.deepcopy_data):
+                return copy.deepcopy(self.plugin_data[name])
+            else:
+                return create_view(self.plugin_data[name])
         else:
             return None
 
@@ -393,32 +497,96 @@ class Plugin:
         Clear a specific field in self.plugin_data
         :param name: name of the field to be cleared
         :return:    True, if successfully cleared
-                    False, if name not contained in self.plugin_data or data could not be saved to disk
+                    False, if name not contained in self.plugin_data or data could not be removed from disk
         """
 
+        await self._ensure_data_loaded()
         if name in self.plugin_data:
             del self.plugin_data[name]
-            return await self.__save_data_to_file()
+            return persistence_worker.schedule_data(self, name) or self.data_store.clear(name)
         else:
             return False
 
+    def _get_data_writer(self, dirty: Dict[str, Set[str] or None]) -> Callable[[], bool]:
+        """
+        Collect the current values of the given data to be written by the persistence worker. Encoding and writing happens in the returned function.
+        :param dirty: names of the data to write along with the keys changed since they have last been written, None if anything might have changed
+        :return: a blocking function writing the data
+        """
+
+        values: Dict[str, Any] = {}
+        name: str
+        for name in dirty.keys():
+            value: Any = self.plugin_data.get(name, REMOVED)
+            # data stored through views is never modified in place afterwards, but the plugin might still hold and modify other data.
+            # Copying the top level keeps adding and removing items from interfering with encoding, other modifications fail the write and retry it
+            values[name] = dict(value) if type(value) is dict else value
+        return lambda: self.data_store.write(values, dirty)
+
     async def backup_data(self) -> bool:
         """
-        Create a backup file of the data currently stored by the plugin. This is not executed automatically and needs to be called by the plugin,
-        preferably before executing potentially destructive operations
+        Create a compressed backup of the data currently stored by the plugin in plugins/<pluginname>/<pluginname>_backups. This is not executed
+        automatically and needs to be called by the plugin, preferably before executing potentially destructive operations.
+        Data stored but not written yet is written first. Backups are incremental, only storing the changes made since the last full backup, and are
+        created in a thread. Outdated backups are removed according to the configured retention.
         :return:    True, if backup file was created successfully
                     False, otherwise
         """
 
-        if self.plugin_data != {}:
-            return await self.__save_data_to_json_file(
-                self.plugin_data,
-                f"{self.plugin_dataj_filename}.bak.{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}",
-            )
-        else:
+        await self._ensure_data_loaded()
+        if self.plugin_data == {}:
+            return False
+
+        # write pending changes first, the backup is created from the entries as stored by the backend, which are copied under its lock
+        await persistence_worker.flush()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            backup: Backup = await loop.run_in_executor(None, lambda: self.backups.create(*self.data_store.snapshot()))
+        except Exception as err:
+            logger.critical(f"Could not create backup of plugin_data for {self.name}: {err}")
+            return False
+
+        logger.info(f"Created backup {backup.backup_id} of plugin_data for {self.name} ({backup.size} bytes)")
+        return True
+
+    async def list_backups(self) -> List[Backup]:
+        """
+        Get a list of all backups of the plugin's data
+        :return: the backups, oldest first
+        """
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.backups.list)
+
+    async def restore_data(self, backup_id: str) -> bool:
+        """
+        Replace the plugin's data by the data stored in a backup. A backup of the current data is created before.
+        :param backup_id: id of the backup to restore
+        :return:    True, if the backup has been restored
+                    False, if the backup does not exist or could not be read
+        """
+
+        await self._ensure_data_loaded()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            data: Dict[str, Any] = await loop.run_in_executor(None, self.backups.read, backup_id)
+        except Exception as err:
+            logger.error(f"Could not read backup {backup_id} of plugin_data for {self.name}: {err}")
             return False
 
-    async def __load_pickle_data_from_file(self, filename: str) -> Dict[str, Any]:
+        await self.backup_data()
+
+        names: Set[str] = set(self.plugin_data.keys()) | set(data.keys())
+        self.plugin_data = data
+        logger.warning(f"Restored backup {backup_id} of plugin_data for {self.name}")
+
+        name: str
+        if all([persistence_worker.schedule_data(self, name) for name in names]):
+            return True
+        else:
+            return self.data_store.write({name: data.get(name, REMOVED) for name in names})
+
+    def __load_pickle_data_from_file(self, filename: str) -> Dict[str, Any]:
         """
         Load data from a pickle-file
         :param filename: filename to load data from
@@ -430,7 +598,7 @@ class Plugin:
         file.close()
         return data
 
-    async def __load_json_data_from_file(self, filename: str, convert: bool = False) -> Dict[str, Any]:
+    def __load_json_data_from_file(self, filename: str, convert: bool = False) -> Dict[str, Any]:
         """
         Load data from a json-file
         :param filename: filename to load data from
@@ -449,20 +617,75 @@ class Plugin:
 
         return data
 
-    async def _load_data_from_file(self) -> Dict[str, Any]:
+    async def _ensure_data_loaded(self) -> None:
+        """
+        Load the plugin's data on first access. Loading happens in a thread, concurrent calls wait for the same load to finish.
+        :return:
+        """
+
+        if self.data_loaded:
+            return
+
+        if self.data_loading is None:
+            self.data_loading = asyncio.ensure_future(self.__load_data())
+        await asyncio.shield(self.data_loading)
+
+    async def __load_data(self) -> None:
         """
-        Load plugin_data from file
+        Load the plugin's data in a thread and make it available in self.plugin_data
+        :return:
+        """
+
+        start: float = time.monotonic()
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self.plugin_data = await loop.run_in_executor(None, self._load_data_from_file)
+        self.data_loaded = True
+        self.data_load_time = time.monotonic() - start
+        logger.info(f"Loaded data for {self.name} in {self.data_load_time * 1000:.1f}ms")
+
+    def _load_data_from_file(self) -> Dict[str, Any]:
+        """
+        Load plugin_data from the plugin's data backend. This is blocking, use _ensure_data_loaded() to load the data in a thread.
+        Data found in legacy json- or pickle-files or stored by a previously configured backend is migrated on first load.
         :return: Data read from file to be loaded into self.plugin_data
         """
 
+        if self.data_store.exists():
+            try:
+                return self.data_store.load()
+            except Exception as err:
+                logger.critical(f"Could not load plugin_data for {self.name} from {self.data_store.filename}: {err}")
+                return {}
+
+        backend: str
+        for backend in DATA_BACKENDS.keys():
+            # data stored by a previously configured backend
+            other_store: PluginDataBackend = create_data_backend(backend, self.basepath, codec=self.data_codec)
+            if type(other_store) is not type(self.data_store) and other_store.exists():
+                try:
+                    other_data: Dict[str, Any] = other_store.load()
+                except Exception as err:
+                    logger.critical(f"Could not load plugin_data for {self.name} from {other_store.filename}: {err}")
+                    return {}
+                finally:
+                    other_store.close()
+
+                logger.warning(f"Converting data for {self.name} from {other_store.filename} to {self.data_store.filename}.")
+                if self.data_store.import_data(other_data):
+                    logger.warning(f"You may remove {other_store.filename} now, it is no longer being used.")
+                else:
+                    logger.critical(f"Could not convert data for {self.name}, keeping {other_store.filename}.")
+                return other_data
+
         plugin_data_from_json: Dict[str, Any] = {}
         plugin_data_from_pickle: Dict[str, Any] = {}
-        abandoned_data: bool = False
+        legacy_filename: str = ""
 
         try:
             if os.path.isfile(self.plugin_dataj_filename):
                 # local json data found, convert if needed
-                plugin_data_from_json = await self.__load_json_data_from_file(self.plugin_dataj_filename, self.is_directory_based)
+                plugin_data_from_json = self.__load_json_data_from_file(self.plugin_dataj_filename, self.is_directory_based)
+                legacy_filename = self.plugin_dataj_filename
                 if os.path.isfile(self.plugin_data_filename):
                     logger.warning(
                         f"Data for {self.name} read from {self.plugin_dataj_filename}, but {self.plugin_data_filename} still exists. After "
@@ -472,101 +695,31 @@ class Plugin:
             elif os.path.isfile(self.plugin_data_filename):
                 # local pickle-data found
                 logger.warning(f"Reading data for {self.name} from pickle. This should only happen once. Data will be stored in new format.")
-                plugin_data_from_pickle = await self.__load_pickle_data_from_file(self.plugin_data_filename)
+                plugin_data_from_pickle = self.__load_pickle_data_from_file(self.plugin_data_filename)
+                legacy_filename = self.plugin_data_filename
 
             else:
                 # no local data found, check for abandoned data
                 if self.is_directory_based:
                     abandoned_json_file: str = f"plugins/{self.name}.json"
                     if os.path.isfile(abandoned_json_file):
-                        abandoned_data = True
                         logger.warning(f"Loading abandoned data for {self.name} from {abandoned_json_file}. This should only happen once.")
-                        plugin_data_from_json = await self.__load_json_data_from_file(abandoned_json_file, convert=True)
+                        plugin_data_from_json = self.__load_json_data_from_file(abandoned_json_file, convert=True)
+                        legacy_filename = abandoned_json_file
 
         except Exception as err:
             logger.critical(f"Could not load plugin_data for {self.name}: {err}")
             return {}
 
-        if abandoned_data:
-            if "abandoned_json_file" in locals() and os.path.isfile(abandoned_json_file):
-                logger.warning(f"You may remove {abandoned_json_file} now, it is no longer being used.")
-            await self.__save_data_to_json_file(plugin_data_from_json, self.plugin_dataj_filename)
-
-        if plugin_data_from_pickle != {} and not os.path.isfile(self.plugin_dataj_filename):
-            logger.warning(f"Converting data for {self.name} to {self.plugin_dataj_filename}. This should only happen once.")
-            if os.path.isfile(self.plugin_data_filename):
-                logger.warning(f"You may remove {self.plugin_data_filename} now, it is no longer being used.")
-
-        if plugin_data_from_pickle != {}:
-            return plugin_data_from_pickle
-        elif plugin_data_from_json != {}:
-            return plugin_data_from_json
-        else:
-            return {}
-
-    async def __save_data_to_pickle_file(self, data: Dict[str, Any], filename: str):
-        """
-        Save data to a pickle-file
-        :param data: data to save
-        :param filename: filename to save the data to
-        :return:    True, if data stored successfully
-                    False, otherwise
-        """
-        try:
-            pickle.dump(data, open(filename, "wb"))
-            return True
-        except Exception as err:
-            logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
-            return False
-
-    async def __save_data_to_json_file(self, data: Dict[str, Any], filename: str):
-        """
-        Save data to a json file
-        :param data: data to save
-        :param filename: filename to save the data to
-        :return:    True, if data stored successfully
-                    False, otherwise
-        """
-
-        try:
-            json_data = jsonpickle.encode(data)
-            file = open(filename, "w")
-            file.write(json_data)
-            file.close()
-            return True
-        except Exception as err:
-            logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
-            return False
-
-    async def __save_data_to_file(self) -> bool:
-        """
-        Save modified plugin_data to disk
-        :return:    True, if data stored successfully
-                    False, otherwise
-        """
-
-        if self.plugin_data != {}:
-            """there is actual data to save"""
-            return await self.__save_data_to_json_file(self.plugin_data, self.plugin_dataj_filename)
-
-        else:
-            logger.debug("No data to save, remove datafiles")
-            """no data to save, remove file"""
-            if os.path.isfile(self.plugin_data_filename):
-                try:
-                    remove(self.plugin_data_filename)
-                    return True
-                except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_data_filename}: {err}")
-                    return False
+        plugin_data: Dict[str, Any] = plugin_data_from_pickle or plugin_data_from_json
+        if plugin_data:
+            logger.warning(f"Converting data for {self.name} to {self.data_store.filename}. This should only happen once.")
+            if self.data_store.import_data(plugin_data):
+                logger.warning(f"You may remove {legacy_filename} now, it is no longer being used.")
+            else:
+                logger.critical(f"Could not convert data for {self.name}, keeping {legacy_filename}.")
 
-            if os.path.isfile(self.plugin_dataj_filename):
-                try:
-                    remove(self.plugin_dataj_filename)
-                    return True
-                except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_dataj_filename}: {err}")
-                    return False
+        return plugin_data
 
     async def __expandable_message_body(self, header: str, body: str) -> str:
         """
@@ -580,8 +733,8 @@ class Plugin:
         :return: expandable message
         """
 
-        markdown_header: str = commonmark.commonmark(header)
-        markdown_body: str = commonmark.commonmark(body)
+        markdown_header: str = render_markdown(header)
+        markdown_body: str = render_markdown(body)
         return f"<details><summary>{markdown_header}</summary><br>{markdown_body}</details>"
 
     async def send_message(
@@ -592,6 +745,7 @@ class Plugin:
         expanded_message: str = "",
         delay: int = 0,
         markdown_convert: bool = True,
+        coalesce: bool = False,
     ) -> str or None:
         """
         Send a message to a room, usually utilized by plugins to respond to commands
@@ -601,7 +755,9 @@ class Plugin:
         :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
         :param delay: optional delay with typing notification, 1..1000ms
         :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
-        :return: the event_id of the sent message or None in case of an error
+        :param coalesce: optional flag if the message may be merged with other messages sent to the room within a short window (see
+                         outbound.coalesce_window), the call then returns once the merged message has been sent, defaults to False
+        :return: the event_id of the sent message (or the merged message containing it) or None in case of an error
         """
 
         if delay > 0:
@@ -613,8 +769,14 @@ class Plugin:
             await client.room_typing(room_id, typing_state=False)
 
         if expanded_message:
+            # the expandable message is rendered already
             message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=False, markdown_convert=markdown_convert)
+            markdown_convert = False
+        event_response: RoomSendResponse or RoomSendError
+        if coalesce:
+            event_response = await message_coalescer.send(client, room_id, message, notice=False, markdown_convert=markdown_convert)
+        else:
+            event_response = await send_text_to_room(client, room_id, message, notice=False, markdown_convert=markdown_convert)
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -670,6 +832,7 @@ class Plugin:
         message: str,
         expanded_message: str = "",
         markdown_convert: bool = True,
+        coalesce: bool = False,
     ) -> str or None:
         """
         Send a notice to a room, usually utilized by plugins to post errors, help texts or other messages not warranting pinging users
@@ -678,12 +841,20 @@ class Plugin:
         :param message: the actual message
         :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
         :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
-        :return: the event_id of the sent message or None in case of an error
+        :param coalesce: optional flag if the notice may be merged with other notices sent to the room within a short window (see
+                         outbound.coalesce_window), the call then returns once the merged notice has been sent, defaults to False
+        :return: the event_id of the sent notice (or the merged notice containing it) or None in case of an error
         """
 
         if expanded_message:
+            # the expandable message is rendered already
             message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=True, markdown_convert=markdown_convert)
+            markdown_convert = False
+        event_response: RoomSendResponse or RoomSendError
+        if coalesce:
+            event_response = await message_coalescer.send(client, room_id, message, notice=True, markdown_convert=markdown_convert)
+        else:
+            event_response = await send_text_to_room(client, room_id, message, notice=True, markdown_convert=markdown_convert)
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -750,6 +921,7 @@ class Plugin:
 
         if expanded_message:
             message = await self.__expandable_message_body(message, expanded_message)
+            return await send_replace(client, room_id, event_id, message, message_type="m.notice", markdown_convert=False)
         return await send_replace(client, room_id, event_id, message, message_type="m.notice")
 
     async def send_reaction(self, client, room_id: str, event_id: str, reaction: str):
@@ -764,6 +936,21 @@ class Plugin:
 
         await send_reaction(client, room_id, event_id, reaction)
 
+    async def send_reactions(
+        self, client: AsyncClient, room_id: str, event_id: str, reactions: List[str]
+    ) -> Dict[str, RoomSendResponse or RoomSendError or None]:
+        """
+        React to a specific event with several reactions at once. The reactions are sent concurrently (within the bot's rate limits),
+        so posting many reactions takes about as long as posting one.
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) room_id to send the reactions to
+        :param event_id: (str) event_id to react to
+        :param reactions: (list) the reactions to send
+        :return: (dict) the result of sending each reaction by reaction, None if sending it failed unexpectedly
+        """
+
+        return await send_reactions(client, room_id, event_id, reactions)
+
     async def react(self, client, room_id: str, event_id: str, reaction: str):
         """
         ** DEPRECATED ** Alias for send_redaction
@@ -792,6 +979,7 @@ class Plugin:
 
         if expanded_message:
             message = await self.__expandable_message_body(message, expanded_message)
+            return await send_replace(client, room_id, event_id, message, message_type="m.text", markdown_convert=False)
         return await send_replace(client, room_id, event_id, message, message_type="m.text")
 
     async def replace(self, client: AsyncClient, room_id: str, event_id: str, message: str) -> str or None:
@@ -827,12 +1015,12 @@ class Plugin:
         logger.warning(f"Deprecated function 'message_delete' used - use 'redact_message' instead")
         await self.redact_message(client, room_id, event_id, reason)
 
-    async def send_image(self, client: AsyncClient, room_id: str, image: Image):
+    async def send_image(self, client: AsyncClient, room_id: str, image: Image.Image or bytes):
         """
         Posts an image to the given room
         :param client:
         :param room_id:
-        :param image:
+        :param image: a PIL image or an encoded image (e.g. retrieved by fetch_image_data_from_url), which is uploaded as it is
         :return:
         """
 
@@ -869,11 +1057,11 @@ class Plugin:
                     None otherwise
         """
 
-        room_members: JoinedMembersResponse = await client.joined_members(room_id)
+        room_members: Tuple[RoomMember, ...] = await member_directory.get_members(client, room_id)
         room_member: RoomMember
 
         if strictness == "strict" or strictness == "loose":
-            for room_member in room_members.members:
+            for room_member in room_members:
 
                 if strictness == "strict":
                     if room_member.display_name == display_name:
@@ -881,7 +1069,7 @@ class Plugin:
 
                 else:
                     """loose matching"""
-                    if room_member.display_name.lower() == display_name.lower():
+                    if room_member.display_name and room_member.display_name.lower() == display_name.lower():
                         return room_member
             else:
                 return None
@@ -889,7 +1077,7 @@ class Plugin:
         else:
             """attempt fuzzy matching"""
             ratios: Dict[int, RoomMember] = {}
-            for room_member in room_members.members:
+            for room_member in room_members:
                 score: int = 0
                 if room_member.display_name and (score := fuzz.ratio(display_name.lower(), room_member.display_name.lower())) >= fuzziness:
                     ratios[score] = room_member
@@ -909,14 +1097,7 @@ class Plugin:
                     None otherwise
         """
 
-        room_members: JoinedMembersResponse = await client.joined_members(room_id)
-        room_member: RoomMember
-
-        for room_member in room_members.members:
-            if room_member.user_id == user_id:
-                return room_member
-
-        return None
+        return await member_directory.get_member(client, room_id, user_id)
 
     async def link_user(
         self,
@@ -1061,9 +1242,21 @@ class Plugin:
     def _save_state(self) -> bool:
         """
         Save dynamic commands, dynamic hooks and all timers to state file
+        Writing happens in the background by the persistence worker, if possible
         :return:
         """
 
+        if persistence_worker.schedule_state(self):
+            return True
+        else:
+            return self._get_state_writer()()
+
+    def _get_state_writer(self) -> Callable[[], bool]:
+        """
+        Collect the current state of the plugin to be written by the persistence worker
+        :return: a blocking function writing the state file
+        """
+
         dynamic_commands: Dict[str, PluginCommand] = {}
         dynamic_hooks: Dict[str, List[PluginHook]] = {}
 
@@ -1085,29 +1278,30 @@ class Plugin:
         plugin_state: Tuple[Dict, Dict, List] = (
             dynamic_commands,
             dynamic_hooks,
-            self._get_timers(),
+            list(self._get_timers()),
         )
 
-        if plugin_state != ({}, {}, []):
-            # we have an actual state to save
-            try:
-                json_data = jsonpickle.encode(plugin_state)
-                file = open(self.plugin_state_filename, "w")
-                file.write(json_data)
-                file.close()
-                return True
-            except Exception as err:
-                logger.critical(f"Could not write plugin_state to {self.plugin_state_filename}: {err}")
-                return False
-        else:
-            # state is empty, remove file if it exists
-            if os.path.isfile(self.plugin_state_filename):
+        def write_state() -> bool:
+            if plugin_state != ({}, {}, []):
+                # we have an actual state to save
                 try:
-                    remove(self.plugin_state_filename)
+                    write_file_atomic(self.plugin_state_filename, jsonpickle.encode(plugin_state))
                     return True
                 except Exception as err:
-                    logger.critical(f"Could not remove file {self.plugin_state_filename}: {err}")
+                    logger.critical(f"Could not write plugin_state to {self.plugin_state_filename}: {err}")
                     return False
+            else:
+                # state is empty, remove file if it exists
+                if os.path.isfile(self.plugin_state_filename):
+                    try:
+                        remove(self.plugin_state_filename)
+                        return True
+                    except Exception as err:
+                        logger.critical(f"Could not remove file {self.plugin_state_filename}: {err}")
+                        return False
+                return True
+
+        return write_state
 
     def _load_state(self):
         """
@@ -1129,25 +1323,46 @@ class Plugin:
         (dynamic_commands, dynamic_hooks, timers) = jsonpickle.decode(json_data)
 
         # add dynamic commands
-        self.commands.update(dynamic_commands)
+        name: str
+        plugin_command: PluginCommand
+        for name, plugin_command in dynamic_commands.items():
+            # commands saved by earlier versions do not know their plugin
+            plugin_command.plugin_name = self.name
+            if self.command_index is not None:
+                if name in self.commands:
+                    self.command_index.remove(self.commands[name])
+                self.command_index.add(plugin_command)
+            self.commands[name] = plugin_command
 
         # add dynamic hooks
         event: str
         hooks_list: List[PluginHook]
         for event, hooks_list in dynamic_hooks.items():
+            hook: PluginHook
+            for hook in hooks_list:
+                # hooks saved by earlier versions lack attributes added since
+                hook.__dict__.setdefault("ordered", False)
             if self.hooks.get(event):
                 self._get_hooks()[event] += hooks_list
             else:
                 self.hooks[event] = hooks_list
+        if self.hook_index is not None:
+            self.hook_index.invalidate()
 
         # add last execution for static timers and all dynamic timers
         state_timer: Timer
         static_timer: Timer
         for state_timer in timers:
+            # timers saved by earlier versions lack attributes added since
+            state_timer.__dict__.setdefault("last_due", None)
+            state_timer.__dict__.setdefault("timezone", None)
+            state_timer.__dict__.setdefault("misfire", "run_once")
+
             for static_timer in self._get_timers():
                 if static_timer.name == state_timer.name:
                     # update last execution from state, keep everything else
                     static_timer.last_execution = state_timer.last_execution
+                    static_timer.last_due = state_timer.last_due
                     break
 
             else:
@@ -1155,6 +1370,21 @@ class Plugin:
                 if state_timer.timer_type == "dynamic":
                     self.timers.append(state_timer)
 
+    async def fetch_image_data_from_url(self, url: str) -> bytes or None:
+        """
+        Try to get an encoded image from the given url, e.g. to post it using send_image() without decoding and encoding it again
+        :param url: a url to an image
+        :return:    the image's data if successfully retrieved,
+                    None otherwise
+        """
+
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(None, requests.get, url)
+            response.raise_for_status()
+            return response.content
+        except Exception:
+            return None
+
     async def fetch_image_from_url(self, url: str) -> Image or None:
         """
         Try to get an image from the given url
@@ -1163,10 +1393,11 @@ class Plugin:
                     None otherwise
         """
 
+        image_data: bytes or None = await self.fetch_image_data_from_url(url)
+        if image_data is None:
+            return None
         try:
-            response = requests.get(url)
-            image_bytes = io.BytesIO(response.content)
-            return Image.open(image_bytes)
+            return Image.open(io.BytesIO(image_data))
         except:
             return None
 
@@ -1249,6 +1480,48 @@ class Plugin:
         """
         self.client = client
 
+    def _set_command_index(self, command_index: CommandIndex) -> None:
+        """
+        Set the index of all plugins' commands and add the plugin's commands to it, it is kept up to date when adding or removing commands
+        :param command_index: the index
+        :return:
+        """
+
+        self.command_index = command_index
+        plugin_command: PluginCommand
+        for plugin_command in self.commands.values():
+            command_index.add(plugin_command)
+
+    def _set_hook_index(self, hook_index: HookIndex) -> None:
+        """
+        Set the index of all plugins' hooks, it is updated when adding, modifying or removing hooks
+        :param hook_index: the index
+        :return:
+        """
+
+        self.hook_index = hook_index
+        hook_index.invalidate()
+
+    def _set_timer_scheduler(self, timer_scheduler: TimerScheduler) -> None:
+        """
+        Set the scheduler running all plugins' timers, it is updated when adding or removing timers
+        :param timer_scheduler: the scheduler
+        :return:
+        """
+
+        self.timer_scheduler = timer_scheduler
+
+    def _set_data_backend(self, backend: str, journal_compaction_size: int = 1048576) -> None:
+        """
+        Set the backend used to store the plugin's data, needs to be called before loading the data
+        :param backend: name of the backend, one of core.plugin_data.DATA_BACKENDS
+        :param journal_compaction_size: size of the journal in bytes triggering a compaction, only used by the journal backend
+        :return:
+        """
+
+        self.data_store.close()
+        self.data_store = create_data_backend(backend, self.basepath, codec=self.data_codec, journal_compaction_size=journal_compaction_size)
+
     async def get_client(self) -> AsyncClient:
         """
         Get the bot's client instance
@@ -1267,6 +1540,7 @@ class PluginCommand:
             power_level,
             room_id: List[str],
             command_type: str = "static",
+            plugin_name: str or None = None,
     ):
         """
         Initialise a PluginCommand
@@ -1276,6 +1550,7 @@ class PluginCommand:
         :param power_level: an optional required power_level to execute the command
         :param room_id: an optional list of room_ids the command will be active on
         :param command_type: the optional type of the command, currently "static" (default) or "dynamic"
+        :param plugin_name: the name of the plugin the command belongs to
         """
 
         self.command: str = command
@@ -1284,6 +1559,7 @@ class PluginCommand:
         self.power_level: int = power_level
         self.room_id: List[str] = room_id
         self.command_type: str = command_type
+        self.plugin_name: str or None = plugin_name
 
     def _is_valid_from_room(self, room_id: str) -> bool:
         """
@@ -1304,6 +1580,7 @@ class PluginHook:
         room_id_list: List[str] = [],
         event_ids: List[str] = [],
         hook_type: str = "static",
+        ordered: bool = False,
     ):
         """
         Initialise a PluginHook
@@ -1312,9 +1589,11 @@ class PluginHook:
         :param room_id_list: an optional list of room_ids the hook should be active for
         :param event_ids: optional list of event-ids, the hook is applicable for, currently only useful for "m.reaction"-hooks
         :param hook_type: the optional type of the hook, currently "static" (default) or "dynamic"
+        :param ordered: whether the hook needs to run in order with other ordered hooks instead of concurrently
         """
         self.event_type: str = event_type
         self.method: Callable = method
         self.room_id_list: List[str] = room_id_list
         self.event_ids: List[str] = event_ids
         self.hook_type: str = hook_type
+        self.ordered: bool = ordered
@@ -0,0 +1,594 @@
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from core.data_codec import DataCodec
+from core.persistence import write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+REMOVED = object()
+"""Marker for values to be removed by PluginDataBackend.write()"""
+
+compaction_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compaction")
+"""runs the compactions of all journals, one at a time and apart from the persistence worker's threads"""
+
+
+def is_split(value: Any) -> bool:
+    """
+    :param value: a value to be stored
+    :return: True, if the value is stored as one entry per item (kind "dict"), False, if it is stored as a single entry (kind "value")
+    """
+
+    return type(value) is dict and bool(value) and all(isinstance(key, str) for key in value.keys())
+
+
+def split_value(codec: DataCodec, value: Any) -> Tuple[str, Dict[str, str]]:
+    """
+    Encode a value into the entries it is going to be stored in
+    :param codec: the codec to encode the entries with
+    :param value: the value to encode
+    :return:    Tuple of
+                    the kind of the value ("dict" or "value")
+                    Dict of entry-name and encoded entry
+    """
+
+    if is_split(value):
+        return "dict", {key: codec.encode(entry) for key, entry in value.items()}
+    else:
+        return "value", {"": codec.encode(value)}
+
+
+def join_entries(codec: DataCodec, kind: str, entries: Dict[str, str]) -> Any:
+    """
+    Decode a value from the entries it has been stored in
+    :param codec: the codec to decode the entries with
+    :param kind: the kind of the value ("dict" or "value")
+    :param entries: Dict of entry-name and encoded entry
+    :return: the decoded value
+    """
+
+    if kind == "dict":
+        return {entry: codec.decode(value) for entry, value in entries.items()}
+    else:
+        return codec.decode(entries.get("", "null"))
+
+
+class DataChange:
+    def __init__(self, kind: str or None, changed_entries: Dict[str, str], removed_entries: List[str]):
+        """
+        The changes to a single stored value that need to be written by a backend
+        :param kind: the new kind of the value, either "value" (stored as a single entry) or "dict" (stored as one entry per item),
+                     None if the value has been removed
+        :param changed_entries: Dict of entry-name and encoded entry of all entries that have been added or changed
+        :param removed_entries: names of entries that have been removed
+        """
+
+        self.kind: str or None = kind
+        self.changed_entries: Dict[str, str] = changed_entries
+        self.removed_entries: List[str] = removed_entries
+
+
+class PreparedValue:
+    def __init__(self, kind: str or None, entries: Dict[str, str], dirty_keys: Set[str] or None = None):
+        """
+        A value encoded to be written by PluginDataBackend.write_prepared()
+        :param kind: the kind of the value, either "value" or "dict", None if the value is to be removed
+        :param entries: Dict of entry-name and encoded entry, only the entries of dirty_keys still contained in the value if dirty_keys is given
+        :param dirty_keys: the only entries that might have changed since the value has last been written, None if all entries might have changed
+        """
+
+        self.kind: str or None = kind
+        self.entries: Dict[str, str] = entries
+        self.dirty_keys: Set[str] or None = dirty_keys
+
+
+class PluginDataBackend(ABC):
+    def __init__(self, filename: str, codec: DataCodec or None = None):
+        """
+        Base class for the persistent storage of a plugin's data.
+        Each name passed to Plugin.store_data() is stored separately. Dicts with string keys are split up further, keeping each of their entries
+        separately, so storing a single changed entry only writes that entry instead of all of the plugin's data.
+        :param filename: the file to store the data in
+        :param codec: the codec to encode entries with, defaults to jsonpickle
+        """
+
+        self.filename: str = filename
+        self.codec: DataCodec = codec or DataCodec()
+        self.lock: threading.Lock = threading.Lock()
+        """the backend is written to from the persistence worker's threads, make sure only one of them writes at a time"""
+
+        self._kinds: Dict[str, str] = {}
+        """kind of the value stored for each name, either "value" (stored as a single entry) or "dict" (stored as one entry per item)"""
+
+        self._entries: Dict[str, Dict[str, str]] = {}
+        """encoded entries as currently stored, used to determine which entries actually need to be written"""
+
+        self._needs_full: Set[str] = set()
+        """names whose last write failed, their stored entries might not match the entries a value's dirty keys are relative to"""
+
+    def exists(self) -> bool:
+        """
+        Check if the data file has already been created
+        :return:    True, if the data file exists
+                    False, otherwise
+        """
+
+        return os.path.isfile(self.filename)
+
+    def close(self) -> None:
+        """
+        Release all resources held by the backend
+        :return:
+        """
+
+        pass
+
+    @abstractmethod
+    def _read(self) -> None:
+        """
+        Read all stored entries into self._kinds and self._entries
+        :return:
+        """
+
+    @abstractmethod
+    def _write_changes(self, changes: Dict[str, DataChange]) -> None:
+        """
+        Persist the given changes, raises an exception if that fails
+        :param changes: Dict of name and the changes made to its value
+        :return:
+        """
+
+    def _after_write(self) -> None:
+        """
+        Called after changes have been written successfully, e.g. to run maintenance tasks
+        :return:
+        """
+
+        pass
+
+    def _split(self, value: Any) -> Tuple[str, Dict[str, str]]:
+        return split_value(self.codec, value)
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Load all stored data. Entries encoded in another format than the codec's current one are encoded again and written back.
+        :return: Dict of name and value of all stored data
+        """
+
+        with self.lock:
+            self._read()
+
+            data: Dict[str, Any] = {}
+            outdated: List[str] = []
+            name: str
+            kind: str
+            for name, kind in self._kinds.items():
+                entries: Dict[str, str] = self._entries[name]
+                data[name] = join_entries(self.codec, kind, entries)
+                if not all(self.codec.is_current(value) for value in entries.values()):
+                    outdated.append(name)
+
+        if outdated:
+            logger.info(f"Migrating {', '.join(outdated)} in {self.filename} to {self.codec.data_format}")
+            self.write({name: data[name] for name in outdated})
+
+        return data
+
+    def store(self, name: str, value: Any, dirty_keys: Set[str] or None = None) -> bool:
+        """
+        Store a single value, only writing the entries that differ from the ones currently stored
+        :param name: name of the value
+        :param value: the value to store
+        :param dirty_keys: keys of a dict that might have changed since it has last been stored, None if anything might have changed
+        :return:    True, if the value has been stored successfully
+                    False, otherwise
+        """
+
+        return self.write({name: value}, {name: dirty_keys})
+
+    def snapshot(self) -> Tuple[Dict[str, str], Dict[str, Dict[str, str]]]:
+        """
+        Get a consistent copy of the entries as currently stored, e.g. to create a backup from
+        :return:    Tuple of
+                        Dict of name and kind of the value
+                        Dict of name and Dict of entry-name and encoded entry
+        """
+
+        with self.lock:
+            return dict(self._kinds), {name: dict(entries) for name, entries in self._entries.items()}
+
+    def clear(self, name: str) -> bool:
+        """
+        Remove a value and all of its entries
+        :param name: name of the value to remove
+        :return:    True, if the value has been removed successfully
+                    False, otherwise
+        """
+
+        return self.write({name: REMOVED})
+
+    def prepare(self, values: Dict[str, Any], dirty: Dict[str, Set[str] or None] or None = None) -> Dict[str, PreparedValue]:
+        """
+        Encode values to be written by write_prepared(), e.g. before passing them to another thread while they might still be modified.
+        Of dicts stored as one entry per item, only the items of their dirty keys are encoded.
+        :param values: Dict of name and value to store, values of REMOVED remove the name
+        :param dirty: Dict of name and the keys that might have changed since the value has last been stored, None (or a missing name) if anything
+                      might have changed
+        :return: Dict of name and encoded value
+        """
+
+        prepared: Dict[str, PreparedValue] = {}
+        name: str
+        for name, value in values.items():
+            if value is REMOVED:
+                prepared[name] = PreparedValue(None, {})
+                continue
+
+            dirty_keys: Set[str] or None = (dirty or {}).get(name)
+            if dirty_keys is not None and self._kinds.get(name) == "dict" and name not in self._needs_full and is_split(value):
+                # the stored entries are read without the lock, write_prepared() makes sure they have not been replaced meanwhile
+                entries: Dict[str, str] = {key: self.codec.encode(value[key]) for key in dirty_keys if key in value}
+                prepared[name] = PreparedValue("dict", entries, set(dirty_keys))
+            else:
+                kind, entries = self._split(value)
+                prepared[name] = PreparedValue(kind, entries)
+
+        return prepared
+
+    def write(self, values: Dict[str, Any], dirty: Dict[str, Set[str] or None] or None = None) -> bool:
+        """
+        Write several values at once, only writing the entries that differ from the ones currently stored.
+        This is blocking and is usually called from the persistence worker's threads.
+        :param values: Dict of name and value to store, values of REMOVED remove the name
+        :param dirty: Dict of name and the keys that might have changed since the value has last been stored, None (or a missing name) if anything
+                      might have changed
+        :return:    True, if all values have been written successfully
+                    False, otherwise
+        """
+
+        return self.write_prepared(self.prepare(values, dirty))
+
+    def write_prepared(self, values: Dict[str, PreparedValue]) -> bool:
+        """
+        Write several values encoded by prepare() at once, only writing the entries that differ from the ones currently stored.
+        This is blocking and is usually called from the persistence worker's threads.
+        :param values: Dict of name and encoded value
+        :return:    True, if all values have been written successfully
+                    False, otherwise
+        """
+
+        with self.lock:
+            changes: Dict[str, DataChange] = {}
+            new_entries: Dict[str, Dict[str, str]] = {}
+            outdated: Set[str] = set()
+
+            name: str
+            value: PreparedValue
+            for name, value in values.items():
+                stored_entries: Dict[str, str] = self._entries.get(name, {})
+
+                if value.kind is None:
+                    if name in self._kinds:
+                        changes[name] = DataChange(None, {}, list(stored_entries.keys()))
+                    continue
+
+                if value.dirty_keys is not None:
+                    if self._kinds.get(name) != "dict" or name in self._needs_full:
+                        # the entries the dirty keys are relative to have been replaced since the value has been prepared
+                        logger.error(f"Could not write {name} to {self.filename}: its stored entries are outdated, it is written completely next time")
+                        outdated.add(name)
+                        continue
+                    changed_entries: Dict[str, str] = {entry: encoded for entry, encoded in value.entries.items() if stored_entries.get(entry) != encoded}
+                    removed_entries: List[str] = [entry for entry in value.dirty_keys if entry not in value.entries and entry in stored_entries]
+                    if changed_entries or removed_entries:
+                        changes[name] = DataChange("dict", changed_entries, removed_entries)
+                        new_entries[name] = self.__apply_entries(stored_entries, changed_entries, removed_entries)
+                    continue
+
+                if value.kind != self._kinds.get(name):
+                    # the kind changed, all entries need to be written again
+                    changed_entries = value.entries
+                else:
+                    changed_entries = {entry: encoded for entry, encoded in value.entries.items() if stored_entries.get(entry) != encoded}
+                removed_entries = [entry for entry in stored_entries.keys() if entry not in value.entries]
+                if value.kind != self._kinds.get(name) or changed_entries or removed_entries:
+                    changes[name] = DataChange(value.kind, changed_entries, removed_entries)
+                    new_entries[name] = value.entries
+
+            self._needs_full.difference_update(name for name in values.keys() if name not in changes)
+            self._needs_full.update(outdated)
+            if not changes:
+                return not outdated
+
+            try:
+                self._write_changes(changes)
+            except (OSError, sqlite3.Error) as err:
+                logger.critical(f"Could not write {', '.join(changes.keys())} to {self.filename}: {err}")
+                self._needs_full.update(changes.keys())
+                return False
+
+            change: DataChange
+            for name, change in changes.items():
+                self._needs_full.discard(name)
+                if change.kind is None:
+                    self._kinds.pop(name, None)
+                    self._entries.pop(name, None)
+                else:
+                    self._kinds[name] = change.kind
+                    self._entries[name] = new_entries[name]
+
+            self._after_write()
+            return not outdated
+
+    @staticmethod
+    def __apply_entries(stored_entries: Dict[str, str], changed_entries: Dict[str, str], removed_entries: Iterable[str]) -> Dict[str, str]:
+        """
+        :param stored_entries: the entries currently stored
+        :param changed_entries: entries added or changed
+        :param removed_entries: names of entries removed
+        :return: the stored entries after applying the changes
+        """
+
+        entries: Dict[str, str] = dict(stored_entries)
+        entries.update(changed_entries)
+        entry: str
+        for entry in removed_entries:
+            del entries[entry]
+        return entries
+
+    def import_data(self, data: Dict[str, Any]) -> bool:
+        """
+        Import data read from a legacy data file or another backend
+        :param data: Dict of name and value to import
+        :return:    True, if all values have been imported successfully
+                    False, otherwise
+        """
+
+        return self.write(data)
+
+
+class PluginDataStore(PluginDataBackend):
+    def __init__(self, filename: str, codec: DataCodec or None = None):
+        """
+        Persistent storage of a plugin's data in a local SQLite database in WAL mode.
+        Each name is kept in its own row of data_keys, each of its entries in its own row of data_entries.
+        :param filename: the SQLite database file to store the data in
+        :param codec: the codec to encode entries with, defaults to jsonpickle
+        """
+
+        super().__init__(filename, codec)
+        self.conn: sqlite3.Connection or None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the database (creating it if required), switch it to WAL mode and make sure all tables exist
+        :return: the connection to the database
+        """
+
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS data_keys (name TEXT PRIMARY KEY, kind TEXT NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS data_entries (name TEXT NOT NULL, entry TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (name, entry))"
+            )
+            self.conn.commit()
+
+        return self.conn
+
+    def close(self) -> None:
+        """
+        Close the connection to the database
+        :return:
+        """
+
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def _read(self) -> None:
+        conn: sqlite3.Connection = self._connect()
+        self._kinds = {name: kind for (name, kind) in conn.execute("SELECT name, kind FROM data_keys")}
+        self._entries = {name: {} for name in self._kinds.keys()}
+
+        name: str
+        entry: str
+        value: str
+        for name, entry, value in conn.execute("SELECT name, entry, value FROM data_entries ORDER BY rowid"):
+            if name in self._entries:
+                self._entries[name][entry] = value
+
+    def _write_changes(self, changes: Dict[str, DataChange]) -> None:
+        key_rows: List[Tuple[str, str]] = []
+        removed_keys: List[Tuple[str]] = []
+        changed_rows: List[Tuple[str, str, str]] = []
+        removed_rows: List[Tuple[str, str]] = []
+
+        name: str
+        change: DataChange
+        for name, change in changes.items():
+            if change.kind is None:
+                removed_keys.append((name,))
+            elif change.kind != self._kinds.get(name):
+                key_rows.append((name, change.kind))
+            changed_rows.extend((name, entry, encoded) for entry, encoded in change.changed_entries.items())
+            removed_rows.extend((name, entry) for entry in change.removed_entries)
+
+        conn: sqlite3.Connection = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO data_keys (name, kind) VALUES (?, ?)", key_rows)
+            conn.executemany("DELETE FROM data_keys WHERE name = ?", removed_keys)
+            conn.executemany("DELETE FROM data_entries WHERE name = ? AND entry = ?", removed_rows)
+            conn.executemany(
+                "INSERT INTO data_entries (name, entry, value) VALUES (?, ?, ?) ON CONFLICT (name, entry) DO UPDATE SET value = excluded.value",
+                changed_rows,
+            )
+
+
+class PluginDataJournal(PluginDataBackend):
+    def __init__(self, filename: str, codec: DataCodec or None = None, compaction_size: int = 1048576, executor: Executor or None = None):
+        """
+        Persistent storage of a plugin's data as an append-only journal of changes.
+        Every write appends one record per changed name, containing only its changed and removed entries, and fsyncs the journal once.
+        As soon as the journal grows beyond compaction_size, a compaction is run in the background: all entries are written to a snapshot and
+        the records contained in it are removed from the journal, while further writes keep being appended.
+        Loading reads the snapshot and replays the journal on top of it.
+        :param filename: the journal file, the snapshot is kept next to it in <filename>.snapshot
+        :param codec: the codec to encode entries with, defaults to jsonpickle
+        :param compaction_size: size of the journal in bytes triggering a compaction
+        :param executor: the executor to run compactions in, defaults to compaction_executor
+        """
+
+        super().__init__(filename, codec)
+        self.snapshot_filename: str = f"{filename}.snapshot"
+        self.compaction_size: int = compaction_size
+        self.executor: Executor = executor or compaction_executor
+        self.journal_size: int = 0
+        self.compaction: Future or None = None
+        """the compaction running in the background, if any"""
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.filename) or os.path.isfile(self.snapshot_filename)
+
+    def close(self) -> None:
+        """
+        Wait for a running compaction to finish
+        :return:
+        """
+
+        compaction: Future or None = self.compaction
+        if compaction is not None:
+            compaction.exception()
+
+    def _read(self) -> None:
+        self._kinds = {}
+        self._entries = {}
+
+        if os.path.isfile(self.snapshot_filename):
+            with open(self.snapshot_filename, "r") as file:
+                snapshot: Dict[str, Dict[str, Any]] = json.load(file)
+            self._kinds = snapshot["kinds"]
+            self._entries = snapshot["entries"]
+
+        self.journal_size = 0
+        if os.path.isfile(self.filename):
+            with open(self.filename, "rb") as file:
+                line: bytes
+                for line in file:
+                    try:
+                        record: Dict[str, Any] = json.loads(line)
+                    except ValueError:
+                        # a record only partially written before a crash, nothing after it has been written successfully
+                        logger.warning(f"Ignoring incomplete record at the end of {self.filename}")
+                        break
+                    self.__replay(record)
+                    self.journal_size += len(line)
+
+    def __replay(self, record: Dict[str, Any]) -> None:
+        """
+        Apply a record of the journal to the entries read so far
+        :param record: the record to apply
+        :return:
+        """
+
+        name: str = record["name"]
+        if record["kind"] is None:
+            self._kinds.pop(name, None)
+            self._entries.pop(name, None)
+            return
+
+        if record["kind"] != self._kinds.get(name):
+            self._entries[name] = {}
+        self._kinds[name] = record["kind"]
+        entries: Dict[str, str] = self._entries.setdefault(name, {})
+        entries.update(record["changed"])
+        entry: str
+        for entry in record["removed"]:
+            entries.pop(entry, None)
+
+    def _write_changes(self, changes: Dict[str, DataChange]) -> None:
+        records: str = "".join(
+            json.dumps({"name": name, "kind": change.kind, "changed": change.changed_entries, "removed": change.removed_entries}) + "\n"
+            for name, change in changes.items()
+        )
+        encoded_records: bytes = records.encode("utf-8")
+
+        with open(self.filename, "ab") as file:
+            if file.tell() != self.journal_size:
+                # drop an incomplete record left behind by a crash before appending to it
+                file.truncate(self.journal_size)
+            file.write(encoded_records)
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_size += len(encoded_records)
+
+    def _after_write(self) -> None:
+        if self.journal_size > self.compaction_size and (self.compaction is None or self.compaction.done()):
+            self.compaction = self.executor.submit(self.compact)
+
+    def compact(self) -> bool:
+        """
+        Write all entries to the snapshot and remove the records contained in it from the journal.
+        Only collecting the entries and replacing the journal hold the lock, the snapshot is written while further records are appended to the
+        journal. Both files are replaced atomically, the snapshot first, so a crash in between only leads to records being replayed again on top
+        of a snapshot already containing them, which results in the same entries.
+        :return:    True, if the journal has been compacted
+                    False, otherwise
+        """
+
+        with self.lock:
+            # the entries of a name are replaced rather than modified by writes, copying the dicts holding them is sufficient
+            kinds: Dict[str, str] = dict(self._kinds)
+            entries: Dict[str, Dict[str, str]] = dict(self._entries)
+            compacted_size: int = self.journal_size
+
+        try:
+            write_file_atomic(self.snapshot_filename, json.dumps({"kinds": kinds, "entries": entries}))
+        except OSError as err:
+            logger.error(f"Could not compact {self.filename}: {err}")
+            return False
+
+        with self.lock:
+            try:
+                # keep the records appended while the snapshot has been written
+                with open(self.filename, "rb") as file:
+                    file.seek(compacted_size)
+                    remaining: bytes = file.read(self.journal_size - compacted_size)
+                write_file_atomic(self.filename, remaining)
+            except OSError as err:
+                logger.error(f"Could not compact {self.filename}: {err}")
+                return False
+            self.journal_size -= compacted_size
+
+        logger.debug(f"Compacted {self.filename} ({compacted_size} bytes)")
+        return True
+
+
+DATA_BACKENDS: Dict[str, str] = {"sqlite": "db", "journal": "journal"}
+"""available backends and the file extension of their data files"""
+
+
+def create_data_backend(backend: str, basepath: str, codec: DataCodec or None = None, journal_compaction_size: int = 1048576) -> PluginDataBackend:
+    """
+    Create the storage backend for a plugin's data
+    :param backend: name of the backend, one of DATA_BACKENDS
+    :param basepath: path of the plugin's files without extension, e.g. plugins/<name>/<name>
+    :param codec: the codec to encode entries with, defaults to jsonpickle
+    :param journal_compaction_size: size of the journal in bytes triggering a compaction, only used by the journal backend
+    :return: the backend
+    """
+
+    filename: str = f"{basepath}.{DATA_BACKENDS[backend]}"
+    if backend == "journal":
+        return PluginDataJournal(filename, codec=codec, compaction_size=journal_compaction_size)
+    else:
+        return PluginDataStore(filename, codec=codec)
@@ -1,20 +1,29 @@
-import copy
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
 
 from nio import UnknownEvent, RoomMessageText, AsyncClient
 
-from core.chat_functions import send_text_to_room
+from core.chat_functions import render_markdown, render_message, send_text_to_room, set_markdown_renderer
+from core.coalescer import message_coalescer
+from core.command_index import CommandIndex
+from core.dispatcher import Dispatcher
+from core.hook_index import HookIndex
 from core.plugin import Plugin, PluginCommand, PluginHook
-from core.timer import Timer
+from core.media_cache import media_cache
+from core.member_directory import member_directory
+from core.outbound import outbound_queue
+from core.persistence import persistence_worker
+from core.sent_events import sent_event_cache
+from core.timer import Timer, TimerScheduler
 from core.config import Config
 from sys import modules
 from re import match
 from time import time
-import operator
-from typing import List, Dict
+from typing import Any, AsyncContextManager, AsyncIterator, Dict, List, Set, Tuple
 import glob
-from os.path import basename, isfile, isdir
+from os.path import basename, isfile, isdir, join
 import importlib
-from fuzzywuzzy import fuzz
 import logging
 import traceback
 
@@ -31,6 +40,40 @@ class PluginLoader:
         """
 
         self.config: Config = config
+        self.command_index: CommandIndex = CommandIndex(fuzzy_threshold=self.config.command_fuzzy_threshold)
+        self.timer_scheduler: TimerScheduler = TimerScheduler(on_triggered=self.__timer_triggered, get_lock=self.__hold_timer_lock)
+        self.dispatcher: Dispatcher = Dispatcher(
+            max_workers=self.config.command_workers,
+            max_in_flight=self.config.command_max_in_flight,
+            max_queued_per_room=self.config.command_max_queued_per_room,
+        )
+        self.plugin_locks: Dict[str, asyncio.Lock] = {}
+        """held while a command, hook or timer of a serialized plugin is running, by plugin name"""
+        self.hook_tasks: Set[asyncio.Task] = set()
+        """hooks running in the background"""
+        self.hook_semaphores: Dict[str, asyncio.Semaphore] = {}
+        """limits the number of concurrently running hooks, by plugin name"""
+        self.hook_counts: Dict[str, int] = {}
+        """number of hooks running or waiting to be run, by plugin name"""
+        self.hook_timeouts: int = 0
+        self.hook_cancellations: int = 0
+        self.hook_drops: int = 0
+        persistence_worker.configure(delay=self.config.plugin_data_flush_delay)
+        set_markdown_renderer(self.config.markdown_renderer)
+        outbound_queue.configure(
+            self.config.outbound_room_rate, self.config.outbound_room_burst, self.config.outbound_global_rate, self.config.outbound_global_burst
+        )
+        message_coalescer.configure(self.config.outbound_coalesce_window, self.config.outbound_coalesce_max_messages)
+        member_directory.configure(self.config.members_ttl)
+        media_cache.configure(
+            join(self.config.store_filepath, "media_cache.db") if self.config.media_cache_max_entries else None,
+            self.config.media_cache_max_entries,
+            self.config.media_cache_max_size,
+        )
+        sent_event_cache.configure(
+            join(self.config.store_filepath, "sent_events.db") if self.config.sent_events_max_entries else None, self.config.sent_events_max_entries
+        )
+
         # import all plugins
         module_all = glob.glob(f"{plugins_dir}/*")
         module_all.sort()
@@ -70,6 +113,7 @@ class PluginLoader:
 
         # get all loaded plugins from sys.modules and make them available as plugin_list
         self.__plugin_list: Dict[str, Plugin] = {}
+        self.hook_index: HookIndex = HookIndex(self.__plugin_list)
 
         for key in modules.keys():
             if match(r"^plugins\.\w*(\.\w*)?", key):
@@ -79,6 +123,13 @@ class PluginLoader:
         for plugin in self.__plugin_list.values():
             """Set the bot's client instance"""
             plugin._set_client(client)
+            plugin._set_command_index(self.command_index)
+            plugin._set_hook_index(self.hook_index)
+            plugin._set_timer_scheduler(self.timer_scheduler)
+            plugin._set_data_backend(self.config.plugin_data_backend, journal_compaction_size=self.config.plugin_data_journal_compaction_size)
+            plugin.backups.configure(
+                self.config.plugin_data_backup_keep_recent, self.config.plugin_data_backup_keep_hourly, self.config.plugin_data_backup_keep_daily
+            )
 
             """Display details about the loaded plugins, this does nothing else"""
             logger.info(f"Loaded plugin {plugin.name}:")
@@ -104,9 +155,22 @@ class PluginLoader:
             return not self.config.plugins_allowlist or plugin in self.config.plugins_allowlist
 
     async def load_plugin_data(self):
+        """
+        Preload all plugins' data concurrently, if configured. Otherwise, each plugin's data is loaded on first access.
+        :return:
+        """
 
-        for plugin in self.__plugin_list.values():
-            plugin.plugin_data = await plugin._load_data_from_file()
+        if self.config.plugin_data_loading != "preload":
+            return
+
+        start: float = time()
+        plugins: List[Plugin] = list(self.__plugin_list.values())
+        await asyncio.gather(*[plugin._ensure_data_loaded() for plugin in plugins])
+
+        logger.info(f"Loaded data of {len(plugins)} plugins in {(time() - start) * 1000:.1f}ms:")
+        plugin: Plugin
+        for plugin in sorted(plugins, key=lambda loaded_plugin: loaded_plugin.data_load_time, reverse=True):
+            logger.info(f"  {plugin.name}: {plugin.data_load_time * 1000:.1f}ms")
 
     async def load_plugin_state(self):
         """
@@ -117,6 +181,61 @@ class PluginLoader:
         for plugin in self.get_plugins().values():
             plugin._load_state()
 
+    async def shutdown(self):
+        """
+        Stop running commands and write all pending plugin data and states to disk
+        :return:
+        """
+
+        await self.timer_scheduler.stop()
+        await self.dispatcher.close()
+        task: asyncio.Task
+        for task in self.hook_tasks:
+            task.cancel()
+        await asyncio.gather(*self.hook_tasks, return_exceptions=True)
+        await message_coalescer.close()
+        await outbound_queue.close()
+        await persistence_worker.close()
+        media_cache.close()
+        sent_event_cache.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get statistics about the bot's internals
+        :return: Dict of component name and its statistics
+        """
+
+        return {
+            "persistence": persistence_worker.get_stats(),
+            "commands": self.command_index.get_stats(),
+            "command queue": self.dispatcher.get_stats(),
+            "timers": self.timer_scheduler.get_stats(),
+            "outbound": outbound_queue.get_stats(),
+            "coalescing": message_coalescer.get_stats(),
+            "media cache": media_cache.get_stats(),
+            "sent events": sent_event_cache.get_stats(),
+            "members": member_directory.get_stats(),
+            "rendering cache": {
+                "messages": f"{render_message.cache_info().hits} hits, {render_message.cache_info().misses} misses",
+                "markdown": f"{render_markdown.cache_info().hits} hits, {render_markdown.cache_info().misses} misses",
+            },
+            "command queues by room": {
+                room_id: ", ".join(f"{name}: {value}" for name, value in room_stats.items())
+                for room_id, room_stats in self.dispatcher.get_room_stats().items()
+            },
+            "hooks": {
+                "index rebuilds": self.hook_index.rebuilds,
+                "index updates": self.hook_index.updates,
+                "running or queued": len(self.hook_tasks),
+                "timeouts": self.hook_timeouts,
+                "dropped": self.hook_drops,
+                "cancelled": self.hook_cancellations,
+            },
+            "data loading (ms)": {
+                plugin.name: round(plugin.data_load_time * 1000, 1) for plugin in self.__plugin_list.values() if plugin.data_load_time is not None
+            },
+        }
+
     def get_plugins(self) -> Dict[str, Plugin]:
 
         return self.__plugin_list
@@ -141,27 +260,17 @@ class PluginLoader:
 
         for plugin in self.get_plugins().values():
             for event_type, current_plugin_hooks in plugin._get_hooks().items():
-                if event_type in all_plugin_hooks.keys():
-                    for plugin_hook in current_plugin_hooks:
-                        all_plugin_hooks[event_type].append(plugin_hook)
-                else:
-                    all_plugin_hooks[event_type] = copy.deepcopy(current_plugin_hooks)
+                all_plugin_hooks.setdefault(event_type, []).extend(current_plugin_hooks)
 
         return all_plugin_hooks
 
     def get_commands(self) -> Dict[str, PluginCommand]:
         """
         Get all commands curently registered by all plugins
-        :return: Dict of command-string and the corresponding PluginCommand
+        :return: Dict of command-string and the corresponding PluginCommand, kept up to date by the plugins - do not modify
         """
 
-        plugin_commands: Dict[str, PluginCommand] = {}
-        plugin: Plugin
-
-        for plugin in self.get_plugins().values():
-            plugin_commands.update(plugin._get_commands())
-
-        return plugin_commands
+        return self.command_index.commands
 
     def get_timers(self) -> List[Timer]:
         """
@@ -189,32 +298,37 @@ class PluginLoader:
         logger.debug(f"Running Command {command.command} with args {command.args}")
 
         command_start = command.command.split()[0].lower()
-        run_command: str = ""
+        run_command: str or None = None
+        plugin_command: PluginCommand
 
-        if command_start in self.get_commands().keys():
+        if command_start in self.command_index.commands:
             run_command = command_start
 
         # Command not found, try fuzzy matching
-        else:
-            ratios: Dict[str, int] = {}
-            for key in self.get_commands().keys():
-                if fuzz.ratio(command_start, key) > 60:
-                    ratios[key] = fuzz.ratio(command_start, key)
-
-            # Sort matching commands by match percentage and get the highest match
-            if ratios != {}:
-                run_command = sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+        elif self.config.command_fuzzy_matching != "off":
+            run_command = self.command_index.resolve(command_start)
+
+            if run_command is not None and self.config.command_fuzzy_matching == "suggest":
+                plugin_command = self.command_index.get(run_command)
+                if (
+                    self.command_index.is_valid_for_room(run_command, command.room.room_id)
+                    and command.room.power_levels.get_user_level(command.event.sender) >= plugin_command.power_level
+                ):
+                    await send_text_to_room(command.client, command.room.room_id, f"Unknown command `{command_start}`, did you mean `{run_command}`?")
+                return 1
 
         # check if we did actually find a matching command
-        if run_command != "":
-            if not self.get_commands()[run_command].room_id or command.room.room_id in self.get_commands()[run_command].room_id:
+        if run_command is not None:
+            plugin_command = self.command_index.get(run_command)
+            if self.command_index.is_valid_for_room(run_command, command.room.room_id):
 
                 # check if the user's power_level matches the command's requirement
-                if command.room.power_levels.get_user_level(command.event.sender) >= self.get_commands()[run_command].power_level:
+                if command.room.power_levels.get_user_level(command.event.sender) >= plugin_command.power_level:
 
                     # Make sure, exceptions raised by plugins do not kill the bot
                     try:
-                        await self.get_commands()[run_command].method(command)
+                        async with self.hold_plugin_lock(plugin_command.plugin_name):
+                            await plugin_command.method(command)
                     except Exception:
                         logger.critical(f"Plugin failed to catch exception caused by {command_start}:")
                         traceback.print_exc()
@@ -228,10 +342,15 @@ class PluginLoader:
                     return 2
             else:
                 return 1
+        else:
+            return 1
 
     async def run_hooks(self, client, event_type: str, room, event: UnknownEvent or RoomMessageText):
         """
-        Run all applicable hooks for the event_type
+        Start all applicable hooks for the event_type in the background, so the sync callbacks do not wait for them.
+        Hooks are run concurrently in tasks of their own, except for ordered hooks, which are run one after another in the order they have been
+        registered in. Ordered hooks are queued per room by the dispatcher, so they also see the events of a room in the order they arrived in.
+        Unordered hooks of a plugin that already has the configured maximum number of hooks running and queued are dropped.
         :param client:
         :param event_type:
         :param room:
@@ -239,56 +358,152 @@ class PluginLoader:
         :return:
         """
 
-        if event_type in self.get_hooks().keys():
+        relates_to: str or None = event.source.get("content", {}).get("m.relates_to", {}).get("event_id")
 
-            plugin_hooks: List[PluginHook] = self.get_hooks()[event_type]
-            plugin_hook: PluginHook
+        # hooks valid for the room of the current event and, if restricted to specific events, relating to one of them
+        plugin_hooks: List[Tuple[Plugin, PluginHook]] = self.hook_index.get_hooks(event_type, room.room_id, relates_to)
+        if not plugin_hooks:
+            return
 
-            for plugin_hook in plugin_hooks:
-                if (not plugin_hook.room_id_list or room.room_id in plugin_hook.room_id_list) and (
-                    not plugin_hook.event_ids or event.source["content"]["m.relates_to"]["event_id"] in plugin_hook.event_ids
-                ):
-                    # plugin_hook is valid for room of the current event and
-                    # event relates to a specified event_id
+        ordered_hooks: List[Tuple[Plugin, PluginHook]] = []
+        plugin: Plugin
+        plugin_hook: PluginHook
+        for plugin, plugin_hook in plugin_hooks:
+            if plugin_hook.ordered:
+                ordered_hooks.append((plugin, plugin_hook))
+            elif self.hook_counts.get(plugin.name, 0) >= self.config.hook_max_concurrent_per_plugin + self.config.hook_max_queued_per_plugin:
+                self.hook_drops += 1
+                logger.warning(f"Dropped hook {plugin_hook.method.__name__} of plugin {plugin.name} on {room.room_id} for {event.event_id}, too many queued")
+            else:
+                task: asyncio.Task = asyncio.get_running_loop().create_task(self.__run_hook(client, plugin, plugin_hook, room, event))
+                self.hook_tasks.add(task)
+                task.add_done_callback(self.hook_tasks.discard)
+                self.hook_counts[plugin.name] = self.hook_counts.get(plugin.name, 0) + 1
+                task.add_done_callback(partial(self.__hook_finished, plugin.name))
 
-                    # Make sure, exceptions raised by plugins do not kill the bot
-                    try:
-                        await plugin_hook.method(client, room.room_id, event)
-                    except Exception as err:
-                        logger.critical(f"Plugin failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
-                        traceback.print_exc()
+        if ordered_hooks:
+            self.dispatcher.submit(f"hooks {room.room_id}", partial(self.__run_ordered_hooks, client, ordered_hooks, room, event))
 
-    async def run_timers(self, client, timestamp: float) -> float:
+    def __hook_finished(self, plugin_name: str, task: asyncio.Task) -> None:
+        """
+        Keep track of the number of a plugin's hooks running or waiting to be run
+        :param plugin_name: the name of the plugin the hook belongs to
+        :param task: the finished task running the hook
+        :return:
         """
-        Checks all timers if their execution is due and executes them
+
+        self.hook_counts[plugin_name] -= 1
+
+    async def __run_ordered_hooks(self, client, plugin_hooks: List[Tuple[Plugin, PluginHook]], room, event: UnknownEvent or RoomMessageText):
+        """
+        Run hooks one after another
         :param client:
-        :param timestamp: timestamp of last execution to make sure we're not running more than once every 30s
+        :param plugin_hooks: the hooks to run along with the plugins they belong to
+        :param room:
+        :param event:
         :return:
         """
 
-        """Do not run timers more often than every 30s"""
-        if time() >= timestamp + 30:
+        plugin: Plugin
+        plugin_hook: PluginHook
+        for plugin, plugin_hook in plugin_hooks:
+            await self.__run_hook(client, plugin, plugin_hook, room, event)
 
-            timer: Timer
-            affected_plugins: List[str] = []
+    async def __run_hook(self, client, plugin: Plugin, plugin_hook: PluginHook, room, event: UnknownEvent or RoomMessageText):
+        """
+        Run a single hook, limited to the configured number of concurrently running hooks per plugin (and for serialized plugins once no other
+        command, hook or timer of its plugin is running). It is cancelled once it exceeds the configured timeout, including the time spent waiting.
+        :param client:
+        :param plugin: the plugin the hook belongs to
+        :param plugin_hook: the hook to run
+        :param room:
+        :param event:
+        :return:
+        """
 
-            # check all timers for execution
-            for timer in self.get_timers():
-                try:
-                    if await timer.trigger(client):
-                        logger.debug(f"Timer {timer.name} triggered")
-                        affected_plugins.append(timer.name.split(".")[0])
-                except Exception:
-                    logger.critical(f"Plugin failed to catch exception caused by timer {timer.name}:")
-                    traceback.print_exc()
+        semaphore: asyncio.Semaphore or None = self.hook_semaphores.get(plugin.name)
+        if semaphore is None:
+            semaphore = self.hook_semaphores[plugin.name] = asyncio.Semaphore(self.config.hook_max_concurrent_per_plugin)
 
-            # save state of a plugin if it's timer has triggered
-            if affected_plugins:
-                plugin: Plugin
-                for plugin in self.get_plugins().values():
-                    if plugin.name in affected_plugins:
-                        plugin._save_state()
+        async def run() -> None:
+            async with semaphore, self.hold_plugin_lock(plugin.name):
+                await plugin_hook.method(client, room.room_id, event)
 
-            return time()
+        # Make sure, exceptions raised by plugins do not kill the bot
+        try:
+            await asyncio.wait_for(run(), timeout=self.config.hook_timeout or None)
+        except asyncio.TimeoutError:
+            self.hook_timeouts += 1
+            logger.warning(
+                f"Hook {plugin_hook.method.__name__} of plugin {plugin.name} exceeded the timeout of {self.config.hook_timeout}s on "
+                f"{room.room_id} for {event.event_id} and has been cancelled"
+            )
+        except asyncio.CancelledError:
+            self.hook_cancellations += 1
+            logger.warning(f"Hook {plugin_hook.method.__name__} of plugin {plugin.name} has been cancelled on {room.room_id} for {event.event_id}")
+            raise
+        except Exception:
+            logger.critical(f"Plugin {plugin.name} failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
+            traceback.print_exc()
+
+    def get_plugin_lock(self, name: str or None) -> asyncio.Lock or None:
+        """
+        Get the lock held while a command, hook or timer of a serialized plugin is running. Running them one at a time keeps the plugin's
+        read_data-modify-store_data sequences (and other changes to its state) from interleaving across awaits.
+        :param name: the name of the plugin
+        :return: the plugin's lock, None if the plugin is unknown or not serialized
+        """
+
+        plugin: Plugin or None = self.__plugin_list.get(name)
+        if plugin is None or not plugin.serialized:
+            return None
+
+        lock: asyncio.Lock or None = self.plugin_locks.get(name)
+        if lock is None:
+            lock = self.plugin_locks[name] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def hold_plugin_lock(self, name: str or None) -> AsyncIterator[None]:
+        """
+        Hold the lock of a serialized plugin, does nothing for other plugins
+        :param name: the name of the plugin
+        :return:
+        """
+
+        lock: asyncio.Lock or None = self.get_plugin_lock(name)
+        if lock is None:
+            yield
         else:
-            return timestamp
+            async with lock:
+                yield
+
+    def __hold_timer_lock(self, timer: Timer) -> AsyncContextManager[None]:
+        """
+        Hold the lock of the plugin a timer belongs to, if it is serialized
+        :param timer: the timer
+        :return:
+        """
+
+        return self.hold_plugin_lock(timer.name.split(".")[0])
+
+    def start_timers(self, client) -> None:
+        """
+        Start running all plugins' timers when they are due, does nothing if they are already running
+        :param client:
+        :return:
+        """
+
+        if not self.timer_scheduler.is_running():
+            self.timer_scheduler.start(client, self.get_timers())
+
+    def __timer_triggered(self, timer: Timer) -> None:
+        """
+        Save the state of the plugin a timer belongs to after it has been triggered
+        :param timer: the triggered timer
+        :return:
+        """
+
+        plugin: Plugin or None = self.get_plugin_by_name(timer.name.split(".")[0])
+        if plugin is not None:
+            plugin._save_state()
@@ -0,0 +1,71 @@
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict
+
+import commonmark
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cmarkgfm
+    from cmarkgfm.cmark import Options as CmarkOptions
+except ImportError:
+    cmarkgfm = None
+
+
+class MarkdownRenderer(ABC):
+    name: str = ""
+
+    @abstractmethod
+    def render(self, text: str) -> str:
+        """
+        Render markdown to HTML
+        :param text: the markdown to render
+        :return: the rendered HTML
+        """
+
+
+class CommonmarkRenderer(MarkdownRenderer):
+    name: str = "commonmark"
+
+    def render(self, text: str) -> str:
+        """
+        Render markdown to HTML using commonmark-py (pure python)
+        :param text: the markdown to render
+        :return: the rendered HTML
+        """
+
+        return commonmark.commonmark(text)
+
+
+class CmarkgfmRenderer(MarkdownRenderer):
+    name: str = "cmarkgfm"
+
+    def render(self, text: str) -> str:
+        """
+        Render markdown to HTML using cmarkgfm (bindings to the C reference implementation). GFM extensions are not enabled and raw HTML is
+        passed through, so the output matches commonmark-py's.
+        :param text: the markdown to render
+        :return: the rendered HTML
+        """
+
+        return cmarkgfm.markdown_to_html(text, options=CmarkOptions.CMARK_OPT_UNSAFE)
+
+
+RENDERERS: Dict[str, type] = {"commonmark": CommonmarkRenderer, "cmarkgfm": CmarkgfmRenderer}
+"""available markdown renderers, by name"""
+
+
+def create_renderer(name: str) -> MarkdownRenderer:
+    """
+    Create a markdown renderer, falling back to commonmark if the requested renderer is not installed
+    :param name: name of the renderer, one of RENDERERS
+    :return: the renderer
+    """
+
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown markdown renderer {name}, must be one of {', '.join(RENDERERS.keys())}")
+    if name == "cmarkgfm" and cmarkgfm is None:
+        logger.warning("cmarkgfm is not installed, rendering markdown using commonmark instead")
+        name = "commonmark"
+    return RENDERERS[name]()
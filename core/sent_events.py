@@ -0,0 +1,72 @@
+from typing import Any, Dict
+
+from core.sqlite_cache import SQLiteCache
+
+
+class SentEvent:
+    def __init__(self, body: str, formatted_body: str or None):
+        """
+        The current content of a message sent by the bot, i.e. the content of its latest edit
+        :param body: the plain text of the message
+        :param formatted_body: the HTML of the message, None if it has not been formatted
+        """
+
+        self.body: str = body
+        self.formatted_body: str or None = formatted_body
+
+
+class SentEventCache(SQLiteCache):
+    name = "sent event cache"
+    table = "events"
+    key_column = "event_id"
+    columns = {"body": "TEXT NOT NULL", "formatted_body": "TEXT"}
+    entry_type = SentEvent
+
+    def __init__(self, filename: str or None = None, max_entries: int = 1000):
+        """
+        Cache of the content of messages sent by the bot, by event_id, so editing a message does not need to fetch the original from the server
+        to find out whether its content changed.
+        The least recently used entries are evicted once there are more than max_entries entries.
+        :param filename: the database to persist the cache in, None to keep it in memory only
+        :param max_entries: maximum number of entries
+        """
+
+        super().__init__(filename, max_entries)
+
+    def get(self, event_id: str) -> SentEvent or None:
+        """
+        Look up the current content of a message sent by the bot
+        :param event_id: the event_id of the message
+        :return: the content, None if the event is unknown
+        """
+
+        return super().get(event_id)
+
+    def put(self, event_id: str, event: SentEvent) -> None:
+        """
+        Remember the current content of a message
+        :param event_id: the event_id of the message, the original event's one for edits
+        :param event: the content
+        :return:
+        """
+
+        super().put(event_id, event)
+
+    def put_content(self, event_id: str, content: Dict[str, Any]) -> None:
+        """
+        Remember the content of a message event sent by the bot. For edits, the new content is remembered for the original event.
+        :param event_id: the event_id of the sent event
+        :param content: the content of the event
+        :return:
+        """
+
+        relation: Dict[str, Any] = content.get("m.relates_to") or {}
+        if relation.get("rel_type") == "m.replace" and "m.new_content" in content:
+            event_id = relation.get("event_id")
+            content = content["m.new_content"]
+        if event_id is not None and isinstance(content.get("body"), str):
+            self.put(event_id, SentEvent(content["body"], content.get("formatted_body")))
+
+
+sent_event_cache: SentEventCache = SentEventCache()
+"""cache of the content of all messages sent by the bot"""
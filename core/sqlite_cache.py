@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteCache:
+    name: str = "cache"
+    """name of the cache used in log messages"""
+    table: str = "entries"
+    key_column: str = "key"
+    columns: Dict[str, str] = {}
+    """columns of the table besides key and last_used along with their definitions, named after the attributes of the entries"""
+    entry_type: type = object
+    """type of the entries, constructed from the columns in order"""
+
+    def __init__(self, filename: str or None = None, max_entries: int = 1000):
+        """
+        Least recently used cache of entries by a string key, the base of the bot's persistent caches.
+        The least recently used entries are evicted once there are more than max_entries entries (or the limits of a subclass are exceeded).
+        Entries are kept in memory and, if a filename is given, in a SQLite database written in a background thread.
+        :param filename: the database to persist the cache in, None to keep it in memory only
+        :param max_entries: maximum number of entries
+        """
+
+        self.max_entries: int = max_entries
+        self.entries: Dict[str, Any] = OrderedDict()
+        """entries by key, least recently used first"""
+        self.connection: sqlite3.Connection or None = None
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.table)
+        """a single thread, so all writes are serialised on the same connection"""
+
+        # statistics
+        self.hits: int = 0
+        self.misses: int = 0
+
+        if filename is not None:
+            self.open(filename)
+
+    def configure(self, filename: str or None, max_entries: int) -> None:
+        """
+        Apply the bot's configuration
+        :param filename: the database to persist the cache in, None to keep it in memory only
+        :param max_entries: maximum number of entries
+        :return:
+        """
+
+        self.max_entries = max_entries
+        if filename is not None:
+            self.open(filename)
+        self.__evict()
+
+    def open(self, filename: str) -> None:
+        """
+        Open the database and load all entries from it
+        :param filename: the database
+        :return:
+        """
+
+        try:
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(filename, check_same_thread=False)
+            definitions: str = ", ".join(f"{column} {definition}" for column, definition in self.columns.items())
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({self.key_column} TEXT PRIMARY KEY, {definitions}, last_used REAL NOT NULL)")
+            self.connection.commit()
+            rows = self.connection.execute(f"SELECT {self.key_column}, {', '.join(self.columns)} FROM {self.table} ORDER BY last_used").fetchall()
+        except sqlite3.Error as err:
+            logger.warning(f"Could not open {self.name} {filename}, caching in memory only: {err}")
+            self.connection = None
+            return
+
+        self.entries.clear()
+        self._cleared()
+        row: Tuple[Any, ...]
+        for row in rows:
+            entry: Any = self.entry_type(*row[1:])
+            self.entries[row[0]] = entry
+            self._added(entry)
+
+    def __write(self, query: str, parameters: Tuple[Any, ...]) -> None:
+        """
+        Execute a query on the database in the background
+        :param query: the query
+        :param parameters: the query's parameters
+        :return:
+        """
+
+        if self.connection is None:
+            return
+
+        def execute() -> None:
+            try:
+                self.connection.execute(query, parameters)
+                self.connection.commit()
+            except sqlite3.Error as err:
+                logger.warning(f"Could not update {self.name}: {err}")
+
+        try:
+            asyncio.get_running_loop().run_in_executor(self.executor, execute)
+        except RuntimeError:
+            # no running event loop
+            execute()
+
+    def get(self, key: str) -> Any or None:
+        """
+        Look up an entry and mark it as recently used
+        :param key: the key of the entry
+        :return: the entry, None if it is not cached
+        """
+
+        entry: Any or None = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        self.__write(f"UPDATE {self.table} SET last_used = ? WHERE {self.key_column} = ?", (time.time(), key))
+        return entry
+
+    def put(self, key: str, entry: Any) -> None:
+        """
+        Add an entry to the cache, replacing the previous entry by the same key
+        :param key: the key of the entry
+        :param entry: the entry
+        :return:
+        """
+
+        if self.max_entries == 0:
+            return
+
+        previous: Any or None = self.entries.pop(key, None)
+        if previous is not None:
+            self._removed(previous)
+        self.entries[key] = entry
+        self._added(entry)
+        placeholders: str = ", ".join("?" * (len(self.columns) + 2))
+        self.__write(
+            f"INSERT OR REPLACE INTO {self.table} ({self.key_column}, {', '.join(self.columns)}, last_used) VALUES ({placeholders})",
+            (key, *(getattr(entry, column) for column in self.columns), time.time()),
+        )
+        self.__evict()
+
+    def __evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache is within its limits
+        :return:
+        """
+
+        while self.entries and (len(self.entries) > self.max_entries or self._exceeds_limits()):
+            key, entry = self.entries.popitem(last=False)
+            self._removed(entry)
+            self.__write(f"DELETE FROM {self.table} WHERE {self.key_column} = ?", (key,))
+
+    def _added(self, entry: Any) -> None:
+        """
+        Called when an entry has been added, e.g. to keep track of the entries' total size
+        :param entry: the entry
+        :return:
+        """
+
+    def _removed(self, entry: Any) -> None:
+        """
+        Called when an entry has been replaced or evicted
+        :param entry: the entry
+        :return:
+        """
+
+    def _cleared(self) -> None:
+        """
+        Called when all entries have been removed before loading them from the database
+        :return:
+        """
+
+    def _exceeds_limits(self) -> bool:
+        """
+        :return: True, if entries need to be evicted due to limits of the subclass besides max_entries
+        """
+
+        return False
+
+    def close(self) -> None:
+        """
+        Wait for all pending writes and close the database, e.g. on shutdown
+        :return:
+        """
+
+        self.executor.shutdown(wait=True)
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_stats(self) -> Dict[str, int or float]:
+        """
+        :return: statistics about the cache
+        """
+
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit rate (%)": round(self.hits / (self.hits + self.misses) * 100, 1) if self.hits + self.misses else 0.0,
+        }
@@ -1,5 +1,178 @@
+import asyncio
 import datetime
-from typing import List, Callable
+import heapq
+import itertools
+import logging
+import traceback
+from functools import lru_cache
+from typing import AsyncContextManager, Callable, Dict, List, Set, Tuple
+
+from core.outbound import PRIORITY_BROADCAST, send_priority
+
+try:
+    import zoneinfo
+except ImportError:
+    # python < 3.9
+    zoneinfo = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = datetime.timedelta(seconds=30)
+"""interval of timers without frequency"""
+
+MISFIRE_GRACE = datetime.timedelta(minutes=1)
+"""time a timer may be late before it is considered to have misfired, e.g. because the bot was not running"""
+
+MISFIRE_POLICIES = ("run_once", "skip", "catch_up")
+"""how to handle runs missed while the bot was not running: run once, skip them or run once for each of them"""
+
+NAMED_FREQUENCIES: Dict[str, str] = {"hourly": "0 * * * *", "daily": "0 0 * * *", "weekly": "0 0 * * 1"}
+"""hardcoded frequencies and the cron expressions they correspond to"""
+
+CRON_FIELDS: List[Tuple[int, int]] = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+"""allowed values of the fields of a cron expression: minute, hour, day of month, month, day of week (0 and 7 being sunday)"""
+
+
+class CronSchedule:
+    def __init__(self, expression: str):
+        """
+        A schedule defined by a cron expression of five fields (minute, hour, day of month, month, day of week). Fields may be `*`, numbers,
+        ranges (`1-5`), steps (`*/15`, `0-30/10`) or lists of these (`1,15`).
+        As in cron, a day matches if either the day of month or the day of week matches, if both fields are restricted.
+        :param expression: the cron expression
+        :raises ValueError: if the expression is invalid
+        """
+
+        fields: List[str] = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' needs to consist of five fields")
+
+        self.expression: str = expression
+        self.minutes: List[int] = sorted(self.__parse_field(fields[0], *CRON_FIELDS[0]))
+        self.hours: List[int] = sorted(self.__parse_field(fields[1], *CRON_FIELDS[1]))
+        self.days: Set[int] = self.__parse_field(fields[2], *CRON_FIELDS[2])
+        self.months: Set[int] = self.__parse_field(fields[3], *CRON_FIELDS[3])
+        self.weekdays: Set[int] = {weekday % 7 for weekday in self.__parse_field(fields[4], *CRON_FIELDS[4])}
+        self.days_restricted: bool = fields[2] != "*"
+        self.weekdays_restricted: bool = fields[4] != "*"
+
+    @staticmethod
+    def __parse_field(field: str, minimum: int, maximum: int) -> Set[int]:
+        """
+        Parse a single field of a cron expression
+        :param field: the field
+        :param minimum: smallest allowed value
+        :param maximum: largest allowed value
+        :return: all values matched by the field
+        """
+
+        values: Set[int] = set()
+        part: str
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            try:
+                if value_range == "*":
+                    start, end = minimum, maximum
+                elif "-" in value_range:
+                    start, end = (int(value) for value in value_range.split("-", 1))
+                else:
+                    start = end = int(value_range)
+                    if step:
+                        end = maximum
+                step_size: int = int(step) if step else 1
+            except ValueError:
+                raise ValueError(f"Invalid cron field '{field}'")
+            if start < minimum or end > maximum or start > end or step_size < 1:
+                raise ValueError(f"Invalid cron field '{field}', values need to be within {minimum}-{maximum}")
+            values.update(range(start, end + 1, step_size))
+        return values
+
+    def __matches_day(self, day: datetime.date) -> bool:
+        """
+        :param day: the day to check
+        :return: True, if the schedule fires on the given day
+        """
+
+        if day.month not in self.months:
+            return False
+        day_matches: bool = day.day in self.days
+        # cron counts weekdays from sunday
+        weekday_matches: bool = (day.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_matches or weekday_matches
+        return day_matches and weekday_matches
+
+    def next_after(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        Determine the first time the schedule fires after the given time
+        :param after: the time to start searching from, its timezone (if any) is the one the schedule is evaluated in
+        :return: the next time the schedule fires, in the same timezone
+        :raises ValueError: if the schedule never fires (e.g. on the 31st of february)
+        """
+
+        start: datetime.datetime = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day: datetime.date = start.date()
+
+        # the longest gap between matching days is a leap day on a given weekday: 28 years
+        for _ in range(366 * 28):
+            if self.__matches_day(day):
+                hour: int
+                for hour in self.hours:
+                    if day == start.date() and hour < start.hour:
+                        continue
+                    minute: int
+                    for minute in self.minutes:
+                        if day == start.date() and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=after.tzinfo)
+            day += datetime.timedelta(days=1)
+
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+
+@lru_cache(maxsize=256)
+def parse_schedule(frequency: str) -> CronSchedule:
+    """
+    Parse a timer's frequency given as string, parsed schedules are cached so timers (which are stored along with the plugin's state) only
+    need to keep the string
+    :param frequency: one of NAMED_FREQUENCIES, "at HH:MM" or a cron expression
+    :return: the schedule
+    :raises ValueError: if the frequency is invalid or never fires
+    """
+
+    schedule: CronSchedule
+    if frequency in NAMED_FREQUENCIES:
+        schedule = CronSchedule(NAMED_FREQUENCIES[frequency])
+    elif frequency.startswith("at "):
+        try:
+            # not using time.fromisoformat, which requires two-digit hours
+            hour, minute = frequency[3:].strip().split(":")
+            time: datetime.time = datetime.time(int(hour), int(minute))
+        except ValueError:
+            raise ValueError(f"Invalid time in frequency '{frequency}', needs to be given as HH:MM")
+        schedule = CronSchedule(f"{time.minute} {time.hour} * * *")
+    else:
+        schedule = CronSchedule(frequency)
+
+    # reject schedules that never fire (e.g. "0 0 31 2 *") when the timer is added, not when it is scheduled
+    schedule.next_after(datetime.datetime(2000, 1, 1))
+    return schedule
+
+
+@lru_cache(maxsize=64)
+def get_timezone(timezone: str) -> datetime.tzinfo:
+    """
+    :param timezone: name of the timezone, e.g. "Europe/Berlin"
+    :return: the timezone
+    :raises ValueError: if the timezone is unknown
+    """
+
+    if zoneinfo is None:
+        raise ValueError("Timezones require python 3.9 or later")
+    try:
+        return zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {timezone}")
 
 
 class Timer:
@@ -10,28 +183,105 @@ class Timer:
         frequency: str or datetime.timedelta or None = None,
         last_execution: datetime.datetime or None = None,
         timer_type: str = "static",
+        timezone: str or None = None,
+        misfire: str = "run_once",
     ):
 
         """
         A class for storing timers that call a specific method in a specified interval
         :param name: the name of a timer, usually derived from the plugin that added it and the name of the method that is being called
         :param method: the method called when the timer is triggered
-        :param frequency: the frequency in which the timer is allowed to trigger, None will allow the timer to trigger every time it is being called
+        :param frequency: the frequency in which the timer is allowed to trigger, either
+                          - a timedelta between triggers,
+                          - "weekly", "daily" or "hourly" to trigger at the start of each week, day or hour,
+                          - "at HH:MM" to trigger once a day at the given time,
+                          - a cron expression, e.g. "30 8 * * 1-5" or
+                          - None to trigger every 30 seconds
         :param last_execution: timestamp of the timer's last execution
         :param timer_type: type of the timer, either static (default) or dynamic
+        :param timezone: name of the timezone the frequency is evaluated in, e.g. "Europe/Berlin", defaults to the system's timezone
+        :param misfire: how to handle runs missed (by more than MISFIRE_GRACE) while the bot was not running, one of MISFIRE_POLICIES:
+                        - "run_once": run once as soon as possible (default)
+                        - "skip": skip the missed runs and wait for the next regular run
+                        - "catch_up": run once for each missed run
         """
 
         self.name: str = name
         self.method: Callable = method
         self.last_execution: datetime.datetime or None = last_execution
+        self.last_due: datetime.datetime or None = None
+        """the time the last execution was due at"""
         self.timer_type: str = timer_type
-        self.valid_frequencies: List[str] = ["weekly", "daily", "hourly"]
+        self.valid_frequencies: List[str] = list(NAMED_FREQUENCIES.keys())
         """List of valid hardcoded frequencies needed for special cases"""
 
-        if frequency is None or isinstance(frequency, datetime.timedelta) or (isinstance(frequency, str) and frequency in self.valid_frequencies):
-            self.frequency: str or datetime.timedelta or None = frequency
-        else:
-            raise Exception
+        if misfire not in MISFIRE_POLICIES:
+            raise ValueError(f"Invalid misfire policy {misfire}, must be one of {', '.join(MISFIRE_POLICIES)}")
+        self.misfire: str = misfire
+
+        if isinstance(frequency, str):
+            # validate frequency and timezone once, they are parsed again (and cached) when needed
+            parse_schedule(frequency)
+        elif frequency is not None and not isinstance(frequency, datetime.timedelta):
+            raise ValueError(f"Invalid frequency {frequency} for timer {name}")
+        if timezone is not None:
+            get_timezone(timezone)
+        self.frequency: str or datetime.timedelta or None = frequency
+        self.timezone: str or None = timezone
+
+    def __next_after(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        Determine the first time the timer is due after the given time
+        :param after: local time to start from
+        :return: local time the timer is due at
+        """
+
+        if self.frequency is None:
+            return after + DEFAULT_INTERVAL
+        elif isinstance(self.frequency, datetime.timedelta):
+            return after + self.frequency
+
+        schedule: CronSchedule = parse_schedule(self.frequency)
+        if self.timezone is None:
+            return schedule.next_after(after)
+        # evaluate the schedule in the timer's timezone, but keep local times like everywhere else
+        return schedule.next_after(after.astimezone(get_timezone(self.timezone))).astimezone().replace(tzinfo=None)
+
+    def __first_from(self, due: datetime.datetime, earliest: datetime.datetime) -> datetime.datetime:
+        """
+        Determine the first time the timer is due at or after a given time, without stepping through every run in between
+        :param due: local time of a run of the timer, intervals are continued from it
+        :param earliest: local time to start from
+        :return: local time the timer is due at
+        """
+
+        if isinstance(self.frequency, str):
+            # the schedule's runs do not depend on previous ones, next_after() finds the first run after the given time directly
+            return self.__next_after(earliest - datetime.timedelta(microseconds=1))
+
+        interval: datetime.timedelta = self.frequency or DEFAULT_INTERVAL
+        # the number of intervals needed to reach earliest, rounded up
+        return due + interval * -((due - earliest) // interval)
+
+    def next_due(self) -> datetime.datetime:
+        """
+        Determine when the timer is due next, applying the timer's misfire policy to runs missed since its last execution
+        :return: the time the timer is due at, may be in the past. A timer that has never been triggered is due immediately.
+        """
+
+        if self.last_execution is None:
+            return datetime.datetime.now()
+
+        if self.misfire == "catch_up" and self.last_due is not None:
+            # continue from the last missed run
+            return self.__next_after(self.last_due)
+
+        due: datetime.datetime = self.__next_after(self.last_execution)
+        if self.misfire == "skip":
+            earliest: datetime.datetime = datetime.datetime.now() - MISFIRE_GRACE
+            if due < earliest:
+                due = self.__first_from(due, earliest)
+        return due
 
     async def should_trigger(self) -> bool:
         """
@@ -41,43 +291,19 @@ class Timer:
                         False if the conditions are not met.
         """
 
-        # no frequency, always trigger
-        if self.frequency is None:
-            return True
+        return datetime.datetime.now() >= self.next_due()
 
-        else:
-            # timer has never been executed, always trigger
-            if self.last_execution is None:
-                return True
+    async def run(self, client, due: datetime.datetime or None = None) -> None:
+        """
+        Run the timer's stored method, regardless of whether it should trigger
+        :param client: (nio.AsyncClient) the bot's matrix client
+        :param due: the time the run has been due at, defaults to now
+        :return:
+        """
 
-            else:
-                # check hardcoded intervals
-                if isinstance(self.frequency, str):
-                    last_execution_date: datetime.date = self.last_execution.date()
-                    last_execution_week: int = last_execution_date.isocalendar()[1]
-                    last_execution_hour: int = self.last_execution.time().hour
-                    current_week: int = datetime.datetime.today().isocalendar()[1]
-                    current_hour: int = datetime.datetime.now().hour
-
-                    if self.frequency == "weekly":
-                        # triggers if week_numbers differ
-                        if last_execution_week != current_week:
-                            return True
-
-                    elif self.frequency == "daily":
-                        # triggers if day of month differs
-                        if last_execution_date.day != datetime.datetime.today().day:
-                            return True
-
-                    elif self.frequency == "hourly":
-                        # triggers if hour or day differ
-                        if last_execution_hour != current_hour or last_execution_date.day != datetime.datetime.today().day:
-                            return True
-
-                # check timedelta intervals
-                elif isinstance(self.frequency, datetime.timedelta):
-                    if datetime.datetime.now() - self.last_execution > self.frequency:
-                        return True
+        await self.method(client)
+        self.last_execution = datetime.datetime.now()
+        self.last_due = due or self.last_execution
 
     async def trigger(self, client) -> bool:
         """
@@ -88,9 +314,218 @@ class Timer:
         """
 
         if await self.should_trigger():
-            await self.method(client)
-            self.last_execution = datetime.datetime.now()
+            await self.run(client)
             return True
 
         else:
             return False
+
+
+class TimerScheduler:
+    def __init__(
+        self,
+        on_triggered: Callable[[Timer], None] or None = None,
+        max_sleep: float = 60.0,
+        get_lock: Callable[[Timer], AsyncContextManager] or None = None,
+    ):
+        """
+        Runs timers when they are due.
+        Timers are kept in a heap by the time they are due next, the scheduler sleeps until the earliest timer is due and runs it in a task of
+        its own, so slow timers neither delay other timers nor the sync loop. A timer is scheduled again once it has finished running.
+        :param on_triggered: called after a timer has been run, e.g. to persist its last execution
+        :param max_sleep: maximum number of seconds to sleep before checking the heap again, so changes of the system clock are picked up
+        :param get_lock: returns a lock (or another async context manager) to hold while running a timer, e.g. so a plugin's timers do not run while
+                         its commands are running
+        """
+
+        self.on_triggered: Callable[[Timer], None] or None = on_triggered
+        self.get_lock: Callable[[Timer], AsyncContextManager] or None = get_lock
+        self.max_sleep: float = max_sleep
+        self.client = None
+        self.heap: List[list] = []
+        """entries of [due, sequence, timer, valid], removed entries are marked invalid and discarded once they reach the top"""
+        self.entries: Dict[Timer, list or None] = {}
+        """the heap entry of each scheduled timer, None while the timer is running"""
+        self.sequence = itertools.count()
+        self.wakeup: asyncio.Event or None = None
+        self.task: asyncio.Task or None = None
+        self.running_tasks: Set[asyncio.Task] = set()
+
+        # statistics
+        self.triggered: int = 0
+        self.failed: int = 0
+        self.max_lateness: float = 0.0
+
+    def is_running(self) -> bool:
+        """
+        :return:    True, if the scheduler has been started
+                    False, otherwise
+        """
+
+        return self.task is not None
+
+    def start(self, client, timers: List[Timer]) -> None:
+        """
+        Start running timers, needs to be called from within the running event loop
+        :param client: (nio.AsyncClient) the bot's matrix client, passed to the timers
+        :param timers: all timers to schedule
+        :return:
+        """
+
+        if self.task is not None:
+            return
+
+        self.client = client
+        self.wakeup = asyncio.Event()
+        timer: Timer
+        for timer in timers:
+            self.__push(timer)
+        self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    def add(self, timer: Timer) -> None:
+        """
+        Schedule a timer added after the scheduler has been started
+        :param timer: the timer to add
+        :return:
+        """
+
+        if self.task is None or timer in self.entries:
+            return
+
+        self.__push(timer)
+        # the new timer might be due before the one the scheduler is currently waiting for
+        self.wakeup.set()
+
+    def remove(self, timer: Timer) -> None:
+        """
+        Stop scheduling a timer. A currently running timer finishes its run.
+        :param timer: the timer to remove
+        :return:
+        """
+
+        entry: list or None = self.entries.pop(timer, None)
+        if entry is not None:
+            entry[3] = False
+
+    def __push(self, timer: Timer) -> None:
+        """
+        Add a timer to the heap by the time it is due next
+        :param timer: the timer to add
+        :return:
+        """
+
+        due: datetime.datetime
+        try:
+            due = timer.next_due()
+        except ValueError as err:
+            # e.g. a stored timer whose schedule never fires, keep scheduling all other timers
+            logger.error(f"Not scheduling timer {timer.name}: {err}")
+            self.entries.pop(timer, None)
+            return
+
+        entry: list = [due, next(self.sequence), timer, True]
+        self.entries[timer] = entry
+        heapq.heappush(self.heap, entry)
+
+    async def __run(self) -> None:
+        """
+        Sleep until the earliest timer is due, run it and repeat
+        :return:
+        """
+
+        while True:
+            # discard removed timers
+            while self.heap and not self.heap[0][3]:
+                heapq.heappop(self.heap)
+
+            delay: float = self.max_sleep
+            if self.heap:
+                delay = min((self.heap[0][0] - datetime.datetime.now()).total_seconds(), self.max_sleep)
+
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            due, _, timer, _ = heapq.heappop(self.heap)
+            self.entries[timer] = None
+            self.max_lateness = max(self.max_lateness, (datetime.datetime.now() - due).total_seconds())
+            task: asyncio.Task = asyncio.get_running_loop().create_task(self.__trigger(timer, due))
+            self.running_tasks.add(task)
+            task.add_done_callback(self.running_tasks.discard)
+
+    async def __trigger(self, timer: Timer, due: datetime.datetime) -> None:
+        """
+        Run a timer and schedule it again, unless it has been removed meanwhile
+        :param timer: the timer to run
+        :param due: the time the timer has been due at
+        :return:
+        """
+
+        # messages sent by timers are broadcasts, replies to users take precedence
+        send_priority.set(PRIORITY_BROADCAST)
+        try:
+            logger.debug(f"Timer {timer.name} triggered")
+            if self.get_lock is None:
+                await timer.run(self.client, due=due)
+            else:
+                async with self.get_lock(timer):
+                    await timer.run(self.client, due=due)
+            self.triggered += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+            logger.critical(f"Plugin failed to catch exception caused by timer {timer.name}:")
+            traceback.print_exc()
+            # do not retry a failing timer right away, but with its next regular run
+            timer.last_execution = datetime.datetime.now()
+            timer.last_due = due
+
+        if self.on_triggered is not None:
+            try:
+                self.on_triggered(timer)
+            except Exception:
+                logger.critical(f"Failed to handle triggered timer {timer.name}:")
+                traceback.print_exc()
+
+        if timer in self.entries:
+            self.__push(timer)
+            self.wakeup.set()
+
+    async def stop(self) -> None:
+        """
+        Stop the scheduler and cancel all running timers, e.g. on shutdown
+        :return:
+        """
+
+        tasks: List[asyncio.Task] = list(self.running_tasks)
+        if self.task is not None:
+            tasks.append(self.task)
+            self.task = None
+
+        task: asyncio.Task
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, int or float or str]:
+        """
+        :return: statistics about the scheduler
+        """
+
+        stats: Dict[str, int or float or str] = {
+            "timers": len(self.entries),
+            "running": len(self.running_tasks),
+            "triggered": self.triggered,
+            "failed": self.failed,
+            "max lateness (ms)": round(self.max_lateness * 1000, 1),
+        }
+        upcoming: List[list] = [entry for entry in self.heap if entry[3]]
+        if upcoming:
+            due, _, timer, _ = min(upcoming)
+            stats["next"] = f"{timer.name} at {due.strftime('%Y-%m-%d %H:%M:%S')}"
+        return stats
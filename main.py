@@ -3,17 +3,19 @@
 import logging
 import asyncio
 import os
+import signal
 import sys
 import traceback
-from time import time
 from asyncio import sleep
 from nio import (
     AsyncClient,
     AsyncClientConfig,
     RoomMessageText,
     InviteEvent,
+    RoomMemberEvent,
     LocalProtocolError,
     LoginError,
+    SyncResponse,
     UnknownEvent,
 )
 from core.callbacks import Callbacks
@@ -33,16 +35,15 @@ except ModuleNotFoundError:
 
 client: AsyncClient
 plugin_loader: PluginLoader
-timestamp: float = time()
 
 
-async def run_plugins(response):
+async def start_timers(response: SyncResponse):
 
     global plugin_loader
     global client
-    global timestamp
 
-    timestamp = await plugin_loader.run_timers(client, timestamp)
+    # timers are run by a scheduler of their own, start it once the initial sync has been received
+    plugin_loader.start_timers(client)
 
 
 async def main():
@@ -103,8 +104,9 @@ async def main():
     callbacks = Callbacks(client, store, config, plugin_loader)
     client.add_event_callback(callbacks.message, (RoomMessageText,))
     client.add_event_callback(callbacks.invite, (InviteEvent,))
+    client.add_event_callback(callbacks.member, (RoomMemberEvent,))
     client.add_event_callback(callbacks.event_unknown, (UnknownEvent,))
-    client.add_response_callback(run_plugins)
+    client.add_response_callback(start_timers, SyncResponse)
 
     # Keep trying to reconnect on failure (with some time in-between)
     error_retries: int = 0
@@ -166,4 +168,27 @@ async def main():
             await client.close()
 
 
-asyncio.new_event_loop().run_until_complete(main())
+async def shutdown():
+
+    global plugin_loader
+
+    if "plugin_loader" in globals():
+        logger.info("Writing pending plugin data...")
+        await plugin_loader.shutdown()
+
+
+loop = asyncio.new_event_loop()
+main_task = loop.create_task(main())
+try:
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+except NotImplementedError:
+    # signal handlers are not available on windows
+    pass
+
+try:
+    loop.run_until_complete(main_task)
+except (KeyboardInterrupt, asyncio.CancelledError):
+    logger.info("Shutting down...")
+finally:
+    main_task.cancel()
+    loop.run_until_complete(shutdown())
@@ -10,6 +10,9 @@ plugin = Plugin("coingecko", "CryptoCurrency", "Get data from the Coingecko API"
 
 
 def setup():
+    # the list of available coins is large, store it compressed
+    plugin.set_data_codec("json", compression_threshold=65536)
+
     plugin.add_command(
         "cgprice",
         cgprice_command,
@@ -9,10 +9,9 @@ import datetime
 from shlex import split
 import logging
 from dateparser import parse
-from asyncio import sleep
 
 logger = logging.getLogger(__name__)
-plugin = Plugin("dates", "General", "Stores dates and birthdays, posts reminders")
+plugin = Plugin("dates", "General", "Stores dates and birthdays, posts reminders", serialized=True)
 
 celebratory_emoji: List[str] = [
     "🎉",
@@ -38,6 +37,9 @@ celebratory_emoji: List[str] = [
 
 
 def setup():
+    plugin.set_data_codec("json")
+    plugin.register_data_class(StoreDate)
+
     plugin.add_command("date", date, "Display the details of the next upcoming date or a specific date")
     plugin.add_command("date_add", date_add, "Add a date or birthday")
     plugin.add_command("date_del", date_del, "Delete a date or birthday", power_level=50)
@@ -446,11 +448,7 @@ async def post_reminders(client):
 
                 # post 3 to 6 random emoji
                 emoji_list: List[str] = random.sample(celebratory_emoji, random.randint(3, 6))
-                emoji: str
-                for emoji in emoji_list:
-                    await plugin.send_reaction(client, store_date.mx_room, message_id, emoji)
-                # sleep for 15 seconds to avoid being ratelimited if there's multiple birthdays
-                await sleep(15)
+                await plugin.send_reactions(client, store_date.mx_room, message_id, emoji_list)
 
             elif store_date.date_type == "date":
                 if datetime.datetime.now() < store_date.date:
@@ -1,9 +1,10 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
 import random
 import ssl
 import socket
-from typing import Dict, List, Tuple
+from typing import Awaitable, Dict, List, Tuple
 import pytz
 import requests
 from nio import AsyncClient
@@ -26,6 +27,9 @@ def setup():
     :return: -
     """
 
+    plugin.set_data_codec("json")
+    plugin.register_data_class(Server)
+
     plugin.add_config("room_list", default_value=None, is_required=False)
     plugin.add_config("warn_cert_expiry", default_value=7, is_required=True)
     plugin.add_config("server_max_age", default_value=60, is_required=True)
@@ -305,6 +309,8 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         if not room_list:
             room_list = [x for x in client.rooms]
 
+        # announcements are sent concurrently, so announcements to the same room are merged into a single message
+        announcements: List[Awaitable] = []
         for room_id in room_list:
             for server in new_dead_servers:
                 if server not in plugin.read_config("server_ignore_list"):
@@ -312,7 +318,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                         user_ids: List[str] = (await plugin.get_users_on_servers(client, [server], [room_id]))[server]
                         message: str = f"Federation error: {server} offline.  \n"
                         message += f"Isolated users: {', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])}."
-                        await plugin.send_notice(client, room_id, message)
+                        announcements.append(plugin.send_notice(client, room_id, message, coalesce=True))
                     except KeyError:
                         pass
 
@@ -322,7 +328,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                         user_ids: List[str] = (await plugin.get_users_on_servers(client, [server], [room_id]))[server]
                         message: str = f"Federation recovery: {server} back online.  \n"
                         message += f"Welcome back, {', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])}."
-                        await plugin.send_notice(client, room_id, message)
+                        announcements.append(plugin.send_notice(client, room_id, message, coalesce=True))
                     except KeyError:
                         pass
 
@@ -338,9 +344,10 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                             f"{', '.join([await plugin.link_user_by_id(client, room_id, user_id) for user_id in user_ids])} will be isolated until "
                             f"the server's certificate has been renewed."
                         )
-                        await plugin.send_message(client, room_id, message)
+                        announcements.append(plugin.send_message(client, room_id, message, coalesce=True))
                     except KeyError:
                         pass
+        await asyncio.gather(*announcements)
 
         if data_changed:
             await plugin.store_data("server_list", server_list_new)
@@ -1,4 +1,7 @@
+from typing import Any, Dict, List
+
 from nio import AsyncClient, MatrixRoom
+from core.backup import Backup
 from core.plugin import Plugin
 
 plugin = Plugin("manage_bot", "General", "Provide functions to manage the bot from an admin-room")
@@ -28,6 +31,34 @@ def setup():
         plugin.read_config("manage_bot_rooms"),
         plugin.read_config("manage_bot_power_level"),
     )
+    plugin.add_command(
+        "bot_backup",
+        bot_backup,
+        "Create a backup of a plugin's data",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
+    plugin.add_command(
+        "bot_backups",
+        bot_backups,
+        "List the backups of a plugin's data",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
+    plugin.add_command(
+        "bot_restore",
+        bot_restore,
+        "Restore a plugin's data from a backup",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
+    plugin.add_command(
+        "bot_stats",
+        bot_stats,
+        "Display statistics about the bot's internals",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
 
 
 async def bot_rooms_list(command):
@@ -93,4 +124,100 @@ async def bot_leave_room(command):
         await plugin.respond_notice(command, f"Usage: `bot_leave_room <room_id>`")
 
 
+async def bot_backup(command):
+    """
+    Create a backup of a plugin's data
+    :param command:
+    :return:
+    """
+
+    if len(command.args) == 1:
+        backup_plugin: Plugin or None = command.plugin_loader.get_plugin_by_name(command.args[0])
+        if backup_plugin is None:
+            await plugin.respond_notice(command, f"Error: unknown plugin {command.args[0]}")
+        elif await backup_plugin.backup_data():
+            await plugin.respond_notice(command, f"Created backup of {backup_plugin.name}'s data")
+        else:
+            await plugin.respond_notice(command, f"Error: could not create a backup of {backup_plugin.name}'s data")
+
+    else:
+        await plugin.respond_notice(command, f"Usage: `bot_backup <plugin>`")
+
+
+async def bot_backups(command):
+    """
+    List the backups of a plugin's data
+    :param command:
+    :return:
+    """
+
+    if len(command.args) == 1:
+        backup_plugin: Plugin or None = command.plugin_loader.get_plugin_by_name(command.args[0])
+        if backup_plugin is None:
+            await plugin.respond_notice(command, f"Error: unknown plugin {command.args[0]}")
+            return
+
+        backups: List[Backup] = await backup_plugin.list_backups()
+        if not backups:
+            await plugin.respond_notice(command, f"No backups of {backup_plugin.name}'s data found")
+            return
+
+        message: str = f"**Backups of {backup_plugin.name}'s data**  \n"
+        backup: Backup
+        for backup in reversed(backups):
+            if backup.is_full():
+                message += f"`{backup.backup_id}`: full, {backup.size} bytes  \n"
+            else:
+                message += f"`{backup.backup_id}`: incremental (based on `{backup.base_id}`), {backup.size} bytes  \n"
+        await plugin.respond_notice(command, message)
+
+    else:
+        await plugin.respond_notice(command, f"Usage: `bot_backups <plugin>`")
+
+
+async def bot_restore(command):
+    """
+    Restore a plugin's data from a backup
+    :param command:
+    :return:
+    """
+
+    if len(command.args) == 2:
+        backup_plugin: Plugin or None = command.plugin_loader.get_plugin_by_name(command.args[0])
+        if backup_plugin is None:
+            await plugin.respond_notice(command, f"Error: unknown plugin {command.args[0]}")
+            return
+
+        restored: bool
+        # keep a serialized plugin's commands, hooks and timers from modifying its data while it is being replaced
+        async with command.plugin_loader.hold_plugin_lock(backup_plugin.name if backup_plugin is not plugin else None):
+            restored = await backup_plugin.restore_data(command.args[1])
+
+        if restored:
+            await plugin.respond_notice(command, f"Restored {backup_plugin.name}'s data from backup {command.args[1]}")
+        else:
+            await plugin.respond_notice(command, f"Error: could not restore {backup_plugin.name}'s data from backup {command.args[1]}")
+
+    else:
+        await plugin.respond_notice(command, f"Usage: `bot_restore <plugin> <backup_id>`")
+
+
+async def bot_stats(command):
+    """
+    Display statistics about the bot's internals, e.g. pending writes of plugin data
+    :param command:
+    :return:
+    """
+
+    message: str = ""
+    component: str
+    stats: Dict[str, Any]
+    for component, stats in command.plugin_loader.get_stats().items():
+        message += f"**{component}**  \n"
+        for name, value in stats.items():
+            message += f"{name}: {value}  \n"
+
+    await plugin.respond_notice(command, message)
+
+
 setup()
@@ -19,6 +19,7 @@ plugin = Plugin(
     "quote",
     "General",
     "Store (more or less) funny quotes and access them randomly or by search term",
+    serialized=True,
 )
 
 
@@ -28,6 +29,11 @@ def setup():
     :return:
     """
 
+    plugin.set_data_codec("json")
+    plugin.register_data_class(Quote)
+    plugin.register_data_class(QuoteLine)
+    plugin.register_data_class(TrackedQuote)
+
     plugin.add_config("manage_quote_rooms", default_value=[], is_required=False)
     plugin.add_command(
         "quote",
@@ -494,8 +500,8 @@ async def post_quote(command, quote_object: Quote, match_index: int = -1, total_
     else:
         event_id: str = await plugin.respond_notice(command, f"{await quote_object.display_text(command)}")
 
-    for reaction in quote_object.reactions.keys():
-        await plugin.send_reaction(command.client, command.room.room_id, event_id, reaction)
+    if quote_object.reactions:
+        await plugin.send_reactions(command.client, command.room.room_id, event_id, list(quote_object.reactions.keys()))
 
     """store the event id of the message to allow for tracking reactions to the last 100 posted quotes"""
     tracked_quotes: List[TrackedQuote]
@@ -108,10 +108,11 @@ def setup():
     """Markdown sample"""
     plugin.add_command("sample_markdown", sample_markdown, "Post a message containing a markdown code block.")
 
-    """The following part demonstrates registering timers by fixed interval and timedelta"""
+    """The following part demonstrates registering timers by fixed interval, timedelta and cron expression"""
     if timers_enabled:
         plugin.add_timer(timer_daily, frequency="daily")
         plugin.add_timer(timer_every_36_minutes, frequency=datetime.timedelta(minutes=36))
+        plugin.add_timer(timer_weekday_mornings, frequency="30 8 * * 1-5", timezone="Europe/Berlin", misfire="skip")
 
 
 class Sample:
@@ -240,8 +241,7 @@ async def sample_react(command):
     """
 
     if len(command.args) == 0:
-        await plugin.send_reaction(command.client, command.room.room_id, command.event.event_id, "Hello")
-        await plugin.send_reaction(command.client, command.room.room_id, command.event.event_id, "👋")
+        await plugin.send_reactions(command.client, command.room.room_id, command.event.event_id, ["Hello", "👋"])
 
 
 async def sample_replace(command):
@@ -293,7 +293,7 @@ async def timer_daily(client):
     :return:
     """
 
-    print(f"This method is being executed around midnight every day")
+    print(f"This method is being executed at midnight every day")
 
 
 async def timer_every_36_minutes(client):
@@ -306,6 +306,16 @@ async def timer_every_36_minutes(client):
     print(f"This method is being executed every 36 minutes")
 
 
+async def timer_weekday_mornings(client):
+    """
+    Prints a dummy message at 08:30 (Europe/Berlin) on weekdays, runs missed while the bot was offline are skipped
+    :param client:
+    :return:
+    """
+
+    print(f"This method is being executed at 08:30 on weekdays")
+
+
 async def add_command(command):
     """
     Dynamically activate a command and a hook for reactions
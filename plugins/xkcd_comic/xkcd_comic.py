@@ -1,8 +1,8 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
 from typing import List
 
-from PIL import Image
 from nio import AsyncClient, UnknownEvent
 
 from core.bot_commands import Command
@@ -70,9 +70,10 @@ async def post_xkcd(client: AsyncClient, room_id: str, comic: xkcd.Comic):
     """
 
     if plugin.read_config("url_only") == False:
-        image: Image.Image = await plugin.fetch_image_from_url(comic.imageLink)
-        if image is not None:
-            await plugin.send_image(client, room_id, image)
+        # post the image as it is, without decoding it
+        image_data: bytes or None = await plugin.fetch_image_data_from_url(comic.imageLink)
+        if image_data is not None:
+            await plugin.send_image(client, room_id, image_data)
             await plugin.send_message(client, room_id, await format_message(comic))
         else:
             # error retrieving the actual image, fall back to posting the url
@@ -147,13 +148,17 @@ async def xkcd_check(client):
             if plugin.read_config("notification_only") == True:
                 # notification_only is set, only post a notification about a new comic
                 plugin.del_hook("m.reaction", xkcd_react)
-                message_ids: List[str] = []
-                for room_id in room_list:
+
+                async def notify(room_id: str) -> str or None:
                     message_id: str or None = await plugin.send_notice(
                         client, room_id, f"New xkcd-Comic: [{comic.title} ({comic.number})]({comic.link}). `!xkcd` or 👀 to display."
                     )
-                    await plugin.send_reaction(client, room_id, message_id, "👀")
-                    message_ids.append(message_id)
+                    if message_id is not None:
+                        await plugin.send_reactions(client, room_id, message_id, ["👀"])
+                    return message_id
+
+                # notify all rooms concurrently instead of one after another
+                message_ids: List[str] = [message_id for message_id in await asyncio.gather(*[notify(room_id) for room_id in room_list]) if message_id]
                 if message_ids:
                     plugin.add_hook("m.reaction", xkcd_react, room_list, message_ids, hook_type="dynamic")
 
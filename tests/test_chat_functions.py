@@ -0,0 +1,128 @@
+import time
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from nio import RoomGetEventError, RoomGetEventResponse
+
+from core import chat_functions
+from core.chat_functions import build_message_content, send_replace, strip_tags
+from core.sent_events import SentEventCache
+
+
+class StripTagsTest(unittest.TestCase):
+    """
+    The plain text body of messages has to match what the HTMLParser used before produced, without its cost
+    """
+
+    def test_markup_is_removed(self):
+        self.assertEqual("Title 5 ended", strip_tags("<table><tr><td><b>Title</b></td> <td>5</td> <td>ended</td></tr></table>"))
+        self.assertEqual("link", strip_tags("<a href=\"https://example.org/?a=1&amp;b=2\" title='x > y'>link</a>"))
+        self.assertEqual("ab", strip_tags("a<br/>b"))
+        self.assertEqual("ab", strip_tags("a<br\n/>b"))
+        self.assertEqual("text", strip_tags("<!DOCTYPE html><!-- comment -->text"))
+        self.assertEqual("a & b", strip_tags("a &amp; b"))
+
+    def test_text_without_markup_is_unchanged(self):
+        text: str = "**bold** and `code`"
+        self.assertIs(text, strip_tags(text))
+        self.assertEqual("1 < 2 and 3 > 2", strip_tags("1 < 2 and 3 > 2"))
+        self.assertEqual("a <b", strip_tags("a <b"))
+        self.assertEqual("<3", strip_tags("<3"))
+
+    def test_unclosed_comment(self):
+        self.assertEqual("text ", strip_tags("text <!-- unclosed"))
+
+    def test_pathological_input(self):
+        # every unclosed tag used to rescan the rest of the text, taking minutes on these
+        text: str
+        for text in ("<a" * 50000, "<a x" * 50000, '<a "' * 50000, "<" + "a" * 100000, "<!--" * 50000, "<!" * 50000):
+            with self.subTest(text=text[:8]):
+                start: float = time.perf_counter()
+                strip_tags(text)
+                self.assertLess(time.perf_counter() - start, 1)
+
+
+class FakeClient:
+    def __init__(self, events: Dict[str, Dict[str, Any]]):
+        """
+        Answers requests for the given events, by event_id
+        """
+
+        self.events: Dict[str, Dict[str, Any]] = events
+        self.fetched: List[str] = []
+
+    async def room_get_event(self, room_id: str, event_id: str):
+        self.fetched.append(event_id)
+        if event_id not in self.events:
+            return RoomGetEventError("not found", "M_NOT_FOUND")
+        return RoomGetEventResponse.from_dict(self.events[event_id])
+
+
+def create_event(event_id: str, content: Dict[str, Any], unsigned: Dict[str, Any] or None = None) -> Dict[str, Any]:
+    event: Dict[str, Any] = {"type": "m.room.message", "event_id": event_id, "sender": "@user:example.org", "origin_server_ts": 1, "room_id": "!a"}
+    event["content"] = content
+    if unsigned is not None:
+        event["unsigned"] = unsigned
+    return event
+
+
+def create_edit(event_id: str, original_event_id: str, message: str) -> Dict[str, Any]:
+    content: Dict[str, Any] = build_message_content(f"* {message}")
+    content["m.new_content"] = build_message_content(message)
+    content["m.relates_to"] = {"rel_type": "m.replace", "event_id": original_event_id}
+    return create_event(event_id, content)
+
+
+class SendReplaceTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Messages not sent by the bot have to be compared against their latest edit, never against their original content
+    """
+
+    async def asyncSetUp(self):
+        self.cache: SentEventCache = SentEventCache()
+        self.room_send: mock.AsyncMock = mock.AsyncMock(return_value="$sent")
+        patches: List[Any] = [mock.patch.object(chat_functions, "sent_event_cache", self.cache), mock.patch.object(chat_functions, "room_send", self.room_send)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def create_client(self, unsigned: Dict[str, Any] or None, *events: Dict[str, Any]) -> FakeClient:
+        original: Dict[str, Any] = create_event("$original", build_message_content("original"), unsigned)
+        return FakeClient({event["event_id"]: event for event in (original, *events)})
+
+    async def test_bundled_edit(self):
+        edit: Dict[str, Any] = create_edit("$edit", "$original", "edited")
+        client: FakeClient = self.create_client({"m.relations": {"m.replace": edit}})
+
+        self.assertIsNone(await send_replace(client, "!a", "$original", "edited"))
+        self.room_send.assert_not_called()
+        self.assertEqual("edited", self.cache.get("$original").body)
+
+        # the latest content is known now, editing the message again does not fetch it again
+        self.assertEqual("$sent", await send_replace(client, "!a", "$original", "original"))
+        self.assertEqual(["$original"], client.fetched)
+
+    async def test_edit_reported_by_event_id(self):
+        client: FakeClient = self.create_client({"m.relations": {"m.replace": {"event_id": "$edit"}}}, create_edit("$edit", "$original", "edited"))
+        self.assertIsNone(await send_replace(client, "!a", "$original", "edited"))
+        self.assertEqual(["$original", "$edit"], client.fetched)
+        self.assertEqual("edited", self.cache.get("$original").body)
+
+    async def test_unknown_edit(self):
+        # the edit could not be fetched, so the message is edited regardless
+        client: FakeClient = self.create_client({"m.relations": {"m.replace": {"event_id": "$missing"}}})
+        self.assertEqual("$sent", await send_replace(client, "!a", "$original", "original"))
+        self.assertIsNone(self.cache.get("$original"))
+
+    async def test_no_edit_reported(self):
+        client: FakeClient = self.create_client(None)
+        self.assertIsNone(await send_replace(client, "!a", "$original", "original"))
+        self.assertEqual("$sent", await send_replace(client, "!a", "$original", "changed"))
+        # the original content might be outdated, it is not remembered
+        self.assertIsNone(self.cache.get("$original"))
+        self.assertEqual(["$original", "$original"], client.fetched)
+
+
+if __name__ == "__main__":
+    unittest.main()
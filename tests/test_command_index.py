@@ -0,0 +1,103 @@
+import unittest
+from typing import List
+from unittest import mock
+
+from core import command_index
+from core.command_index import CommandIndex
+from core.plugin import PluginCommand
+
+
+def create_command(command: str, room_id: List[str] or None = None, plugin_name: str = "test") -> PluginCommand:
+    return PluginCommand(command, lambda: None, f"help for {command}", 0, room_id, plugin_name=plugin_name)
+
+
+class CommandIndexTest(unittest.TestCase):
+    """
+    Commands have to be found exactly as walking all plugins and comparing every command with fuzzywuzzy used to find them
+    """
+
+    def create_index(self, fuzzy_threshold: int = 60) -> CommandIndex:
+        index: CommandIndex = CommandIndex(fuzzy_threshold=fuzzy_threshold)
+        command: str
+        for command in ("help", "quote", "abcd", "abc", "weather"):
+            index.add(create_command(command))
+        return index
+
+    def assert_resolves(self, fuzzy_threshold: int, command: str, candidate: str, expected: str or None) -> None:
+        index: CommandIndex = CommandIndex(fuzzy_threshold=fuzzy_threshold)
+        index.add(create_command(candidate))
+        self.assertEqual(expected, index.resolve(command))
+
+    def test_exact_match(self):
+        index: CommandIndex = self.create_index(fuzzy_threshold=100)
+        self.assertEqual("abc", index.resolve("abc"))
+        self.assertEqual("help", index.get("help").command)
+        self.assertIsNone(index.get("hepl"))
+        self.assertEqual(0, index.cache_misses)
+
+    def test_fuzzy_match(self):
+        index: CommandIndex = self.create_index()
+        self.assertEqual("weather", index.resolve("waether"))
+        self.assertEqual("quote", index.resolve("qoute"))
+        self.assertIsNone(index.resolve("xyz"))
+
+    def test_fuzzy_threshold_is_exceeded(self):
+        # fuzz.ratio("abce", "abcd") is exactly 75, fuzz.ratio("abx", "abc") is 66.67 (rounded to 67 by fuzzywuzzy)
+        self.assert_resolves(74, "abce", "abcd", "abcd")
+        self.assert_resolves(75, "abce", "abcd", None)
+        self.assert_resolves(66, "abx", "abc", "abc")
+        self.assert_resolves(67, "abx", "abc", None)
+
+    def test_fuzzy_threshold_without_rapidfuzz(self):
+        with mock.patch.object(command_index, "process", None):
+            self.test_fuzzy_threshold_is_exceeded()
+            self.test_fuzzy_match()
+
+    def test_cache(self):
+        index: CommandIndex = self.create_index()
+        self.assertEqual("weather", index.resolve("waether"))
+        self.assertEqual("weather", index.resolve("waether"))
+        self.assertIsNone(index.resolve("xyz"))
+        self.assertIsNone(index.resolve("xyz"))
+        self.assertEqual((2, 2), (index.cache_hits, index.cache_misses))
+
+    def test_cache_is_invalidated_by_changes(self):
+        index: CommandIndex = self.create_index()
+        self.assertIsNone(index.resolve("xyz"))
+        self.assertEqual("weather", index.resolve("waether"))
+        version: int = index.version
+
+        xyz: PluginCommand = create_command("xyz1")
+        index.add(xyz)
+        self.assertGreater(index.version, version)
+        self.assertEqual("xyz1", index.resolve("xyz"))
+
+        waether: PluginCommand = create_command("waether")
+        index.add(waether)
+        self.assertEqual("waether", index.resolve("waether"))
+
+        index.remove(xyz)
+        index.remove(waether)
+        self.assertIsNone(index.resolve("xyz"))
+        self.assertEqual("weather", index.resolve("waether"))
+
+    def test_commands_of_several_plugins(self):
+        index: CommandIndex = self.create_index()
+        first: PluginCommand = create_command("roll", ["!a"], plugin_name="first")
+        second: PluginCommand = create_command("roll", plugin_name="second")
+        index.add(first)
+        self.assertFalse(index.is_valid_for_room("roll", "!b"))
+
+        with self.assertLogs(command_index.logger, "WARNING"):
+            index.add(second)
+        self.assertIs(second, index.get("roll"))
+        self.assertTrue(index.is_valid_for_room("roll", "!b"))
+
+        index.remove(second)
+        self.assertIs(first, index.get("roll"))
+        self.assertTrue(index.is_valid_for_room("roll", "!a"))
+        self.assertFalse(index.is_valid_for_room("roll", "!b"))
+
+        index.remove(first)
+        self.assertIsNone(index.get("roll"))
+        self.assertTrue(index.is_valid_for_room("roll", "!b"))
@@ -0,0 +1,148 @@
+import datetime
+import unittest
+from typing import Any, Dict
+from unittest import mock
+
+import jsonpickle
+
+from core import data_codec
+from core.data_codec import DataCodec, msgpack, zstandard
+
+
+class Line:
+    def __init__(self, nick: str, message: str):
+        self.nick: str = nick
+        self.message: str = message
+
+    def __eq__(self, other):
+        return type(other) is type(self) and vars(other) == vars(self)
+
+
+class Unregistered(Line):
+    pass
+
+
+VALUE: Dict[str, Any] = {
+    "text": "ünïcode ~ text",
+    "number": 3,
+    "float": 0.5,
+    "flag": True,
+    "none": None,
+    "list": [1, [2, 3]],
+    "tuple": (1, "two"),
+    "set": {1, 2},
+    "datetime": datetime.datetime(2023, 4, 5, 6, 7, 8, 9),
+    "utc": datetime.datetime(2023, 4, 5, tzinfo=datetime.timezone.utc),
+    "date": datetime.date(2023, 4, 5),
+    "timedelta": datetime.timedelta(days=1, seconds=2, microseconds=3),
+    "lines": [Line("nick", "message")],
+}
+"""a value containing every type supported by the compact formats"""
+
+
+class DataCodecTest(unittest.TestCase):
+    """
+    Every stored value has to be readable regardless of the format it has been encoded in and the format currently configured
+    """
+
+    def create_codec(self, data_format: str, compression_threshold: int or None = None) -> DataCodec:
+        codec: DataCodec = DataCodec(data_format, compression_threshold)
+        codec.register_class(Line)
+        return codec
+
+    def assert_round_trip(self, codec: DataCodec, prefix: str, value: Any = VALUE) -> None:
+        encoded: str = codec.encode(value)
+        self.assertTrue(encoded.startswith(prefix), encoded[:20])
+        self.assertEqual(value, codec.decode(encoded))
+        # values are readable by codecs configured for any other format as well
+        other_format: str
+        for other_format in ("jsonpickle", "json"):
+            self.assertEqual(value, self.create_codec(other_format).decode(encoded))
+
+    def test_untagged_jsonpickle(self):
+        codec: DataCodec = self.create_codec("jsonpickle")
+        encoded: str = codec.encode(VALUE)
+        self.assertEqual(VALUE, jsonpickle.decode(encoded))
+        self.assert_round_trip(codec, "{")
+        self.assertTrue(codec.is_current(encoded))
+        self.assertFalse(self.create_codec("json").is_current(encoded))
+
+    def test_json(self):
+        codec: DataCodec = self.create_codec("json")
+        self.assert_round_trip(codec, "~json:")
+        self.assertTrue(codec.is_current(codec.encode(VALUE)))
+
+    def test_json_without_orjson(self):
+        with mock.patch.object(data_codec, "orjson", None):
+            self.assert_round_trip(self.create_codec("json"), "~json:")
+
+    def test_json_stored_format(self):
+        # values stored by earlier versions need to stay readable
+        encoded: str = (
+            '~json:{"t":{"__tuple__":[1,{"__set__":["a"]}]},"d":{"__date__":"2023-04-05"},"o":{"__object__":"Line","state":{"nick":"n","message":"m"}}}'
+        )
+        self.assertEqual({"t": (1, {"a"}), "d": datetime.date(2023, 4, 5), "o": Line("n", "m")}, self.create_codec("jsonpickle").decode(encoded))
+
+    def test_unsupported_values_fall_back_to_jsonpickle(self):
+        codec: DataCodec = self.create_codec("json")
+        value: Any
+        for value in (
+            Unregistered("nick", "message"),
+            {"__set__": "reserved key"},
+            float("nan"),
+            datetime.datetime(2023, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+        ):
+            with self.subTest(value=value):
+                encoded: str = codec.encode(value)
+                self.assertTrue(encoded.startswith("~jsonpickle:"), encoded)
+                self.assertTrue(codec.is_current(encoded))
+                decoded: Any = codec.decode(encoded)
+                # nan is the only value not equal to itself
+                self.assertTrue(decoded == value or decoded != decoded)
+
+    def test_non_string_keys(self):
+        codec: DataCodec = self.create_codec("json")
+        encoded: str = codec.encode({"outer": {1: "int keys"}})
+        self.assertTrue(encoded.startswith("~jsonpickle:"), encoded)
+        # as before the compact formats, jsonpickle stores keys as strings
+        self.assertEqual({"outer": {"1": "int keys"}}, codec.decode(encoded))
+
+    def test_zlib(self):
+        data_format: str
+        with mock.patch.object(data_codec, "zstandard", None):
+            for data_format in ("json", "jsonpickle"):
+                with self.subTest(data_format=data_format):
+                    self.assert_round_trip(self.create_codec(data_format, compression_threshold=16), f"~{data_format}+zlib:")
+
+    def test_compression_threshold(self):
+        codec: DataCodec = self.create_codec("json", compression_threshold=1024)
+        self.assertTrue(codec.encode("short").startswith("~json:"))
+        self.assertNotEqual("~json:", codec.encode("long" * 1024)[:6])
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        data_format: str
+        for data_format in ("json", "jsonpickle"):
+            with self.subTest(data_format=data_format):
+                self.assert_round_trip(self.create_codec(data_format, compression_threshold=16), f"~{data_format}+zstd:")
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        codec: DataCodec = self.create_codec("msgpack")
+        self.assert_round_trip(codec, "~msgpack:")
+        self.assertTrue(codec.is_current(codec.encode(VALUE)))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_zlib(self):
+        with mock.patch.object(data_codec, "zstandard", None):
+            self.assert_round_trip(self.create_codec("msgpack", compression_threshold=16), "~msgpack+zlib:")
+
+    def test_msgpack_missing(self):
+        with mock.patch.object(data_codec, "msgpack", None):
+            self.assertEqual("json", DataCodec("msgpack").data_format)
+            with self.assertRaises(ValueError):
+                DataCodec().decode("~msgpack:gqF0AQ==")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            DataCodec("yaml")
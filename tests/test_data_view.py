@@ -0,0 +1,199 @@
+import copy
+import json
+import unittest
+from collections import namedtuple
+from typing import Any, Dict
+
+from core.data_view import DataView, create_view, get_dirty_keys, is_unmodified_view, unwrap
+
+Pair = namedtuple("Pair", "first second")
+
+
+class Quote:
+    def __init__(self, text: str):
+        self.text: str = text
+        self.tags: list = []
+
+    def tag(self, name: str) -> None:
+        self.tags.append(name)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and vars(other) == vars(self)
+
+
+class DataViewTest(unittest.TestCase):
+    """
+    Views returned by read_data() have to behave like the deep copy read_data() used to return, without copying the data until it is modified
+    """
+
+    def setUp(self):
+        self.stored: Dict[str, Any] = {
+            "list": [1, 2, {"nested": 1}],
+            "dict": {"a": {"b": 1}, "c": 2},
+            "set": {1, 2},
+            "tuple": (1, "two", 3.0),
+            "mutable_tuple": ([1], {"x": 1}),
+            "pair": Pair([1], "2"),
+            "quote": Quote("text"),
+            "names": ["a", "b"],
+        }
+        self.snapshot: Dict[str, Any] = copy.deepcopy(self.stored)
+        self.view: Any = create_view(self.stored)
+
+    def assert_stored_unchanged(self) -> None:
+        self.assertEqual(self.snapshot, self.stored)
+
+    def test_reading_does_not_copy(self):
+        self.assertEqual(self.stored["dict"], self.view["dict"])
+        self.assertEqual("text", self.view["quote"].text)
+        self.assertIs(self.stored, unwrap(self.view))
+        self.assertTrue(is_unmodified_view(self.view, self.stored))
+
+    def test_modifying_copies_path_only(self):
+        self.view["dict"]["a"]["b"] = 2
+        self.view["list"][2]["nested"] = 2
+        self.view["quote"].tag("x")
+
+        self.assert_stored_unchanged()
+        data: Dict[str, Any] = unwrap(self.view)
+        self.assertEqual(2, data["dict"]["a"]["b"])
+        self.assertEqual(2, data["list"][2]["nested"])
+        self.assertEqual(["x"], data["quote"].tags)
+        self.assertIs(self.stored["set"], data["set"])
+        self.assertFalse(is_unmodified_view(self.view, self.stored))
+        self.assertEqual({"dict", "list", "quote"}, get_dirty_keys(self.view, self.stored))
+
+    def test_isinstance(self):
+        self.assertNotIn("__class__", vars(DataView))
+        self.assertIsInstance(self.view, dict)
+        self.assertIsInstance(self.view["list"], list)
+        self.assertIsInstance(self.view["set"], set)
+        self.assertIsInstance(self.view["quote"], Quote)
+        self.assertIsInstance(self.view["quote"], DataView)
+
+    def test_json(self):
+        self.view["list"].append(3)
+        self.view["list"][2]["nested"] = 2
+        self.view["dict"].pop("c")
+        data: Dict[str, Any] = {key: self.view[key] for key in ("list", "dict", "tuple", "names")}
+
+        self.assertEqual(json.dumps({key: unwrap(value) for key, value in data.items()}), json.dumps(data))
+        self.assertEqual('[1, 2, {"nested": 2}, 3]', json.dumps(self.view["list"]))
+        self.assertEqual("a, b", ", ".join(self.view["names"]))
+        self.assert_stored_unchanged()
+
+    def test_tuples(self):
+        immutable: tuple = self.view["tuple"]
+        self.assertIs(self.stored["tuple"], immutable)
+        self.assertEqual(hash(self.stored["tuple"]), hash(immutable))
+        self.assertIs(tuple, type(immutable + (4,)))
+
+        mutable: tuple = self.view["mutable_tuple"]
+        self.assertIs(tuple, type(mutable))
+        mutable[0].append(2)
+        self.assertEqual(([1, 2], {"x": 1}), self.view["mutable_tuple"])
+
+        pair: Pair = self.view["pair"]
+        self.assertIs(Pair, type(pair))
+        pair.first.append(2)
+        self.assertEqual("2", self.view["pair"].second)
+        self.assertEqual(Pair([1, 2], "2"), unwrap(self.view)["pair"])
+        self.assert_stored_unchanged()
+
+    def test_aliases_within_container(self):
+        shared: list = [1]
+        stored: Dict[str, Any] = {"x": shared, "y": shared}
+        view: Any = create_view(stored)
+
+        view["x"].append(2)
+        self.assertIs(view["x"], view["y"])
+        data: Dict[str, Any] = unwrap(view, commit=True)
+        self.assertIs(data["x"], data["y"])
+        self.assertEqual([1, 2], data["y"])
+        self.assertEqual([1], shared)
+
+    def test_aliases_across_containers(self):
+        shared: list = [1]
+        stored: Dict[str, Any] = {"a": {"l": shared}, "b": [shared]}
+        view: Any = create_view(stored)
+
+        self.assertIs(view["a"]["l"], view["b"][0])
+        view["b"][0].append(2)
+        data: Dict[str, Any] = unwrap(view, commit=True)
+        self.assertIs(data["a"]["l"], data["b"][0])
+        self.assertEqual({"a", "b"}, {key for key in data if data[key] is not stored[key]})
+
+    def test_inserted_objects_stay_writable(self):
+        quote: Quote = Quote("new")
+        tags: list = []
+        self.view["new"] = quote
+        self.view["tags"] = tags
+
+        self.view["new"].tag("x")
+        self.view["new"].text = "changed"
+        self.view["tags"].append("y")
+        self.assertEqual(["x"], quote.tags)
+        self.assertEqual("changed", quote.text)
+        self.assertEqual(["y"], tags)
+
+        # once stored, the data is copied again before being modified
+        data: Dict[str, Any] = unwrap(self.view, commit=True)
+        self.view["tags"].append("z")
+        self.assertEqual(["y"], data["tags"])
+
+    def test_commit_only_own_data(self):
+        other_stored: Dict[str, Any] = {"l": [1]}
+        other: Any = create_view(other_stored)
+        other["l"].append(2)
+
+        self.view["other"] = other
+        data: Dict[str, Any] = unwrap(self.view, commit=True)
+        self.assertTrue(is_unmodified_view(self.view, data))
+        self.assertFalse(is_unmodified_view(other, other_stored))
+        self.assertEqual({"l"}, get_dirty_keys(other, other_stored))
+
+        # the other data's copy is now shared, so it is not modified in place anymore
+        other["l"].append(3)
+        self.assertEqual([1, 2], data["other"]["l"])
+        self.assertEqual([1, 2, 3], unwrap(other)["l"])
+
+    def test_list_operations(self):
+        items: list = self.view["list"]
+        items.insert(0, 0)
+        items.extend([4, 5])
+        self.assertEqual(5, items.pop())
+        items.remove(2)
+        items[1:2] = [9]
+        del items[-1]
+        items.reverse()
+
+        self.assertEqual([{"nested": 1}, 9, 0], items)
+        self.assertEqual(unwrap(items), list.copy(items))
+        self.assert_stored_unchanged()
+
+    def test_dict_operations(self):
+        items: dict = self.view["dict"]
+        self.assertEqual(2, items.setdefault("c", 3))
+        items.update({"d": 4}, e=5)
+        self.assertEqual({"b": 1}, items.pop("a"))
+        items |= {"f": 6}
+
+        self.assertEqual({"c": 2, "d": 4, "e": 5, "f": 6}, items)
+        self.assertEqual(unwrap(items), dict(dict.items(items)))
+        self.assertEqual({"dict"}, get_dirty_keys(self.view, self.stored))
+        self.assert_stored_unchanged()
+
+    def test_set_operations(self):
+        items: set = self.view["set"]
+        items.add(3)
+        items.discard(1)
+        self.assertIn(3, items)
+        self.assertEqual({2, 3}, items | set())
+        self.assertEqual({2, 3}, set(iter(set.copy(items))))
+        self.assert_stored_unchanged()
+
+    def test_deepcopy_is_independent(self):
+        data: Dict[str, Any] = copy.deepcopy(self.view)
+        self.assertIs(dict, type(data))
+        data["list"].append(3)
+        self.assertEqual(self.snapshot["list"], self.view["list"])
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from typing import Awaitable, Callable, List
+
+from core.dispatcher import Dispatcher
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Jobs of a room have to run in order without holding up other rooms, and submitting jobs must never wait
+    """
+
+    async def asyncSetUp(self):
+        self.started: List[str] = []
+        self.release: asyncio.Event = asyncio.Event()
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    def create_dispatcher(self, **kwargs) -> Dispatcher:
+        self.dispatcher: Dispatcher = Dispatcher(**kwargs)
+        return self.dispatcher
+
+    def create_job(self, name: str, blocking: bool = False) -> Callable[[], Awaitable]:
+        async def job() -> None:
+            self.started.append(name)
+            if blocking:
+                await self.release.wait()
+
+        return job
+
+    async def wait_until_idle(self) -> None:
+        while self.dispatcher.queued() or self.dispatcher.running:
+            await asyncio.sleep(0.001)
+
+    async def test_room_order(self):
+        dispatcher: Dispatcher = self.create_dispatcher(max_workers=4)
+        index: int
+        for index in range(5):
+            self.assertTrue(dispatcher.submit("!a", self.create_job(f"a{index}")))
+        await self.wait_until_idle()
+        self.assertEqual([f"a{index}" for index in range(5)], self.started)
+        self.assertEqual(5, dispatcher.processed)
+
+    async def test_rooms_run_in_parallel(self):
+        dispatcher: Dispatcher = self.create_dispatcher(max_workers=2)
+        dispatcher.submit("!a", self.create_job("a0", blocking=True))
+        dispatcher.submit("!a", self.create_job("a1"))
+        dispatcher.submit("!b", self.create_job("b0"))
+        await asyncio.sleep(0.01)
+        # the blocked job holds up its own room only
+        self.assertEqual(["a0", "b0"], self.started)
+
+        self.release.set()
+        await self.wait_until_idle()
+        self.assertEqual(["a0", "b0", "a1"], self.started)
+
+    async def test_overflow_is_dropped(self):
+        dispatcher: Dispatcher = self.create_dispatcher(max_workers=1, max_queued_per_room=2)
+        dispatcher.submit("!a", self.create_job("a0", blocking=True))
+        await asyncio.sleep(0.01)
+
+        # submitting returns immediately although the room is busy
+        self.assertTrue(dispatcher.submit("!a", self.create_job("a1")))
+        self.assertTrue(dispatcher.submit("!a", self.create_job("a2")))
+        self.assertFalse(dispatcher.submit("!a", self.create_job("a3")))
+        self.assertTrue(dispatcher.submit("!b", self.create_job("b0")))
+        self.assertEqual(1, dispatcher.dropped)
+        self.assertEqual(1, dispatcher.get_room_stats()["!a"]["dropped"])
+
+        self.release.set()
+        await self.wait_until_idle()
+        self.assertEqual(["a0", "a1", "a2", "b0"], sorted(self.started))
+
+    async def test_max_in_flight(self):
+        dispatcher: Dispatcher = self.create_dispatcher(max_workers=4, max_in_flight=2)
+        room_id: str
+        for room_id in ("!a", "!b", "!c"):
+            dispatcher.submit(room_id, self.create_job(room_id, blocking=True))
+        await asyncio.sleep(0.01)
+        self.assertEqual(["!a", "!b"], self.started)
+        self.assertEqual(2, dispatcher.running)
+        # the waiting job is still queued in its room
+        self.assertEqual(1, dispatcher.queued())
+
+        self.release.set()
+        await self.wait_until_idle()
+        self.assertEqual(["!a", "!b", "!c"], self.started)
+
+    async def test_failed_job(self):
+        async def fail() -> None:
+            raise ValueError("failed")
+
+        dispatcher: Dispatcher = self.create_dispatcher()
+        dispatcher.submit("!a", fail)
+        dispatcher.submit("!a", self.create_job("a1"))
+        await self.wait_until_idle()
+        self.assertEqual(["a1"], self.started)
+        self.assertEqual(1, dispatcher.failed)
+
+
+if __name__ == "__main__":
+    unittest.main()
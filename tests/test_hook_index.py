@@ -0,0 +1,121 @@
+import unittest
+from typing import Dict, List, Tuple
+from unittest import mock
+
+from core.hook_index import HookIndex
+from core.plugin import Plugin, PluginHook
+
+
+async def first(room, event) -> None:
+    pass
+
+
+async def second(room, event) -> None:
+    pass
+
+
+async def third(room, event) -> None:
+    pass
+
+
+class HookIndexTest(unittest.TestCase):
+    """
+    Adding, modifying and removing hooks has to update the index in place, with the same result as rebuilding it
+    """
+
+    def setUp(self):
+        patch = mock.patch.object(Plugin, "_save_state")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.plugins: Dict[str, Plugin] = {name: Plugin(name, "test", "test") for name in ("a", "b")}
+        self.index: HookIndex = HookIndex(self.plugins)
+        plugin: Plugin
+        for plugin in self.plugins.values():
+            plugin._set_hook_index(self.index)
+
+        self.plugins["a"].add_hook("m.room.message", first)
+        self.plugins["b"].add_hook("m.room.message", second, room_id_list=["!a", "!b"], hook_type="dynamic")
+        self.plugins["a"].add_hook("m.reaction", first, event_ids=["$event"], room_id_list=["!a"])
+        # build the index, it is updated from now on
+        self.assertEqual(["first", "second"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual(1, self.index.rebuilds)
+
+    def get_hooks(self, event_type: str, room_id: str, relates_to: str or None = None) -> List[str]:
+        return [hook.method.__name__ for _, hook in self.index.get_hooks(event_type, room_id, relates_to)]
+
+    def assert_same_as_rebuilt(self) -> None:
+        rebuilt: HookIndex = HookIndex(self.plugins)
+        queries: List[Tuple[str, str, str or None]] = [
+            (event_type, room_id, relates_to)
+            for event_type in ("m.room.message", "m.reaction")
+            for room_id in ("!a", "!b", "!c")
+            for relates_to in (None, "$event")
+        ]
+        query: Tuple[str, str, str or None]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(rebuilt.get_hooks(*query), self.index.get_hooks(*query))
+
+    def test_add_hook(self):
+        self.plugins["b"].add_hook("m.room.message", third, room_id_list=["!a"], hook_type="dynamic")
+        self.assertEqual(["first", "second", "third"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual(["first", "second"], self.get_hooks("m.room.message", "!b"))
+
+        self.plugins["b"].add_hook("m.reaction", third)
+        self.assertEqual(["first", "third"], self.get_hooks("m.reaction", "!a", "$event"))
+        self.assertEqual(["third"], self.get_hooks("m.reaction", "!b", "$event"))
+
+        self.assertEqual(1, self.index.rebuilds)
+        self.assertEqual(2, self.index.updates)
+        self.assert_same_as_rebuilt()
+
+    def test_add_rooms_keeps_position(self):
+        self.plugins["a"].add_hook("m.room.message", third, room_id_list=["!b"])
+        self.plugins["b"].add_hook("m.room.message", second, room_id_list=["!c", "!b"], hook_type="dynamic")
+        self.assertEqual(["first", "second"], self.get_hooks("m.room.message", "!c"))
+        # hooks are run in the order of their plugins, then in the order they have been added in
+        self.assertEqual(["first", "third", "second"], self.get_hooks("m.room.message", "!b"))
+        self.assertEqual(1, self.index.rebuilds)
+        self.assert_same_as_rebuilt()
+
+    def test_plugin_loaded_later(self):
+        self.plugins["c"] = Plugin("c", "test", "test")
+        self.plugins["c"].hook_index = self.index
+        self.plugins["c"].add_hook("m.room.message", third)
+        self.assertEqual(["first", "second", "third"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual(2, self.index.rebuilds)
+
+    def test_remove_rooms(self):
+        self.assertTrue(self.plugins["b"].del_hook("m.room.message", second, room_id_list=["!a"]))
+        self.assertEqual(["first"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual(["first", "second"], self.get_hooks("m.room.message", "!b"))
+        self.assertEqual(1, self.index.rebuilds)
+        self.assert_same_as_rebuilt()
+
+    def test_remove_hook(self):
+        self.assertTrue(self.plugins["b"].del_hook("m.room.message", second))
+        self.assertEqual(["first"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual({}, self.index.index["m.room.message"].room_hooks)
+        self.assertEqual(1, self.index.rebuilds)
+        self.assert_same_as_rebuilt()
+
+        # static hooks can not be removed
+        self.assertFalse(self.plugins["a"].del_hook("m.room.message", first))
+        self.assertEqual(["first"], self.get_hooks("m.room.message", "!a"))
+
+    def test_update_of_unknown_hook(self):
+        # hooks never added to a plugin are not indexed
+        self.index.update(self.plugins["a"], PluginHook("m.room.message", third))
+        self.assertEqual(["first", "second"], self.get_hooks("m.room.message", "!a"))
+        self.assert_same_as_rebuilt()
+
+    def test_invalidate(self):
+        self.index.invalidate()
+        self.plugins["b"].add_hook("m.room.message", third, hook_type="dynamic")
+        self.assertEqual(["first", "second", "third"], self.get_hooks("m.room.message", "!a"))
+        self.assertEqual(2, self.index.rebuilds)
+
+
+if __name__ == "__main__":
+    unittest.main()
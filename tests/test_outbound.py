@@ -0,0 +1,130 @@
+import asyncio
+import unittest
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+from aiohttp import ClientConnectionError
+from nio import RoomSendError, RoomSendResponse
+
+from core import outbound
+from core.outbound import PRIORITY_BROADCAST, PRIORITY_REACTION, PRIORITY_REPLY, OutboundQueue, TokenBucket
+
+
+class FakeClient:
+    def __init__(self, *results: Any):
+        """
+        Records the events sent, answering them with the given results in turn (exceptions are raised) and with success afterwards
+        """
+
+        self.results: List[Any] = list(results)
+        self.sent: List[Tuple[str, str, Dict[str, Any], str]] = []
+
+    async def room_send(self, room_id: str, message_type: str, content: Dict[str, Any], tx_id: str, ignore_unverified_devices: bool):
+        self.sent.append((room_id, message_type, content, tx_id))
+        result: Any = self.results.pop(0) if self.results else RoomSendResponse(f"$event{len(self.sent)}", room_id)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst(self):
+        bucket: TokenBucket = TokenBucket(rate=2.0, burst=3)
+        now: float = bucket.updated
+        for _ in range(3):
+            self.assertEqual(now, bucket.available_at(now))
+            bucket.take(now)
+        self.assertEqual(now + 0.5, bucket.available_at(now))
+
+    def test_refill(self):
+        bucket: TokenBucket = TokenBucket(rate=4.0, burst=2)
+        now: float = bucket.updated
+        bucket.take(now)
+        bucket.take(now)
+        self.assertEqual(now + 0.25, bucket.available_at(now + 0.1))
+        self.assertEqual(now + 0.25, bucket.available_at(now + 0.25))
+        # tokens never exceed the burst, however long the bucket has been idle
+        bucket.take(now + 0.25)
+        self.assertEqual(now + 100, bucket.available_at(now + 100))
+        self.assertEqual(2, bucket.tokens)
+
+
+class OutboundQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.patch_delay = mock.patch.object(outbound, "RETRY_DELAY", 0.01)
+        self.patch_delay.start()
+
+    async def asyncTearDown(self):
+        self.patch_delay.stop()
+        await self.queue.close()
+
+    def create_queue(self, **kwargs) -> OutboundQueue:
+        self.queue: OutboundQueue = OutboundQueue(**kwargs)
+        return self.queue
+
+    async def test_priorities(self):
+        # a single event at a time across all rooms, whichever waits with the highest priority is sent next
+        queue: OutboundQueue = self.create_queue(global_rate=200.0, global_burst=1)
+        client: FakeClient = FakeClient()
+        priorities: List[Tuple[str, int]] = [
+            ("!a", PRIORITY_BROADCAST),
+            ("!b", PRIORITY_REACTION),
+            ("!c", PRIORITY_REPLY),
+            ("!d", PRIORITY_BROADCAST),
+            ("!e", PRIORITY_REPLY),
+        ]
+        sends: List[asyncio.Task] = [
+            asyncio.create_task(queue.send(client, room_id, "m.room.message", {"body": room_id}, priority=priority)) for room_id, priority in priorities
+        ]
+        await asyncio.gather(*sends)
+        self.assertEqual(["!c", "!e", "!a", "!d", "!b"], [room_id for room_id, _, _, _ in client.sent])
+
+    async def test_reactions_default_to_lowest_priority(self):
+        queue: OutboundQueue = self.create_queue(global_rate=200.0, global_burst=1)
+        client: FakeClient = FakeClient()
+        sends: List[asyncio.Task] = [
+            asyncio.create_task(queue.send(client, "!a", "m.reaction", {"body": "reaction"})),
+            asyncio.create_task(queue.send(client, "!b", "m.room.message", {"body": "broadcast"}, priority=PRIORITY_BROADCAST)),
+            asyncio.create_task(queue.send(client, "!c", "m.room.message", {"body": "reply"})),
+        ]
+        await asyncio.gather(*sends)
+        self.assertEqual(["reply", "broadcast", "reaction"], [content["body"] for _, _, content, _ in client.sent])
+
+    async def test_room_order(self):
+        queue: OutboundQueue = self.create_queue(room_rate=100.0, room_burst=1)
+        client: FakeClient = FakeClient()
+        await asyncio.gather(*(queue.send(client, "!a", "m.room.message", {"body": index}) for index in range(5)))
+        self.assertEqual(list(range(5)), [content["body"] for _, _, content, _ in client.sent])
+
+    async def test_retry_on_exceptions(self):
+        queue: OutboundQueue = self.create_queue()
+        client: FakeClient = FakeClient(asyncio.TimeoutError(), ClientConnectionError("connection reset"), RoomSendError("unknown", "M_UNKNOWN"))
+        response: RoomSendResponse = await queue.send(client, "!a", "m.room.message", {"body": "text"}, tx_id="txn")
+        self.assertIsInstance(response, RoomSendResponse)
+        # the same transaction id is kept, so the homeserver does not accept the event twice
+        self.assertEqual(["txn"] * 4, [tx_id for _, _, _, tx_id in client.sent])
+        self.assertEqual(3, queue.retried)
+
+    async def test_retries_exhausted(self):
+        queue: OutboundQueue = self.create_queue(max_retries=2)
+        client: FakeClient = FakeClient(*(asyncio.TimeoutError() for _ in range(3)))
+        with self.assertRaises(asyncio.TimeoutError):
+            await queue.send(client, "!a", "m.room.message", {"body": "text"})
+        self.assertEqual(3, len(client.sent))
+        self.assertEqual(1, queue.failed)
+
+        client = FakeClient(*(RoomSendError("unknown", "M_UNKNOWN") for _ in range(3)))
+        self.assertIsInstance(await queue.send(client, "!a", "m.room.message", {"body": "text"}), RoomSendError)
+        self.assertEqual(3, len(client.sent))
+
+    async def test_unexpected_exceptions_are_not_retried(self):
+        queue: OutboundQueue = self.create_queue()
+        client: FakeClient = FakeClient(ValueError("invalid content"))
+        with self.assertRaises(ValueError):
+            await queue.send(client, "!a", "m.room.message", {"body": "text"})
+        self.assertEqual(1, len(client.sent))
+        self.assertEqual(0, queue.retried)
+
+
+if __name__ == "__main__":
+    unittest.main()
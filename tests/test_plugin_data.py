@@ -0,0 +1,261 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from typing import Any, Dict, List, Type
+from unittest import mock
+
+import jsonpickle
+
+from core import plugin_data
+from core.data_codec import DataCodec
+from core.persistence import write_file_atomic
+from core.plugin_data import DataChange, PluginDataBackend, PluginDataJournal, PluginDataStore, create_data_backend
+
+BACKENDS: List[Type[PluginDataBackend]] = [PluginDataStore, PluginDataJournal]
+
+
+class TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd: str = os.getcwd()
+        self.directory: str = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+
+class PluginDataBackendTest(TempDirTest):
+    """
+    Both backends need to persist exactly what has been written, while only writing the entries that actually changed
+    """
+
+    def open(self, backend: Type[PluginDataBackend], codec: DataCodec or None = None) -> PluginDataBackend:
+        store: PluginDataBackend = backend(os.path.join(self.directory, backend.__name__), codec=codec)
+        self.addCleanup(store.close)
+        return store
+
+    def assert_reloaded(self, backend: Type[PluginDataBackend], expected: Dict[str, Any]) -> None:
+        self.assertEqual(expected, self.open(backend).load())
+
+    def spy_changes(self, store: PluginDataBackend) -> List[Dict[str, DataChange]]:
+        """
+        :return: the changes passed to the store's _write_changes() from now on
+        """
+
+        written: List[Dict[str, DataChange]] = []
+        write_changes = store._write_changes
+
+        def record(changes: Dict[str, DataChange]) -> None:
+            written.append(changes)
+            write_changes(changes)
+
+        store._write_changes = record
+        return written
+
+    def test_round_trip(self):
+        backend: Type[PluginDataBackend]
+        for backend in BACKENDS:
+            with self.subTest(backend=backend.__name__):
+                data: Dict[str, Any] = {"split": {"a": [1], "b": {"c": 2}}, "value": [1, 2], "empty": {}, "none": None}
+                store: PluginDataBackend = self.open(backend)
+                self.assertFalse(store.exists())
+                self.assertTrue(store.write(data))
+                self.assertTrue(store.exists())
+                self.assertEqual({"a", "b"}, store.snapshot()[1]["split"].keys())
+                self.assertEqual("dict", store.snapshot()[0]["split"])
+                self.assertEqual("value", store.snapshot()[0]["value"])
+                store.close()
+
+                self.assert_reloaded(backend, data)
+
+    def test_only_changes_are_written(self):
+        backend: Type[PluginDataBackend]
+        for backend in BACKENDS:
+            with self.subTest(backend=backend.__name__):
+                store: PluginDataBackend = self.open(backend)
+                store.write({"d": {"a": 1, "b": 2, "c": 3}, "v": 1})
+                written: List[Dict[str, DataChange]] = self.spy_changes(store)
+
+                self.assertTrue(store.write({"d": {"a": 1, "b": 2, "c": 3}, "v": 1}))
+                self.assertEqual([], written)
+
+                self.assertTrue(store.store("d", {"a": 1, "b": 5, "d": 4}))
+                self.assertEqual({"b": "5", "d": "4"}, written[-1]["d"].changed_entries)
+                self.assertEqual(["c"], written[-1]["d"].removed_entries)
+
+                # with dirty keys, only those are encoded and compared
+                self.assertTrue(store.store("d", {"a": 6, "b": 7, "d": 4}, dirty_keys={"a", "d"}))
+                self.assertEqual({"a": "6"}, written[-1]["d"].changed_entries)
+
+                self.assertTrue(store.store("d", [1]))
+                self.assertEqual("value", written[-1]["d"].kind)
+
+                self.assertTrue(store.clear("v"))
+                self.assertIsNone(written[-1]["v"].kind)
+                store.close()
+
+                self.assert_reloaded(backend, {"d": [1]})
+
+    def test_failed_write_is_written_completely_next_time(self):
+        backend: Type[PluginDataBackend]
+        for backend in BACKENDS:
+            with self.subTest(backend=backend.__name__):
+                store: PluginDataBackend = self.open(backend)
+                store.write({"d": {"a": 1, "b": 2}})
+                with mock.patch.object(store, "_write_changes", side_effect=OSError("disk full")):
+                    self.assertFalse(store.store("d", {"a": 3, "b": 4}, dirty_keys={"a"}))
+                # the stored entries might not match the ones the dirty keys are relative to anymore, so all entries are written
+                self.assertTrue(store.store("d", {"a": 3, "b": 4}, dirty_keys={"b"}))
+                store.close()
+
+                self.assert_reloaded(backend, {"d": {"a": 3, "b": 4}})
+
+    def test_outdated_format_is_migrated(self):
+        backend: Type[PluginDataBackend]
+        for backend in BACKENDS:
+            with self.subTest(backend=backend.__name__):
+                store: PluginDataBackend = self.open(backend)
+                store.write({"d": {"a": (1, 2)}, "v": [1]})
+                store.close()
+
+                store = self.open(backend, DataCodec("json"))
+                self.assertEqual({"d": {"a": (1, 2)}, "v": [1]}, store.load())
+                self.assertEqual({"a": '~json:{"__tuple__":[1,2]}'}, store.snapshot()[1]["d"])
+                self.assertEqual("~json:[1]", store.snapshot()[1]["v"][""])
+                store.close()
+
+    def open_journal(self, compaction_size: int) -> PluginDataJournal:
+        store: PluginDataJournal = PluginDataJournal(os.path.join(self.directory, PluginDataJournal.__name__), compaction_size=compaction_size)
+        self.addCleanup(store.close)
+        return store
+
+    def test_journal_compaction(self):
+        store: PluginDataJournal = self.open_journal(256)
+        index: int
+        for index in range(20):
+            self.assertTrue(store.store("d", {"a": index, "b": "x" * 32}))
+        # compactions run in the background, closing waits for them
+        store.close()
+        self.assertTrue(os.path.isfile(store.snapshot_filename))
+        self.assertEqual(store.journal_size, os.path.getsize(store.filename))
+        self.assert_reloaded(PluginDataJournal, {"d": {"a": 19, "b": "x" * 32}})
+
+        self.assertTrue(store.compact())
+        self.assertEqual(0, os.path.getsize(store.filename))
+        self.assert_reloaded(PluginDataJournal, {"d": {"a": 19, "b": "x" * 32}})
+
+    def test_journal_compaction_does_not_block_writes(self):
+        store: PluginDataJournal = self.open_journal(64)
+        writing: threading.Event = threading.Event()
+        written: threading.Event = threading.Event()
+
+        def write_slowly(filename: str, content: str or bytes) -> None:
+            if filename == store.snapshot_filename:
+                writing.set()
+                written.wait(5)
+            write_file_atomic(filename, content)
+
+        with mock.patch.object(plugin_data, "write_file_atomic", side_effect=write_slowly):
+            self.assertTrue(store.store("d", {"a": 0, "b": "x" * 64}))
+            self.assertTrue(writing.wait(5))
+            # while the snapshot is being written, further changes are appended to the journal
+            self.assertTrue(store.store("d", {"a": 1, "b": "x" * 64}))
+            self.assertTrue(store.store("v", [1]))
+            written.set()
+            self.assertTrue(store.compaction.result(5))
+
+        with open(store.filename, "rb") as file:
+            self.assertEqual(2, len(file.readlines()))
+        self.assert_reloaded(PluginDataJournal, {"d": {"a": 1, "b": "x" * 64}, "v": [1]})
+
+    def test_journal_compaction_interrupted(self):
+        store: PluginDataJournal = self.open_journal(1048576)
+        self.assertTrue(store.store("d", {"a": 0, "b": 1}))
+        self.assertTrue(store.store("d", [2]))
+        self.assertTrue(store.store("d", {"a": 3}))
+        self.assertTrue(store.store("v", 4))
+        self.assertTrue(store.clear("v"))
+        self.assertTrue(store.store("v", 5))
+
+        def fail_journal(filename: str, content: str or bytes) -> None:
+            if filename == store.filename:
+                raise OSError("disk full")
+            write_file_atomic(filename, content)
+
+        # the snapshot has been replaced, the journal has not: all of its records are replayed on top of the snapshot again
+        with mock.patch.object(plugin_data, "write_file_atomic", side_effect=fail_journal):
+            self.assertFalse(store.compact())
+        self.assertTrue(os.path.isfile(store.snapshot_filename))
+        self.assert_reloaded(PluginDataJournal, {"d": {"a": 3}, "v": 5})
+
+    def test_journal_incomplete_record(self):
+        store: PluginDataJournal = PluginDataJournal(os.path.join(self.directory, PluginDataJournal.__name__))
+        store.write({"d": {"a": 1}})
+        with open(store.filename, "ab") as file:
+            file.write(b'{"name": "d", "kind": "dict", "chan')
+
+        store = PluginDataJournal(store.filename)
+        self.assertEqual({"d": {"a": 1}}, store.load())
+        # the incomplete record is dropped before appending to the journal
+        self.assertTrue(store.store("d", {"a": 2}))
+        self.assert_reloaded(PluginDataJournal, {"d": {"a": 2}})
+
+
+class PluginDataMigrationTest(TempDirTest):
+    """
+    Data stored by earlier versions (pickle or jsonpickle files) or by another backend is imported into the configured backend on first load
+    """
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs("plugins/test")
+        self.data: Dict[str, Any] = {"d": {"a": [1, 2], "b": (3, 4)}, "v": "value"}
+
+    def load(self, backend: str = "sqlite") -> Dict[str, Any]:
+        from core.plugin import Plugin
+
+        plugin: Plugin = Plugin("test", "test", "test")
+        plugin.data_store = create_data_backend(backend, plugin.basepath, codec=plugin.data_codec)
+        self.addCleanup(plugin.data_store.close)
+        return plugin._load_data_from_file()
+
+    def assert_migrated(self, backend: str = "sqlite") -> None:
+        store: PluginDataBackend = create_data_backend(backend, "plugins/test/test")
+        self.addCleanup(store.close)
+        self.assertTrue(store.exists())
+        self.assertEqual(self.data, store.load())
+
+    def test_pickle(self):
+        with open("plugins/test/test.pkl", "wb") as file:
+            pickle.dump(self.data, file)
+
+        self.assertEqual(self.data, self.load())
+        self.assert_migrated()
+        self.assertEqual(self.data, self.load())
+
+    def test_jsonpickle(self):
+        with open("plugins/test/test.json", "w") as file:
+            file.write(jsonpickle.encode(self.data))
+        with open("plugins/test/test.pkl", "wb") as file:
+            pickle.dump({"outdated": True}, file)
+
+        self.assertEqual(self.data, self.load())
+        self.assert_migrated()
+
+    def test_other_backend(self):
+        backend: str
+        other: str
+        for backend, other in (("sqlite", "journal"), ("journal", "sqlite")):
+            with self.subTest(backend=backend):
+                store: PluginDataBackend = create_data_backend(other, "plugins/test/test")
+                store.write(self.data)
+                store.close()
+
+                self.assertEqual(self.data, self.load(backend))
+                self.assert_migrated(backend)
+                shutil.rmtree("plugins/test")
+                os.makedirs("plugins/test")
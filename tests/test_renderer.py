@@ -0,0 +1,45 @@
+import os
+import unittest
+from typing import List
+
+from core.renderer import CmarkgfmRenderer, CommonmarkRenderer, MarkdownRenderer, cmarkgfm
+
+GOLDEN_DIR: str = os.path.join(os.path.dirname(__file__), "golden", "renderer")
+"""messages sent by plugins (<name>.md) along with the HTML commonmark-py renders them to (<name>.html)"""
+
+
+def read_golden(filename: str) -> str:
+    """
+    :param filename: name of the file within GOLDEN_DIR
+    :return: the file's content, line endings and trailing whitespace preserved
+    """
+
+    with open(os.path.join(GOLDEN_DIR, filename), encoding="utf-8", newline="") as file:
+        return file.read()
+
+
+class RendererGoldenTest(unittest.TestCase):
+    """
+    All renderers need to produce exactly the HTML clients received before renderers became configurable, so switching the renderer does not
+    change how plugins' messages are displayed
+    """
+
+    names: List[str] = sorted(filename[:-3] for filename in os.listdir(GOLDEN_DIR) if filename.endswith(".md"))
+
+    def assert_golden(self, renderer: MarkdownRenderer) -> None:
+        self.assertTrue(self.names)
+        name: str
+        for name in self.names:
+            with self.subTest(renderer=renderer.name, message=name):
+                self.assertEqual(read_golden(f"{name}.html"), renderer.render(read_golden(f"{name}.md")))
+
+    def test_commonmark(self):
+        self.assert_golden(CommonmarkRenderer())
+
+    @unittest.skipIf(cmarkgfm is None, "cmarkgfm is not installed")
+    def test_cmarkgfm(self):
+        self.assert_golden(CmarkgfmRenderer())
+
+
+if __name__ == "__main__":
+    unittest.main()
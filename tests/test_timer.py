@@ -0,0 +1,175 @@
+import datetime
+import unittest
+from typing import List
+
+from core.timer import MISFIRE_GRACE, CronSchedule, Timer, parse_schedule, zoneinfo
+
+
+def next_runs(expression: str, after: datetime.datetime, count: int) -> List[datetime.datetime]:
+    """
+    :return: the next count times the schedule fires after the given time
+    """
+
+    schedule: CronSchedule = parse_schedule(expression)
+    runs: List[datetime.datetime] = []
+    for _ in range(count):
+        after = schedule.next_after(after)
+        runs.append(after)
+    return runs
+
+
+async def do_nothing(client) -> None:
+    pass
+
+
+class CronScheduleTest(unittest.TestCase):
+    """
+    Schedules have to fire exactly when cron would
+    """
+
+    start: datetime.datetime = datetime.datetime(2023, 5, 1, 10, 7, 30)
+    """a monday"""
+
+    def test_fields(self):
+        schedule: CronSchedule = CronSchedule("0-30/10,45 */6 1,15 1-3 *")
+        self.assertEqual([0, 10, 20, 30, 45], schedule.minutes)
+        self.assertEqual([0, 6, 12, 18], schedule.hours)
+        self.assertEqual({1, 15}, schedule.days)
+        self.assertEqual({1, 2, 3}, schedule.months)
+        self.assertEqual(set(range(7)), schedule.weekdays)
+        self.assertEqual({0, 5}, CronSchedule("* * * * 5/7").weekdays | CronSchedule("* * * * 0").weekdays)
+
+    def test_ranges_and_steps(self):
+        self.assertEqual(
+            [datetime.datetime(2023, 5, 1, 10, minute) for minute in (10, 20, 30)] + [datetime.datetime(2023, 5, 1, 11, 0)],
+            next_runs("0-30/10 * * * *", self.start, 4),
+        )
+        self.assertEqual(
+            [datetime.datetime(2023, 5, 1, 12, 0), datetime.datetime(2023, 5, 1, 18, 0), datetime.datetime(2023, 5, 2, 0, 0)],
+            next_runs("0 */6 * * *", self.start, 3),
+        )
+        self.assertEqual([datetime.datetime(2023, 5, 1, 10, 45), datetime.datetime(2023, 5, 1, 11, 45)], next_runs("45 * * * *", self.start, 2))
+
+    def test_next_after_is_exclusive(self):
+        self.assertEqual(datetime.datetime(2023, 5, 1, 10, 8), CronSchedule("* * * * *").next_after(datetime.datetime(2023, 5, 1, 10, 7)))
+        self.assertEqual(datetime.datetime(2023, 5, 2, 10, 7), CronSchedule("7 10 * * *").next_after(datetime.datetime(2023, 5, 1, 10, 7)))
+
+    def test_weekdays(self):
+        # 0 and 7 are both sunday
+        sundays: List[datetime.datetime] = [datetime.datetime(2023, 5, 7), datetime.datetime(2023, 5, 14)]
+        self.assertEqual(sundays, next_runs("0 0 * * 0", self.start, 2))
+        self.assertEqual(sundays, next_runs("0 0 * * 7", self.start, 2))
+        self.assertEqual(
+            [datetime.datetime(2023, 5, day, 8, 30) for day in (2, 3, 4, 5, 8)],
+            next_runs("30 8 * * 1-5", self.start, 5),
+        )
+
+    def test_day_of_month_or_day_of_week(self):
+        # if both are restricted, either one matching is enough
+        self.assertEqual(
+            [datetime.datetime(2023, 5, day) for day in (5, 12, 13, 19, 26)],
+            next_runs("0 0 13 * 5", self.start, 5),
+        )
+        # otherwise, only the restricted one is considered
+        self.assertEqual([datetime.datetime(2023, 5, 13), datetime.datetime(2023, 6, 13)], next_runs("0 0 13 * *", self.start, 2))
+        self.assertEqual([datetime.datetime(2023, 5, 5), datetime.datetime(2023, 5, 12)], next_runs("0 0 * * 5", self.start, 2))
+
+    def test_rare_days(self):
+        self.assertEqual([datetime.datetime(2024, 2, 29), datetime.datetime(2028, 2, 29)], next_runs("0 0 29 2 *", self.start, 2))
+        self.assertEqual([datetime.datetime(2023, 5, 31), datetime.datetime(2023, 7, 31)], next_runs("0 0 31 * *", self.start, 2))
+
+    def test_named_frequencies(self):
+        self.assertEqual(datetime.datetime(2023, 5, 1, 11, 0), parse_schedule("hourly").next_after(self.start))
+        self.assertEqual(datetime.datetime(2023, 5, 2, 0, 0), parse_schedule("daily").next_after(self.start))
+        self.assertEqual(datetime.datetime(2023, 5, 8, 0, 0), parse_schedule("weekly").next_after(self.start))
+        self.assertEqual(datetime.datetime(2023, 5, 1, 10, 8), parse_schedule("at 10:08").next_after(self.start))
+        self.assertEqual(datetime.datetime(2023, 5, 2, 9, 5), parse_schedule("at 9:05").next_after(self.start))
+
+    def test_invalid(self):
+        frequency: str
+        for frequency in ("* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8", "5-1 * * * *", "*/0 * * * *", "a * * * *"):
+            with self.subTest(frequency=frequency), self.assertRaises(ValueError):
+                parse_schedule(frequency)
+        with self.assertRaises(ValueError):
+            parse_schedule("at 25:00")
+        with self.assertRaises(ValueError):
+            parse_schedule("0 0 31 2 *")
+
+    @unittest.skipIf(zoneinfo is None, "timezones require python 3.9 or later")
+    def test_daylight_saving_time(self):
+        # times within the gap or fold of a change never compare equal to times in other timezones, so runs are compared in UTC
+        berlin: datetime.tzinfo = zoneinfo.ZoneInfo("Europe/Berlin")
+        utc: datetime.timezone = datetime.timezone.utc
+        schedule: CronSchedule = CronSchedule("30 2 * * *")
+
+        # 02:30 does not exist when clocks are put forward, the run is at 03:30 summer time instead
+        spring: List[datetime.datetime] = next_runs("30 2 * * *", datetime.datetime(2023, 3, 25, 12, 0, tzinfo=berlin), 2)
+        self.assertEqual(
+            [datetime.datetime(2023, 3, 26, 1, 30, tzinfo=utc), datetime.datetime(2023, 3, 27, 0, 30, tzinfo=utc)], [run.astimezone(utc) for run in spring]
+        )
+
+        # 02:30 exists twice when clocks are put back, the run is at the first one only
+        autumn: datetime.datetime = schedule.next_after(datetime.datetime(2023, 10, 29, 0, 0, tzinfo=berlin))
+        self.assertEqual(datetime.datetime(2023, 10, 29, 0, 30, tzinfo=utc), autumn.astimezone(utc))
+        self.assertEqual(datetime.datetime(2023, 10, 30, 1, 30, tzinfo=utc), schedule.next_after(autumn).astimezone(utc))
+
+
+class TimerTest(unittest.TestCase):
+    """
+    Timers are due according to their frequency and timezone, runs missed while the bot was not running are handled according to the timer's
+    misfire policy
+    """
+
+    @unittest.skipIf(zoneinfo is None, "timezones require python 3.9 or later")
+    def test_timezone(self):
+        def local(hour: int, minute: int = 0) -> datetime.datetime:
+            # timers keep local times, whichever timezone the system is in
+            return datetime.datetime(2023, 3, 26, hour, minute, tzinfo=datetime.timezone.utc).astimezone().replace(tzinfo=None)
+
+        timer: Timer = Timer("test", do_nothing, "0 * * * *", last_execution=local(0, 30), timezone="Europe/Berlin")
+        runs: List[datetime.datetime] = []
+        for _ in range(3):
+            runs.append(timer.next_due())
+            timer.last_execution = runs[-1]
+        # hourly runs stay an hour apart while clocks are put forward at 01:00 UTC
+        self.assertEqual([local(1), local(2), local(3)], runs)
+
+    def test_skip(self):
+        now: datetime.datetime = datetime.datetime.now()
+        # a year of missed runs every minute
+        timer: Timer = Timer("test", do_nothing, "* * * * *", last_execution=now - datetime.timedelta(days=365), misfire="skip")
+        due: datetime.datetime = timer.next_due()
+        self.assertLessEqual(now - MISFIRE_GRACE, due)
+        self.assertLessEqual(due, datetime.datetime.now() - MISFIRE_GRACE + datetime.timedelta(minutes=1))
+        self.assertEqual((0, 0), (due.second, due.microsecond))
+
+    def test_skip_interval(self):
+        now: datetime.datetime = datetime.datetime.now()
+        last_execution: datetime.datetime = now - datetime.timedelta(days=365)
+        interval: datetime.timedelta = datetime.timedelta(seconds=7)
+        timer: Timer = Timer("test", do_nothing, interval, last_execution=last_execution, misfire="skip")
+        due: datetime.datetime = timer.next_due()
+        self.assertLessEqual(now - MISFIRE_GRACE, due)
+        self.assertLess(due, datetime.datetime.now() - MISFIRE_GRACE + interval)
+        # the interval is continued from the last execution
+        self.assertEqual(datetime.timedelta(0), (due - last_execution) % interval)
+
+    def test_skip_within_grace(self):
+        last_execution: datetime.datetime = datetime.datetime.now() - datetime.timedelta(seconds=40)
+        timer: Timer = Timer("test", do_nothing, datetime.timedelta(seconds=30), last_execution=last_execution, misfire="skip")
+        self.assertEqual(last_execution + datetime.timedelta(seconds=30), timer.next_due())
+
+    def test_run_once(self):
+        last_execution: datetime.datetime = datetime.datetime(2023, 5, 1, 10, 7, 30)
+        timer: Timer = Timer("test", do_nothing, "0 * * * *", last_execution=last_execution)
+        self.assertEqual(datetime.datetime(2023, 5, 1, 11, 0), timer.next_due())
+
+    def test_catch_up(self):
+        last_execution: datetime.datetime = datetime.datetime(2023, 5, 1, 10, 7, 30)
+        timer: Timer = Timer("test", do_nothing, "0 * * * *", last_execution=last_execution, misfire="catch_up")
+        timer.last_due = datetime.datetime(2023, 5, 1, 9, 0)
+        self.assertEqual(datetime.datetime(2023, 5, 1, 10, 0), timer.next_due())
+
+
+if __name__ == "__main__":
+    unittest.main()